@@ -1,9 +1,10 @@
 from flask import Flask, render_template
-from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 from flask_bootstrap import Bootstrap
 from flask_mail import Mail
 
+from app.engine import SQLAlchemy
+
 
 db = SQLAlchemy()
 login_manager = LoginManager()
@@ -16,14 +17,29 @@ def create_app(env='default'):
 
     from app.config import config
     from app.views import blueprints
-    from app.models import User, AnonymousUser
+    from app.models import AnonymousUser
+    from app import counters  # noqa: keeps the denormalized counters in sync
+    from app.likes import likes
+    from app.mail import mail_queue
+    from app.hashing import hasher
+    from app.cache import page_cache
+    from app.identity import user_cache, load_user
+    from app.images import profile_pictures
+    from app.tokens import tokens
+    from app.instrumentation import instrumentation
+    from app.templating import template_cache
+    from app.permissions import permission_registry
+    from app.feeds import feeds
+    from app.trending import trending
 
     app = Flask(__name__)
     app.config.from_object(config[env])
     config[env].configure(app)
 
-    # set up extensions
-    for ext in (db, login_manager, bootstrap, mailer):
+    # set up extensions, the template cache before anything creates the jinja environment
+    for ext in (template_cache, db, login_manager, bootstrap, mailer, likes, mail_queue, hasher,
+                page_cache, profile_pictures, tokens, instrumentation, permission_registry,
+                feeds, trending):
         ext.init_app(app)
 
     # register blueprints
@@ -36,9 +52,11 @@ def create_app(env='default'):
     login_manager.anonymous_user = AnonymousUser
     login_manager.login_message_category = 'info'
 
+    user_cache.configure(app.config['USER_CACHE_SIZE'], app.config['USER_CACHE_TTL'])
+
     @login_manager.user_loader
     def get_user(uid):
-        return User.query.get(int(uid))
+        return load_user(int(uid))
 
     # error handlers
     @app.errorhandler(401)
@@ -53,6 +71,10 @@ def create_app(env='default'):
     def not_found(error):
         return render_template('errors/404.html', error=error), 404
 
+    @app.errorhandler(413)
+    def too_large(error):
+        return render_template('errors/413.html', error=error), 413
+
     @app.errorhandler(500)
     def server_error(error):
         return render_template('errors/500.html', error=error), 500
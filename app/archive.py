@@ -0,0 +1,61 @@
+from datetime import datetime
+
+from sqlalchemy import event
+
+from . import db
+from .models import Post, Archive
+
+
+archive = Archive.__table__
+
+
+def _count_post(connection, created_at, delta):
+    key = db.and_(archive.c.year == created_at.year, archive.c.month == created_at.month)
+    result = connection.execute(archive.update().where(key).values(post_count=archive.c.post_count + delta))
+    if delta > 0 and result.rowcount == 0:
+        connection.execute(archive.insert().values(
+            year=created_at.year, month=created_at.month, post_count=delta))
+
+
+@event.listens_for(Post, 'after_insert')
+def _archive_post(mapper, connection, post):
+    _count_post(connection, post.created_at, 1)
+
+
+@event.listens_for(Post, 'after_update')
+def _rearchive_post(mapper, connection, post):
+    history = db.inspect(post).attrs.created_at.history
+    if history.deleted and history.added:
+        _count_post(connection, history.deleted[0], -1)
+        _count_post(connection, history.added[0], 1)
+
+
+@event.listens_for(Post, 'before_delete')
+def _unarchive_post(mapper, connection, post):
+    _count_post(connection, post.created_at, -1)
+
+
+def month_range(year, month=None):
+    """Return the [start, end) datetimes covering a month, or the whole year if month is None."""
+    if month is None:
+        return datetime(year, 1, 1), datetime(year + 1, 1, 1)
+    start = datetime(year, month, 1)
+    if month == 12:
+        return start, datetime(year + 1, 1, 1)
+    return start, datetime(year, month + 1, 1)
+
+
+def entries():
+    return Archive.query.filter(Archive.post_count > 0) \
+        .order_by(Archive.year.desc(), Archive.month.desc()).all()
+
+
+def rebuild():
+    """Recount posts per month from scratch."""
+    year = db.cast(db.func.strftime('%Y', Post.created_at), db.Integer)
+    month = db.cast(db.func.strftime('%m', Post.created_at), db.Integer)
+    db.session.execute(archive.delete())
+    db.session.execute(archive.insert().from_select(
+        ['year', 'month', 'post_count'],
+        db.select([year, month, db.func.count()]).where(Post.created_at.isnot(None)).group_by(year, month)))
+    db.session.commit()
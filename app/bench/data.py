@@ -0,0 +1,100 @@
+import random
+from datetime import datetime, timedelta
+
+from .. import db, search, archive, counters
+from ..feeds import feeds
+from ..trending import trending
+from ..hashing import hasher
+from ..models import Role, User, Post, Comment, Permission, users_like_posts, users_like_comments
+
+
+PASSWORD = 'benchmark'
+BATCH_SIZE = 1000
+
+WORDS = ('sky', 'cloud', 'python', 'flask', 'query', 'index', 'cache', 'blog', 'river', 'stone', 'light',
+         'night', 'garden', 'market', 'engine', 'signal', 'paper', 'window', 'winter', 'summer', 'travel')
+
+
+def _text(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize() + '.'
+
+
+def _insert(table, rows):
+    for start in range(0, len(rows), BATCH_SIZE):
+        db.session.execute(table.insert(), rows[start:start + BATCH_SIZE])
+
+
+def _skewed(rng, count, skew):
+    """Pick an index in [0, count) with a Zipf-like preference for low ones."""
+    return min(int(count * rng.random() ** skew), count - 1)
+
+
+def _role_id(name, permissions):
+    role = Role.query.filter_by(name=name).first()
+    if role is None:
+        role = Role(name=name, permissions=permissions)
+        db.session.add(role)
+        db.session.flush()
+    return role.uid
+
+
+def generate(users=100, posts=1000, comments=5000, likes=20000, reply_ratio=0.6, skew=3.0, years=3, seed=0):
+    """Add a synthetic dataset to the configured database and return what was created.
+
+    Posts are spread over the last ``years``. Comments reply to an earlier comment
+    of the same post with probability ``reply_ratio``, building deep threads, and
+    likes and comments favour a few popular posts the larger ``skew`` is. Every
+    generated user logs in with :data:`PASSWORD`.
+    """
+    rng = random.Random(seed)
+    now = datetime.now()
+    role_id = _role_id('user', Permission.LIKE | Permission.COMMENT | Permission.PUBLISH)
+    # hashing once keeps generation fast, every user shares the password anyway
+    password_hash = hasher.hash(PASSWORD)
+    first_user = (db.session.query(db.func.max(User.uid)).scalar() or 0) + 1
+    _insert(User.__table__, [
+        dict(uid=first_user + i, username='bench%d' % (first_user + i), email='bench%d@localhost' % (first_user + i),
+             password_hash=password_hash, activated=True, role_id=role_id, created_at=now, modified_at=now)
+        for i in range(users)])
+    user_ids = list(range(first_user, first_user + users))
+
+    first_post = (db.session.query(db.func.max(Post.uid)).scalar() or 0) + 1
+    span = years * 365 * 24 * 3600
+    created = sorted(now - timedelta(seconds=rng.randrange(span)) for _ in range(posts))
+    _insert(Post.__table__, [
+        dict(uid=first_post + i, title='%s %d' % (_text(rng, 4)[:-1], first_post + i), body=_text(rng, 200),
+             author_id=rng.choice(user_ids), created_at=stamp, modified_at=stamp)
+        for i, stamp in enumerate(created)])
+    # newest posts are the popular ones
+    post_ids = list(range(first_post + posts - 1, first_post - 1, -1))
+
+    first_comment = (db.session.query(db.func.max(Comment.uid)).scalar() or 0) + 1
+    rows, threads = [], {}
+    for uid in range(first_comment, first_comment + comments):
+        post_id = post_ids[_skewed(rng, posts, skew)]
+        thread = threads.setdefault(post_id, [])
+        parent_id = rng.choice(thread[-5:]) if thread and rng.random() < reply_ratio else None
+        rows.append(dict(uid=uid, body=_text(rng, 20), author_id=rng.choice(user_ids), post_id=post_id,
+                         parent_id=parent_id, created_at=now, modified_at=now))
+        thread.append(uid)
+    _insert(Comment.__table__, rows)
+
+    pairs = set()
+    for _ in range(likes):
+        pairs.add((rng.choice(user_ids), post_ids[_skewed(rng, posts, skew)]))
+    _insert(users_like_posts, [dict(user_id=user_id, post_id=post_id) for user_id, post_id in pairs])
+    comment_pairs = set()
+    for _ in range(likes // 4 if comments else 0):
+        comment_pairs.add((rng.choice(user_ids), first_comment + _skewed(rng, comments, skew)))
+    _insert(users_like_comments, [dict(user_id=user_id, comment_id=comment_id)
+                                  for user_id, comment_id in comment_pairs])
+    db.session.commit()
+
+    # the bulk inserts bypassed the mapper events that maintain these
+    search.rebuild_index()
+    archive.rebuild()
+    counters.recount()
+    feeds.rebuild()
+    trending.rebuild()
+    return dict(users=users, posts=posts, comments=comments, post_likes=len(pairs),
+                comment_likes=len(comment_pairs), largest_thread=max(map(len, threads.values())) if threads else 0)
@@ -0,0 +1,201 @@
+import json
+import math
+import platform
+import random
+import re
+import time
+import tracemalloc
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import event
+
+from .. import db
+from ..models import User, Post, Comment
+from .data import PASSWORD
+
+
+MEMORY_SAMPLES = 10
+_CSRF = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"')
+
+
+def _percentile(values, percent):
+    return values[max(int(math.ceil(percent / 100.0 * len(values))) - 1, 0)]
+
+
+def _csrf_token(client, url):
+    return _CSRF.search(client.get(url).get_data(as_text=True)).group(1)
+
+
+class _Session(object):
+    """A logged in test client and the ids the scenarios pick from."""
+
+    def __init__(self, app, seed):
+        self.app = app
+        self.rng = random.Random(seed)
+        with app.app_context():
+            self.username = db.session.query(User.username).filter(User.username.like('bench%')) \
+                .order_by(User.uid).limit(1).scalar()
+            # newest first, the generator makes those the popular ones
+            self.post_ids = [uid for uid, in db.session.query(Post.uid).order_by(Post.created_at.desc())]
+            self.engines = [db.get_engine(app)] + [e for e in [db.get_read_engine(app)] if e is not None]
+        if self.username is None:
+            raise RuntimeError('No benchmark users, run `manage.py bench generate` first.')
+        self.client = app.test_client()
+        self.login(self.client)
+        self.token = _csrf_token(self.client, '/posts/%d' % self.post_ids[0])
+        self.liked = set()
+        self.cursor = None
+
+    def login(self, client):
+        token = _csrf_token(client, '/auth/login')
+        return client.post('/auth/login', data=dict(username=self.username, password=PASSWORD, csrf_token=token))
+
+    def post_id(self):
+        return self.post_ids[min(int(len(self.post_ids) * self.rng.random() ** 3), len(self.post_ids) - 1)]
+
+
+def _index(session):
+    return session.client.get('/')
+
+
+def _index_page(session):
+    # walk down the pages and start over once the end is reached
+    url = '/?after=%s' % session.cursor if session.cursor else '/?after='
+    response = session.client.get(url)
+    match = re.search(r'after=([0-9.]+)', response.get_data(as_text=True))
+    session.cursor = match.group(1) if match else None
+    return response
+
+
+def _search(session):
+    return session.client.get('/?q=%s' % session.rng.choice(('python', 'sky river', 'cache', 'night garden')))
+
+
+def _show(session):
+    return session.client.get('/posts/%d' % session.post_id())
+
+
+def _like(session):
+    post_id = session.post_id()
+    action = 'unlike' if post_id in session.liked else 'like'
+    session.liked.symmetric_difference_update([post_id])
+    return session.client.get('/posts/%d/%s' % (post_id, action))
+
+
+def _comment(session):
+    return session.client.post('/posts/%d/comments' % session.post_id(),
+                               data=dict(body='Benchmark comment', csrf_token=session.token))
+
+
+def _login(session):
+    client = session.app.test_client()
+    token = _csrf_token(client, '/auth/login')
+    started = time.perf_counter()
+    response = client.post('/auth/login', data=dict(username=session.username, password=PASSWORD, csrf_token=token))
+    # only the POST is timed, not fetching the form
+    response.started = started
+    return response
+
+
+SCENARIOS = dict(index=_index, index_page=_index_page, search=_search, show=_show, like=_like,
+                 comment=_comment, login=_login)
+
+
+def _measure(session, scenario, requests, warmup):
+    queries = [0]
+
+    def count(*args):
+        queries[0] += 1
+
+    for _ in range(warmup):
+        scenario(session)
+    timings, counts, statuses = [], [], Counter()
+    for engine in session.engines:
+        event.listen(engine, 'before_cursor_execute', count)
+    try:
+        for _ in range(requests):
+            queries[0] = 0
+            started = time.perf_counter()
+            response = scenario(session)
+            timings.append(time.perf_counter() - getattr(response, 'started', started))
+            counts.append(queries[0])
+            statuses[str(response.status_code)] += 1
+    finally:
+        for engine in session.engines:
+            event.remove(engine, 'before_cursor_execute', count)
+    # tracing slows everything down, measure memory on a separate, smaller run
+    peak = 0
+    for _ in range(min(requests, MEMORY_SAMPLES)):
+        tracemalloc.start()
+        try:
+            scenario(session)
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+        finally:
+            tracemalloc.stop()
+    timings.sort()
+    return dict(
+        requests=requests,
+        mean_ms=1000 * sum(timings) / len(timings),
+        p50_ms=1000 * _percentile(timings, 50),
+        p95_ms=1000 * _percentile(timings, 95),
+        p99_ms=1000 * _percentile(timings, 99),
+        queries=sum(counts) / float(len(counts)),
+        max_queries=max(counts),
+        peak_kib=peak / 1024.0,
+        statuses=dict(statuses))
+
+
+def _run(app, requests, scenarios, warmup, seed):
+    session = _Session(app, seed)
+    results = dict((name, _measure(session, SCENARIOS[name], requests, warmup))
+                   for name in (scenarios or sorted(SCENARIOS)))
+    with app.app_context():
+        return dict(
+            meta=dict(
+                date=datetime.now().isoformat(),
+                python=platform.python_version(),
+                users=db.session.query(db.func.count(User.uid)).scalar(),
+                posts=db.session.query(db.func.count(Post.uid)).scalar(),
+                comments=db.session.query(db.func.count(Comment.uid)).scalar()),
+            endpoints=results)
+
+
+def run(requests=200, scenarios=None, warmup=5, seed=0):
+    """Drive each scenario ``requests`` times through the test client and return the results.
+
+    Needs data from :func:`app.bench.data.generate` in the configured database.
+    """
+    # requests made inside the caller's app context would all share its g
+    with ThreadPoolExecutor(1) as pool:
+        return pool.submit(_run, current_app._get_current_object(), requests, scenarios, warmup, seed).result()
+
+
+def save(result, path):
+    with open(path, 'w') as f:
+        json.dump(result, f, indent=2, sort_keys=True)
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(baseline, current, threshold=0.1):
+    """Return a report line per endpoint and whether any p95 latency or query count
+    grew by more than ``threshold`` over the baseline."""
+    lines, regressed = [], False
+    for name, now in sorted(current['endpoints'].items()):
+        before = baseline['endpoints'].get(name)
+        if before is None:
+            lines.append('%-12s new' % name)
+            continue
+        worse = [metric for metric in ('p95_ms', 'queries')
+                 if now[metric] > before[metric] * (1 + threshold) and now[metric] - before[metric] > 0.5]
+        regressed = regressed or bool(worse)
+        lines.append('%-12s p95 %7.2fms -> %7.2fms  queries %5.1f -> %5.1f%s' % (
+            name, before['p95_ms'], now['p95_ms'], before['queries'], now['queries'],
+            '  REGRESSION (%s)' % ', '.join(worse) if worse else ''))
+    return lines, regressed
@@ -0,0 +1,28 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from werkzeug.security import generate_password_hash
+
+
+def _hash_for(method, seconds):
+    count, deadline = 0, time.time() + seconds
+    while time.time() < deadline:
+        generate_password_hash('correct horse battery staple', method)
+        count += 1
+    return count
+
+
+def run(method, seconds=2.0, processes=None):
+    """Hash on every core for ``seconds`` and report the throughput per core."""
+    processes = processes or os.cpu_count()
+    single = _hash_for(method, seconds)
+    with ProcessPoolExecutor(processes) as pool:
+        total = sum(pool.map(_hash_for, [method] * processes, [seconds] * processes))
+    return dict(
+        method=method,
+        processes=processes,
+        seconds=seconds,
+        single_core_per_second=single / seconds,
+        per_second=total / seconds,
+        per_second_per_core=total / seconds / processes)
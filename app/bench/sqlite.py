@@ -0,0 +1,90 @@
+import os
+import random
+import re
+import shutil
+import tempfile
+import threading
+import time
+
+from sqlalchemy.exc import OperationalError
+
+from .. import create_app, db
+from ..config import ProductionConfig
+from ..models import Role, User, Post
+
+
+def _make_app(path, tuned):
+    app = create_app('testing')
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + path
+    if tuned:
+        ProductionConfig.configure(app)
+    return app
+
+
+def _seed(app, users, posts):
+    with app.app_context():
+        db.create_all()
+        role = Role(name='user', permissions=0xff)
+        db.session.add(role)
+        db.session.add_all(User(username='bench%d' % i, email='bench%d@localhost' % i, password='bench',
+                                activated=True, role=role) for i in range(users))
+        db.session.flush()
+        db.session.add_all(Post(title='Post %d' % i, body='Benchmark post %d' % i, author_id=1)
+                           for i in range(posts))
+        db.session.commit()
+
+
+def _client(app, user, posts, write_ratio, deadline, counts, lock):
+    client = app.test_client()
+    form = client.get('/auth/login').get_data(as_text=True)
+    token = re.search(r'name="csrf_token" type="hidden" value="([^"]+)"', form).group(1)
+    client.post('/auth/login', data=dict(username='bench%d' % user, password='bench', csrf_token=token))
+    liked = set()
+    reads = writes = errors = 0
+    while time.time() < deadline:
+        post_id = random.randint(1, posts)
+        try:
+            if random.random() < write_ratio:
+                action = 'unlike' if post_id in liked else 'like'
+                client.get('/posts/%d/%s' % (post_id, action))
+                liked.symmetric_difference_update([post_id])
+                writes += 1
+            else:
+                client.get('/posts/%d' % post_id if random.random() < 0.5 else '/')
+                reads += 1
+        except OperationalError:
+            errors += 1
+    with lock:
+        counts['reads'] += reads
+        counts['writes'] += writes
+        counts['errors'] += errors
+
+
+def _measure(tuned, threads, seconds, write_ratio, posts):
+    directory = tempfile.mkdtemp(prefix='sky-bench-')
+    try:
+        app = _make_app(os.path.join(directory, 'bench.sqlite3'), tuned)
+        _seed(app, threads, posts)
+        counts, lock = dict(reads=0, writes=0, errors=0), threading.Lock()
+        deadline = time.time() + seconds
+        workers = [threading.Thread(target=_client, args=(app, i, posts, write_ratio, deadline, counts, lock))
+                   for i in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        with app.app_context():
+            db.engine.dispose()
+            reader = db.get_read_engine(app)
+            if reader is not None:
+                reader.dispose()
+        return dict(counts, per_second=(counts['reads'] + counts['writes']) / seconds)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def run(threads=8, seconds=5.0, write_ratio=0.2, posts=50):
+    """Hit post pages and like toggles from ``threads`` logged in clients, first with the
+    default engine settings and then with the production SQLite profile."""
+    return dict((name, _measure(tuned, threads, seconds, write_ratio, posts))
+                for name, tuned in (('default', False), ('tuned', True)))
@@ -0,0 +1,313 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import Markup, current_app, has_app_context, make_response, request, session
+from flask_login import current_user
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from . import db
+from .models import Post, Comment, User
+from .utils import not_modified
+
+
+# response headers cached with a page, those set by @conditional
+_PAGE_HEADERS = frozenset(('ETag', 'Last-Modified', 'Cache-Control', 'Vary'))
+
+
+class TTLCache(object):
+    """A thread safe LRU mapping whose entries also expire ``ttl`` seconds after being set."""
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def configure(self, maxsize, ttl):
+        with self._lock:
+            self.maxsize, self.ttl = maxsize, ttl
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                expires, value = self._data[key]
+            except KeyError:
+                return default
+            if expires < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class NullBackend(object):
+    """Caches nothing, for testing or to switch page caching off."""
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value, timeout, tags=()):
+        pass
+
+    def invalidate(self, tags):
+        pass
+
+    def clear(self):
+        pass
+
+
+class MemoryBackend(object):
+    """A per-process LRU of cached values, indexed by tag for invalidation."""
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._tags = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                self._evict(key)
+                return None
+            self._data.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, timeout, tags=()):
+        with self._lock:
+            if key in self._data:
+                self._evict(key)
+            self._data[key] = (time.time() + timeout, value, tags)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._data) > self.maxsize:
+                self._evict(next(iter(self._data)))
+
+    def _evict(self, key):
+        _, _, tags = self._data.pop(key)
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def invalidate(self, tags):
+        with self._lock:
+            for tag in tags:
+                for key in list(self._tags.get(tag, ())):
+                    self._evict(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._tags.clear()
+
+
+class SQLiteBackend(object):
+    """Cached values shared by every worker process on a host through a SQLite file."""
+
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS cache_entries (key TEXT PRIMARY KEY, value BLOB, expires REAL);
+        CREATE TABLE IF NOT EXISTS cache_tags (tag TEXT, key TEXT, PRIMARY KEY (tag, key)) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS ix_cache_tags_key ON cache_tags (key);
+    '''
+    PURGE_EVERY = 1000
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._sets = 0
+        self._connect().executescript(self.SCHEMA)
+
+    def _connect(self):
+        # sqlite connections must not cross threads or survive a fork
+        if getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return self._local.conn
+
+    def get(self, key):
+        row = self._connect().execute(
+            'SELECT value FROM cache_entries WHERE key = ? AND expires > ?', (key, time.time())).fetchone()
+        return None if row is None else pickle.loads(row[0])
+
+    def set(self, key, value, timeout, tags=()):
+        conn = self._connect()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('INSERT OR REPLACE INTO cache_entries (key, value, expires) VALUES (?, ?, ?)',
+                         (key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), time.time() + timeout))
+            conn.execute('DELETE FROM cache_tags WHERE key = ?', (key,))
+            conn.executemany('INSERT OR IGNORE INTO cache_tags (tag, key) VALUES (?, ?)',
+                             [(tag, key) for tag in tags])
+        self._sets += 1
+        if self._sets % self.PURGE_EVERY == 0:
+            self.purge()
+
+    def invalidate(self, tags):
+        tags = list(tags)
+        if not tags:
+            return
+        marks = ', '.join('?' * len(tags))
+        conn = self._connect()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('DELETE FROM cache_entries WHERE key IN '
+                         '(SELECT key FROM cache_tags WHERE tag IN (%s))' % marks, tags)
+            conn.execute('DELETE FROM cache_tags WHERE tag IN (%s)' % marks, tags)
+
+    def purge(self):
+        """Drop expired entries."""
+        conn = self._connect()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('DELETE FROM cache_tags WHERE key IN '
+                         '(SELECT key FROM cache_entries WHERE expires <= ?)', (time.time(),))
+            conn.execute('DELETE FROM cache_entries WHERE expires <= ?', (time.time(),))
+
+    def clear(self):
+        conn = self._connect()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('DELETE FROM cache_entries')
+            conn.execute('DELETE FROM cache_tags')
+
+
+def invalidate_on_commit(*tags):
+    """Drop cached pages and fragments carrying any of ``tags`` once the session commits."""
+    db.session.info.setdefault('cache_tags', set()).update(tags)
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_tags(session, flush_context):
+    tags = session.info.setdefault('cache_tags', set())
+    for obj in session.new | session.dirty | session.deleted:
+        if isinstance(obj, Post):
+            tags.update(('posts', 'post:%d' % obj.uid))
+        elif isinstance(obj, Comment) and obj.post_id is not None:
+            tags.add('post:%d' % obj.post_id)
+        elif isinstance(obj, User):
+            state = db.inspect(obj)
+            if obj in session.deleted or any(state.attrs[name].history.has_changes()
+                                             for name in ('username', 'bio', 'profile_pic')):
+                tags.update(('users', 'user:%d' % obj.uid))
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_tags(session):
+    tags = session.info.pop('cache_tags', None)
+    if tags and has_app_context() and 'page_cache' in current_app.extensions:
+        current_app.extensions['page_cache'].backend.invalidate(tags)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_tags(session):
+    session.info.pop('cache_tags', None)
+
+
+class PageCache(object):
+    """Caches whole pages for anonymous visitors and template fragments for everyone.
+
+    ``CACHE_BACKEND`` is one of ``memory`` (per process), ``sqlite`` (shared by the workers
+    of a host through ``CACHE_SQLITE_PATH``) or ``null``. Entries carry tags such as
+    ``post:<id>`` and are dropped when a commit touches the matching rows.
+    """
+
+    def __init__(self, app=None):
+        self.backend = NullBackend()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('CACHE_BACKEND', 'memory')
+        app.config.setdefault('CACHE_MAXSIZE', 1024)
+        app.config.setdefault('CACHE_SQLITE_PATH', os.path.realpath('cache.sqlite3'))
+        app.config.setdefault('CACHE_DEFAULT_TIMEOUT', 300)
+        backend = app.config['CACHE_BACKEND']
+        if backend == 'memory':
+            self.backend = MemoryBackend(app.config['CACHE_MAXSIZE'])
+        elif backend == 'sqlite':
+            self.backend = SQLiteBackend(app.config['CACHE_SQLITE_PATH'])
+        else:
+            self.backend = NullBackend()
+        app.extensions['page_cache'] = self
+        app.jinja_env.globals['cached_fragment'] = self.fragment
+
+    def page(self, *tags, **options):
+        """Serve a view from the cache to anonymous visitors.
+
+        Tags may refer to view arguments, e.g. ``post:{post_id}``. The validators set by an
+        inner ``@conditional`` are cached with the body, so conditional requests are
+        answered from the same entry.
+        """
+        def decorator(f):
+            @wraps(f)
+            def wrapper(*args, **kwargs):
+                if (request.method != 'GET' or current_user.is_authenticated or
+                        '_flashes' in session):
+                    return f(*args, **kwargs)
+                key = 'page:anonymous:%s' % request.full_path
+                cached = self.backend.get(key)
+                if cached is not None:
+                    body, status, content_type, headers = cached
+                    rv = current_app.response_class(body, status, headers, content_type=content_type)
+                    etag = rv.get_etag()[0]
+                    if etag is not None and not_modified(etag, rv.last_modified):
+                        rv = current_app.response_class(status=304, headers=headers)
+                    return rv
+                rv = make_response(f(*args, **kwargs))
+                if rv.status_code == 200 and not rv.direct_passthrough:
+                    headers = [(name, value) for name, value in rv.headers if name in _PAGE_HEADERS]
+                    self.backend.set(key, (rv.get_data(), rv.status_code, rv.content_type, headers),
+                                     options.get('timeout') or current_app.config['CACHE_DEFAULT_TIMEOUT'],
+                                     [tag.format(**kwargs) for tag in tags])
+                return rv
+            return wrapper
+        return decorator
+
+    def fragment(self, name, *parts, **options):
+        """Render the body of a ``{% call cached_fragment(name, ...) %}`` block at most once."""
+        caller = options['caller']
+        key = 'fragment:%s:%s' % (name, ':'.join(str(part) for part in parts))
+        html = self.backend.get(key)
+        if html is None:
+            html = caller()
+            self.backend.set(key, str(html), options.get('timeout') or current_app.config['CACHE_DEFAULT_TIMEOUT'],
+                             options.get('tags', ()))
+        return Markup(html)
+
+
+page_cache = PageCache()
@@ -0,0 +1,41 @@
+from collections import defaultdict
+
+from sqlalchemy.orm.attributes import set_committed_value
+
+from . import db
+from .models import Comment
+
+
+class CommentThread(object):
+    """All comments of a post, loaded up front and linked into a tree in memory.
+
+    The whole thread costs a fixed number of queries however deep it goes, the
+    ``comments`` collection of every comment is populated without touching the database.
+    """
+
+    def __init__(self, post_id):
+        comments = Comment.query.filter_by(post_id=post_id) \
+            .options(db.joinedload(Comment.author)) \
+            .order_by(Comment.created_at, Comment.uid).all()
+        replies = defaultdict(list)
+        for comment in comments:
+            replies[comment.parent_id].append(comment)
+        for comment in comments:
+            set_committed_value(comment, 'comments', replies.get(comment.uid, []))
+        self.comments = replies[None]
+
+
+def backfill_post_ids():
+    """Copy root post ids down to replies saved before replies stored them."""
+    comments = Comment.__table__
+    parent = comments.alias('parent')
+    root = db.select([parent.c.post_id]).where(parent.c.uid == comments.c.parent_id)
+    while True:
+        result = db.session.execute(
+            comments.update()
+            .where(db.and_(comments.c.post_id.is_(None),
+                           db.exists(root.where(parent.c.post_id.isnot(None)))))
+            .values(post_id=root.as_scalar()))
+        if not result.rowcount:
+            break
+    db.session.commit()
@@ -6,7 +6,42 @@ class Config(object):
     SECRET_KEY = os.environ.get('SKY_KEY') or 'some random string'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     FILE_UPLOAD_PATH = os.path.realpath('files/profile_pictures')
+    FEEDS_DIR = os.path.realpath('files/feeds')
+    # absolute links in feeds and the sitemap, which are also written outside requests
+    SITE_URL = os.environ.get('SKY_SITE_URL') or 'http://localhost:5000'
     ALLOWED_FILE_EXTENSIONS = ['jpg', 'jpeg', 'png']
+    # requests with a larger body are refused before any of it is read
+    MAX_CONTENT_LENGTH = 5 * 1024 * 1024
+    PROFILE_PIC_MAX_SIZE = 4 * 1024 * 1024
+    PROFILE_PIC_SIZES = (64, 256)
+    PROFILE_PIC_WORKERS = 2
+    POSTS_PER_PAGE = int(os.environ.get('SKY_POSTS_PER_PAGE') or 5)
+    LIKES_WRITE_BEHIND = bool(os.environ.get('SKY_LIKES_WRITE_BEHIND'))
+    LIKES_FLUSH_INTERVAL = 1.0
+    LIKES_BATCH_SIZE = 500
+    USER_CACHE_SIZE = 4096
+    USER_CACHE_TTL = 60
+    # how stale a worker's copy of the role permissions may get
+    PERMISSIONS_CHECK_INTERVAL = 5.0
+    MAIL_QUEUE_WORKERS = 2
+    # set SKY_MAIL_QUEUE_AUTOSTART=0 when mail is sent by a separate `manage.py mail_worker`
+    MAIL_QUEUE_AUTOSTART = os.environ.get('SKY_MAIL_QUEUE_AUTOSTART', '1') == '1'
+    MAIL_QUEUE_BATCH_SIZE = 20
+    MAIL_QUEUE_MAX_ATTEMPTS = 5
+    MAIL_QUEUE_RETRY_DELAY = 30
+    PASSWORD_HASH_METHOD = 'pbkdf2:sha256:150000'
+    PASSWORD_SALT_LENGTH = 8
+    PASSWORD_HASH_WORKERS = os.cpu_count()
+    CACHE_BACKEND = os.environ.get('SKY_CACHE_BACKEND') or 'memory'
+    CACHE_SQLITE_PATH = os.path.realpath('cache.sqlite3')
+    CACHE_DEFAULT_TIMEOUT = 300
+    TRENDING_HALF_LIFE = 12 * 3600
+    # seconds between rebasing the trending scores in process, 0 leaves it to `manage.py decay_trending`
+    TRENDING_DECAY_INTERVAL = int(os.environ.get('SKY_TRENDING_DECAY_INTERVAL') or 0)
+    SQL_SLOW_QUERY_THRESHOLD = 0.25
+    SQL_N_PLUS_ONE_THRESHOLD = 5
+    # compiled templates are kept here when set, fill it with `manage.py compile_templates`
+    TEMPLATE_CACHE_DIR = os.environ.get('SKY_TEMPLATE_CACHE_DIR')
 
     @staticmethod
     def configure(app):
@@ -27,6 +62,7 @@ class DevelopmentConfig(Config):
     MAIL_DEFAULT_SENDER = MAIL_USERNAME
     MAIL_PASSWORD = os.environ.get('SKY_ADMIN_PASSWORD')
     MAIL_SUBJECT_PREFIX = '[Sky Blog] '
+    SQL_STATS_URL = '/_stats/sql'
 
     @staticmethod
     def configure(app):
@@ -37,6 +73,16 @@ class TestingConfig(Config):
 
     TESTING = True
     SQLALCHEMY_DATABASE_URI = 'sqlite:///database-test.sqlite3'
+    # python -m smtpd -n -c DebuggingServer localhost:1025
+    MAIL_SERVER = 'localhost'
+    MAIL_PORT = 1025
+    MAIL_DEFAULT_SENDER = 'sky-blog@localhost'
+    MAIL_SUPPRESS_SEND = os.environ.get('SKY_MAIL_SUPPRESS_SEND', '1') == '1'
+    MAIL_SUBJECT_PREFIX = '[Sky Blog] '
+    PASSWORD_HASH_METHOD = 'pbkdf2:sha256:1000'
+    PASSWORD_HASH_WORKERS = 0
+    CACHE_BACKEND = 'null'
+    PROFILE_PIC_WORKERS = 0
 
     @staticmethod
     def configure(app):
@@ -46,10 +92,33 @@ class TestingConfig(Config):
 class ProductionConfig(Config):
 
     SQLALCHEMY_DATABASE_URI = 'sqlite:///database.sqlite3'
+    PASSWORD_HASH_METHOD = 'pbkdf2:sha256:260000'
+    # shared by every worker process on the host
+    CACHE_BACKEND = os.environ.get('SKY_CACHE_BACKEND') or 'sqlite'
+    # set to the internal nginx location serving FILE_UPLOAD_PATH, e.g. /protected/avatars/
+    PROFILE_PIC_ACCEL_PREFIX = os.environ.get('SKY_PROFILE_PIC_ACCEL_PREFIX')
+    SQL_SERVER_TIMING = bool(os.environ.get('SKY_SERVER_TIMING'))
+    SQL_STATS_URL = os.environ.get('SKY_SQL_STATS_URL')
+    TEMPLATE_CACHE_DIR = os.environ.get('SKY_TEMPLATE_CACHE_DIR') or os.path.realpath('template-cache')
 
     @staticmethod
     def configure(app):
-        pass
+        # WAL lets the read pool run alongside the one writer, NORMAL sync is safe under WAL
+        app.config.update(
+            SQLALCHEMY_POOL_SIZE=int(os.environ.get('SKY_DB_POOL_SIZE') or 5),
+            SQLALCHEMY_MAX_OVERFLOW=5,
+            SQLALCHEMY_POOL_TIMEOUT=10,
+            SQLITE_PRAGMAS=(
+                ('journal_mode', 'wal'),
+                ('synchronous', 'normal'),
+                ('busy_timeout', 5000),
+                ('mmap_size', 256 * 1024 * 1024),
+                ('cache_size', -32000),
+                ('temp_store', 'memory'),
+            ),
+            SQLITE_IMMEDIATE_WRITES=True,
+            SQLITE_READ_POOL_SIZE=int(os.environ.get('SKY_DB_READ_POOL_SIZE') or 10),
+        )
 
 
 config = dict(
@@ -0,0 +1,65 @@
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from . import db
+from .models import Post, Comment, users_like_posts, users_like_comments
+
+
+posts, comments = Post.__table__, Comment.__table__
+
+
+def _bump(connection, table, uid, **deltas):
+    values = dict((name, table.c[name] + delta) for name, delta in deltas.items())
+    connection.execute(table.update().where(table.c.uid == uid).values(**values))
+
+
+def _count_comment(connection, comment, delta):
+    if comment.post_id is not None:
+        _bump(connection, posts, comment.post_id, comment_count=delta)
+    if comment.parent_id is not None:
+        _bump(connection, comments, comment.parent_id, reply_count=delta)
+
+
+@event.listens_for(Comment, 'after_insert')
+def _comment_added(mapper, connection, comment):
+    _count_comment(connection, comment, 1)
+
+
+@event.listens_for(Comment, 'before_delete')
+def _comment_removed(mapper, connection, comment):
+    _count_comment(connection, comment, -1)
+
+
+@event.listens_for(Session, 'after_flush')
+def _count_likes(session, flush_context):
+    """Apply likes added or removed through the ``likes`` collections in the same transaction."""
+    for obj in session.new | session.dirty:
+        if not isinstance(obj, (Post, Comment)):
+            continue
+        history = db.inspect(obj).attrs.likes.history
+        delta = len(history.added or ()) - len(history.deleted or ())
+        if delta:
+            _bump(session.connection(), obj.__table__, obj.uid, like_count=delta)
+
+
+def _count(table, *criteria):
+    return db.select([db.func.count()]).select_from(table).where(db.and_(*criteria)).as_scalar()
+
+
+def recount():
+    """Recompute every counter from the underlying rows, return the number of rows repaired."""
+    replies = comments.alias('replies')
+    post_likes = _count(users_like_posts, users_like_posts.c.post_id == posts.c.uid)
+    post_comments = _count(comments, comments.c.post_id == posts.c.uid)
+    comment_likes = _count(users_like_comments, users_like_comments.c.comment_id == comments.c.uid)
+    comment_replies = _count(replies, replies.c.parent_id == comments.c.uid)
+    repaired = db.session.execute(
+        posts.update()
+        .where(db.or_(posts.c.like_count != post_likes, posts.c.comment_count != post_comments))
+        .values(like_count=post_likes, comment_count=post_comments)).rowcount
+    repaired += db.session.execute(
+        comments.update()
+        .where(db.or_(comments.c.like_count != comment_likes, comments.c.reply_count != comment_replies))
+        .values(like_count=comment_likes, reply_count=comment_replies)).rowcount
+    db.session.commit()
+    return repaired
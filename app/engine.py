@@ -0,0 +1,127 @@
+import threading
+import weakref
+
+import flask_sqlalchemy
+from flask import g, request, current_app, has_app_context
+from flask_sqlalchemy import SignallingSession
+from sqlalchemy import create_engine, event, orm
+from sqlalchemy.pool import QueuePool
+
+
+def _is_sqlite_file(url):
+    return url.drivername.startswith('sqlite') and url.database not in (None, '', ':memory:')
+
+
+def _pragmas_on_connect(pragmas, immediate):
+    def connect(dbapi_connection, connection_record):
+        if immediate:
+            # pysqlite opens a transaction right before the first INSERT, UPDATE or DELETE,
+            # make that BEGIN IMMEDIATE: writers queue on busy_timeout for the lock instead
+            # of failing with SQLITE_BUSY when a deferred read transaction can't be upgraded,
+            # and reads before the first write never hold it
+            dbapi_connection.isolation_level = 'IMMEDIATE'
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas:
+            cursor.execute('PRAGMA %s = %s' % (name, value))
+        cursor.close()
+    return connect
+
+
+def read_only(view):
+    """Mark a view that never writes so its queries are served from the read pool."""
+    view.read_only = True
+    return view
+
+
+class RoutingSession(SignallingSession):
+    """Sends queries made by :func:`read_only` views to the read pool and everything else to the writer."""
+
+    def __init__(self, db, **options):
+        self.db = db
+        super(RoutingSession, self).__init__(db, **options)
+
+    def get_bind(self, mapper=None, clause=None):
+        if not self._flushing and has_app_context() and g.get('db_read_only'):
+            reader = self.db.get_read_engine(self.app)
+            if reader is not None:
+                return reader
+        return super(RoutingSession, self).get_bind(mapper, clause)
+
+
+class SQLAlchemy(flask_sqlalchemy.SQLAlchemy):
+    """Flask-SQLAlchemy with connection tuning for a SQLite database file shared by many threads.
+
+    ``SQLITE_PRAGMAS`` are run on every new connection. Setting ``SQLALCHEMY_POOL_SIZE``
+    keeps connections in a QueuePool shared between threads instead of opening one
+    per checkout. ``SQLITE_IMMEDIATE_WRITES`` opens the transaction on the main engine
+    with BEGIN IMMEDIATE at its first write, so there is a single writer at a time
+    and requests only hold the lock from their first write to their commit.
+    ``SQLITE_READ_POOL_SIZE`` opens a second, query_only pool for :func:`read_only` views.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._tuned = weakref.WeakSet()
+        self._readers = weakref.WeakKeyDictionary()
+        self._tuning_lock = threading.Lock()
+        super(SQLAlchemy, self).__init__(*args, **kwargs)
+
+    def init_app(self, app):
+        app.config.setdefault('SQLITE_PRAGMAS', ())
+        app.config.setdefault('SQLITE_IMMEDIATE_WRITES', False)
+        app.config.setdefault('SQLITE_READ_POOL_SIZE', 0)
+        super(SQLAlchemy, self).init_app(app)
+        app.before_request(self._route_request)
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def apply_driver_hacks(self, app, info, options):
+        rv = super(SQLAlchemy, self).apply_driver_hacks(app, info, options)
+        if _is_sqlite_file(info) and options.get('pool_size'):
+            options['poolclass'] = QueuePool
+            options.setdefault('connect_args', {})['check_same_thread'] = False
+        return rv
+
+    def get_engine(self, app=None, bind=None):
+        engine = super(SQLAlchemy, self).get_engine(app, bind)
+        if engine not in self._tuned:
+            with self._tuning_lock:
+                if engine not in self._tuned:
+                    self._tune(engine, self.get_app(app).config)
+        return engine
+
+    def get_read_engine(self, app=None):
+        """Return the query_only engine of the read pool or None when it is not configured."""
+        app = self.get_app(app)
+        size = app.config['SQLITE_READ_POOL_SIZE']
+        if not size:
+            return None
+        reader = self._readers.get(app)
+        if reader is not None:
+            return reader
+        writer = self.get_engine(app)
+        if not _is_sqlite_file(writer.url):
+            return None
+        with self._tuning_lock:
+            reader = self._readers.get(app)
+            if reader is None:
+                reader = create_engine(writer.url, poolclass=QueuePool, pool_size=size,
+                                       connect_args=dict(check_same_thread=False))
+                self._tune(reader, app.config, read_only=True)
+                self._readers[app] = reader
+        return reader
+
+    def _tune(self, engine, config, read_only=False):
+        self._tuned.add(engine)
+        if not _is_sqlite_file(engine.url):
+            return
+        pragmas = list(config['SQLITE_PRAGMAS'])
+        immediate = config['SQLITE_IMMEDIATE_WRITES'] and not read_only
+        if read_only:
+            pragmas.append(('query_only', 'on'))
+        if pragmas or immediate:
+            event.listen(engine, 'connect', _pragmas_on_connect(pragmas, immediate))
+
+    def _route_request(self):
+        view = current_app.view_functions.get(request.endpoint)
+        g.db_read_only = getattr(view, 'read_only', False)
@@ -0,0 +1,167 @@
+import os
+import tempfile
+from datetime import datetime
+
+from flask import current_app, has_app_context, render_template, url_for
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from . import db
+from .models import Post, User
+
+
+posts, users = Post.__table__, User.__table__
+
+ATOM = 'atom.xml'
+RSS = 'rss.xml'
+SITEMAP_INDEX = 'sitemap.xml'
+SUMMARY_LENGTH = 280
+
+
+def sitemap_name(chunk):
+    return 'sitemap-%d.xml' % chunk
+
+
+def _rfc3339(value):
+    return value.astimezone().isoformat(timespec='seconds')
+
+
+def _rfc822(value):
+    return value.astimezone().strftime('%a, %d %b %Y %H:%M:%S %z')
+
+
+def _summary(body):
+    body = ' '.join(body.split())
+    return body if len(body) <= SUMMARY_LENGTH else body[:SUMMARY_LENGTH].rsplit(' ', 1)[0] + '...'
+
+
+class Feeds(object):
+    """Atom and RSS feeds of the latest posts and a sitemap, kept as static files in ``FEEDS_DIR``.
+
+    Files are rewritten after a commit adds, removes or edits posts, so polling them
+    costs a file read or a 304. The sitemap is split into files of
+    ``SITEMAP_CHUNK_SIZE`` posts by id and only the files holding changed posts are
+    rewritten, along with the index. Links point at ``SITE_URL``.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('FEEDS_DIR', os.path.realpath('files/feeds'))
+        app.config.setdefault('FEED_SIZE', 20)
+        app.config.setdefault('SITEMAP_CHUNK_SIZE', 10000)
+        app.config.setdefault('FEEDS_MAX_AGE', 300)
+        app.config.setdefault('SITE_URL', 'http://localhost:5000')
+        app.config.setdefault('SITE_TITLE', 'Sky Blog')
+        app.extensions['feeds'] = self
+
+    def path(self, name):
+        return os.path.join(current_app.config['FEEDS_DIR'], name)
+
+    def _write(self, name, template, **context):
+        directory = current_app.config['FEEDS_DIR']
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        body = render_template(template, **context).encode('utf-8')
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(body)
+            os.replace(tmp, self.path(name))
+        except Exception:
+            os.remove(tmp)
+            raise
+
+    def _engine(self):
+        # the session can't be used after its commit, read from the pool instead
+        return db.get_read_engine(current_app) or db.get_engine(current_app)
+
+    def write_feeds(self):
+        config = current_app.config
+        rows = self._engine().execute(
+            db.select([posts.c.uid, posts.c.title, posts.c.body, posts.c.created_at, posts.c.modified_at,
+                       users.c.username])
+            .select_from(posts.outerjoin(users, users.c.uid == posts.c.author_id))
+            .order_by(posts.c.created_at.desc(), posts.c.uid.desc()).limit(config['FEED_SIZE'])).fetchall()
+        entries = [dict(url=url_for('posts.show', post_id=row.uid, _external=True), title=row.title,
+                        author=row.username, summary=_summary(row.body),
+                        published=row.created_at or datetime.now(),
+                        updated=row.modified_at or row.created_at or datetime.now())
+                   for row in rows]
+        updated = max([entry['updated'] for entry in entries] or [datetime.now()])
+        context = dict(title=config['SITE_TITLE'], home=url_for('main.index', _external=True), entries=entries,
+                       rfc3339=_rfc3339, rfc822=_rfc822, updated=updated)
+        self._write(ATOM, 'feeds/atom.xml', url=url_for('main.feed', name=ATOM, _external=True), **context)
+        self._write(RSS, 'feeds/rss.xml', url=url_for('main.feed', name=RSS, _external=True), **context)
+
+    def write_sitemap(self, chunks=None):
+        """Rewrite the sitemap files holding ``chunks``, all of them if None, and the index."""
+        size = current_app.config['SITEMAP_CHUNK_SIZE']
+        engine = self._engine()
+        chunk = db.cast(posts.c.uid / size, db.Integer)
+        lastmods = dict(engine.execute(
+            db.select([chunk, db.func.max(posts.c.modified_at)]).group_by(chunk)).fetchall())
+        for number in (lastmods if chunks is None else chunks):
+            rows = engine.execute(db.select([posts.c.uid, posts.c.modified_at])
+                                  .where(posts.c.uid.between(number * size, (number + 1) * size - 1))
+                                  .order_by(posts.c.uid)).fetchall()
+            if not rows:
+                if os.path.exists(self.path(sitemap_name(number))):
+                    os.remove(self.path(sitemap_name(number)))
+                continue
+            self._write(sitemap_name(number), 'feeds/sitemap.xml', rfc3339=_rfc3339, urls=[
+                (url_for('posts.show', post_id=uid, _external=True), modified_at) for uid, modified_at in rows])
+        self._write(SITEMAP_INDEX, 'feeds/sitemap_index.xml', rfc3339=_rfc3339, sitemaps=[
+            (url_for('main.sitemap', chunk=number, _external=True), lastmod)
+            for number, lastmod in sorted(lastmods.items())])
+
+    def _site_context(self):
+        # links are built for SITE_URL whether or not a request is being handled
+        return current_app.test_request_context(base_url=current_app.config['SITE_URL'])
+
+    def update(self, post_ids):
+        """Rewrite the feeds and the sitemap files holding ``post_ids``."""
+        size = current_app.config['SITEMAP_CHUNK_SIZE']
+        with self._site_context():
+            self.write_feeds()
+            self.write_sitemap(set(uid // size for uid in post_ids))
+
+    def rebuild(self):
+        """Rewrite every file, for after bulk changes that bypassed the session."""
+        with self._site_context():
+            self.write_feeds()
+            self.write_sitemap()
+
+
+feeds = Feeds()
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_posts(session, flush_context):
+    changed = session.info.setdefault('feed_posts', set())
+    for obj in session.new | session.deleted:
+        if isinstance(obj, Post):
+            changed.add(obj.uid)
+    for obj in session.dirty:
+        if isinstance(obj, Post):
+            state = db.inspect(obj)
+            if any(state.attrs[name].history.has_changes() for name in ('title', 'body', 'created_at')):
+                changed.add(obj.uid)
+
+
+@event.listens_for(Session, 'after_commit')
+def _write_feeds(session):
+    changed = session.info.pop('feed_posts', None)
+    if changed and has_app_context() and 'feeds' in current_app.extensions:
+        try:
+            feeds.update(changed)
+        except Exception:
+            # the posts are committed already, stale feeds are fixed by the next change or `build_feeds`
+            current_app.logger.exception('Could not update the feeds')
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_posts(session):
+    session.info.pop('feed_posts', None)
@@ -5,8 +5,16 @@ from wtforms import (
     ValidationError, FileField)
 from wtforms.validators import DataRequired, Email, Length, EqualTo
 from flask_login import current_user
+from sqlalchemy import event
 
+from . import db
 from .models import User
+from .cache import TTLCache
+
+
+def equals_ignoring_case(column, value):
+    # lower() on both sides lets SQLite answer from the functional index on the column
+    return db.func.lower(column) == db.func.lower(value)
 
 
 class Exists(object):
@@ -25,9 +33,11 @@ class Exists(object):
         return None
 
     def check(self, value):
-        if self._Model.query.filter(self._column == value).first() is not None:
-            return True  # if a record exists, pass
-        return False  # otherwise, fail
+        return db.session.query(db.exists().where(equals_ignoring_case(self._column, value))).scalar()
+
+    def first(self, value):
+        """The row the check matches, views must look it up the same way the validator did."""
+        return self._Model.query.filter(equals_ignoring_case(self._column, value)).first()
 
 
 class Unique(Exists):
@@ -40,6 +50,30 @@ username_is_unique = Unique(User, 'username', message='This username is taken.')
 email_is_unique = Unique(User, 'email', message='This email is already registered.')
 email_exists = Exists(User, 'email', message='We could not find a user with this email.')
 
+available_fields = dict(username=username_is_unique, email=email_is_unique)
+# values recently found free, as-you-type checks keep asking about the same ones
+availability_cache = TTLCache(4096, 30)
+
+
+def is_available(field, value):
+    """Tell whether no user has ``value`` as their username or email, ignoring case."""
+    key = (field, value.lower())
+    if availability_cache.get(key):
+        return True
+    available = available_fields[field].check(value)
+    if available:
+        availability_cache.set(key, True)
+    return available
+
+
+@event.listens_for(User, 'after_insert')
+@event.listens_for(User, 'after_update')
+def _claim(mapper, connection, user):
+    for field in available_fields:
+        value = getattr(user, field)
+        if value:
+            availability_cache.pop((field, value.lower()))
+
 
 class LoginForm(FlaskForm):
 
@@ -83,7 +117,7 @@ class PasswordResetForm(FlaskForm):
     password = PasswordField('New Password:', validators=[DataRequired()])
     password_2 = PasswordField(
         'Confirm New Password:',
-        validators=[EqualTo('new_password', message='Password do not match.')])
+        validators=[EqualTo('password', message='Password do not match.')])
     submit = SubmitField('Reset Password')
 
 
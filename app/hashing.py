@@ -0,0 +1,56 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from flask import current_app
+from werkzeug.security import generate_password_hash, check_password_hash
+
+
+class PasswordHasher(object):
+    """Runs werkzeug's password hashing in a bounded process pool off the request thread.
+
+    ``PASSWORD_HASH_METHOD`` should spell out the iteration count, e.g.
+    ``pbkdf2:sha256:150000``, so stored hashes can be compared against it and upgraded.
+    ``PASSWORD_HASH_WORKERS`` sizes the pool, 0 hashes inline.
+    """
+
+    def __init__(self, app=None):
+        self._pool = None
+        self._pid = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:150000')
+        app.config.setdefault('PASSWORD_SALT_LENGTH', 8)
+        app.config.setdefault('PASSWORD_HASH_WORKERS', os.cpu_count())
+        app.extensions['password_hasher'] = self
+
+    def _executor(self, workers):
+        with self._lock:
+            # a pool inherited through fork() has no live workers, start a fresh one
+            if self._pool is None or self._pid != os.getpid():
+                self._pool = ProcessPoolExecutor(workers)
+                self._pid = os.getpid()
+            return self._pool
+
+    def _call(self, fn, *args):
+        workers = current_app.config['PASSWORD_HASH_WORKERS']
+        if not workers:
+            return fn(*args)
+        return self._executor(workers).submit(fn, *args).result()
+
+    def hash(self, password):
+        return self._call(generate_password_hash, password, current_app.config['PASSWORD_HASH_METHOD'],
+                          current_app.config['PASSWORD_SALT_LENGTH'])
+
+    def verify(self, pwhash, password):
+        return self._call(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        """Tell whether a stored hash was made with other parameters than the configured ones."""
+        return pwhash.split('$', 1)[0] != current_app.config['PASSWORD_HASH_METHOD']
+
+
+hasher = PasswordHasher()
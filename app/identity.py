@@ -0,0 +1,120 @@
+from flask import current_app, session
+from flask_login import UserMixin, current_user, user_logged_in, user_loaded_from_cookie, user_logged_out
+from sqlalchemy import event
+
+from . import db
+from .cache import TTLCache
+from .models import User, Permission
+from .permissions import permission_registry
+
+
+# uid -> snapshot of the fields needed to resolve identity and permissions
+user_cache = TTLCache()
+
+# built in views that can't be marked with @public
+PUBLIC_ENDPOINTS = frozenset(['static', 'bootstrap.static'])
+# whether the logged in user has activated their account, kept in the session
+ACTIVATED_KEY = '_activated'
+
+
+def public(view):
+    """Mark a view that serves everyone alike, so requests for it never resolve the user."""
+    view.public = True
+    return view
+
+
+def is_public(endpoint):
+    if endpoint in PUBLIC_ENDPOINTS:
+        return True
+    return getattr(current_app.view_functions.get(endpoint), 'public', False)
+
+
+def is_activated():
+    """Whether the logged in user is activated, None if nobody is logged in.
+
+    Answered from the session so the check costs no more than the cached user
+    snapshot. A flag outliving the login, as when session protection drops it or
+    the user is deleted, is discarded.
+    """
+    if not current_user.is_authenticated:
+        session.pop(ACTIVATED_KEY, None)
+        return None
+    if ACTIVATED_KEY not in session:
+        session[ACTIVATED_KEY] = bool(current_user.activated)
+    return session[ACTIVATED_KEY]
+
+
+def set_activated(activated):
+    if activated is None:
+        session.pop(ACTIVATED_KEY, None)
+    else:
+        session[ACTIVATED_KEY] = activated
+
+
+@user_logged_in.connect
+@user_loaded_from_cookie.connect
+def _remember_activation(app, user, **extra):
+    set_activated(bool(user.activated))
+
+
+@user_logged_out.connect
+def _forget_activation(app, user, **extra):
+    set_activated(None)
+
+
+class CachedUser(UserMixin):
+    """Stands in for an authenticated :class:`User` using a cached snapshot.
+
+    Identity checks are answered from the snapshot and permission checks from its
+    role id through the permission registry. Anything else, reads and writes alike,
+    goes to the real row, which is loaded on first use.
+    """
+
+    def __init__(self, snapshot):
+        self.__dict__['_snapshot'] = snapshot
+        self.__dict__['_user'] = None
+
+    @property
+    def user(self):
+        if self._user is None:
+            self.__dict__['_user'] = User.query.get(self._snapshot['uid'])
+        return self._user
+
+    def __getattr__(self, name):
+        if self._user is None and name in self._snapshot:
+            return self._snapshot[name]
+        return getattr(self.user, name)
+
+    def __setattr__(self, name, value):
+        setattr(self.user, name, value)
+
+    @property
+    def is_active(self):
+        return self.activated
+
+    def get_id(self):
+        return str(self._snapshot['uid'])
+
+    def can(self, permission):
+        return permission_registry.can(self._snapshot['role_id'], permission)
+
+    def is_admin(self):
+        return self.can(Permission.ADMINISTRATE)
+
+
+def load_user(uid):
+    snapshot = user_cache.get(uid)
+    if snapshot is None:
+        row = db.session.query(User.uid, User.username, User.activated, User.role_id) \
+            .filter(User.uid == uid).first()
+        if row is None:
+            return None
+        snapshot = dict(zip(('uid', 'username', 'activated', 'role_id'), row))
+        user_cache.set(uid, snapshot)
+    return CachedUser(snapshot)
+
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _forget_user(mapper, connection, user):
+    user_cache.pop(user.uid)
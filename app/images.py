@@ -0,0 +1,143 @@
+import os
+import re
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app, url_for
+
+from .uploads import receive
+
+
+DEFAULT_AVATAR = 'avatar.jpg'
+_DIGEST = re.compile(r'^[0-9a-f]{40}$')
+_THUMBNAIL = re.compile(r'^[0-9a-f]{40}-\d+\.jpg$')
+
+
+def thumbnail_name(digest, size):
+    return '%s-%d.jpg' % (digest, size)
+
+
+def is_thumbnail(filename):
+    return _THUMBNAIL.match(filename) is not None
+
+
+def _write_thumbnails(source, directory, digest, sizes, quality):
+    # Pillow is slow to import and only needed once a picture is uploaded
+    from PIL import Image, ImageOps
+    try:
+        with Image.open(source) as original:
+            # let the JPEG decoder scale down while decoding, no thumbnail needs the full resolution
+            original.draft('RGB', (max(sizes), max(sizes)))
+            image = ImageOps.exif_transpose(original).convert('RGB')
+    finally:
+        os.remove(source)
+    for size in sorted(sizes, reverse=True):
+        path = os.path.join(directory, thumbnail_name(digest, size))
+        if os.path.exists(path):
+            continue
+        thumbnail = ImageOps.fit(image, (size, size), Image.LANCZOS)
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            # saved without exif or icc data, so nothing from the original leaks through
+            with os.fdopen(fd, 'wb') as out:
+                thumbnail.save(out, 'JPEG', quality=quality, optimize=True, progressive=True)
+            os.replace(tmp, path)
+        except Exception:
+            os.remove(tmp)
+            raise
+
+
+def _remove_thumbnails(directory, digest, sizes):
+    for size in sizes:
+        try:
+            os.remove(os.path.join(directory, thumbnail_name(digest, size)))
+        except OSError:
+            pass
+
+
+def _log_failure(logger):
+    def callback(future):
+        if future.exception() is not None:
+            logger.error('Failed to process profile picture', exc_info=future.exception())
+    return callback
+
+
+class ProfilePictures(object):
+    """Turns uploaded profile pictures into square JPEG thumbnails off the request thread.
+
+    Thumbnails are written as ``<digest>-<size>.jpg`` for every size in
+    ``PROFILE_PIC_SIZES``; the digest covers the image bytes and the owner so a
+    filename never points at different content and can be cached forever.
+    ``PROFILE_PIC_WORKERS`` sizes the thread pool, 0 processes inline.
+    """
+
+    def __init__(self, app=None):
+        self._pool = None
+        self._pid = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('PROFILE_PIC_SIZES', (64, 256))
+        app.config.setdefault('PROFILE_PIC_MAX_SIZE', 4 * 1024 * 1024)
+        app.config.setdefault('PROFILE_PIC_QUALITY', 85)
+        app.config.setdefault('PROFILE_PIC_WORKERS', 2)
+        app.config.setdefault('PROFILE_PIC_MAX_AGE', 365 * 24 * 3600)
+        # e.g. /protected/avatars/ to hand the file over to nginx with X-Accel-Redirect
+        app.config.setdefault('PROFILE_PIC_ACCEL_PREFIX', None)
+        app.extensions['profile_pictures'] = self
+        app.add_template_global(self.url, 'avatar_url')
+
+    def _executor(self, workers):
+        with self._lock:
+            if self._pool is None or self._pid != os.getpid():
+                self._pool = ThreadPoolExecutor(workers)
+                self._pid = os.getpid()
+            return self._pool
+
+    def _submit(self, fn, *args):
+        workers = current_app.config['PROFILE_PIC_WORKERS']
+        if not workers:
+            return fn(*args)
+        future = self._executor(workers).submit(fn, *args)
+        future.add_done_callback(_log_failure(current_app.logger))
+        return future
+
+    def save(self, owner_id, stream):
+        """Spool an upload to disk, queue it for processing and return the digest to store on the user.
+
+        Raises ValueError if it is not a JPEG or PNG image and RequestEntityTooLarge
+        if it is over ``PROFILE_PIC_MAX_SIZE`` bytes.
+        """
+        config = current_app.config
+        directory = config['FILE_UPLOAD_PATH']
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        upload = receive(stream, directory, config['PROFILE_PIC_MAX_SIZE'], salt=('%d:' % owner_id).encode())
+        self._submit(_write_thumbnails, upload.path, directory, upload.digest, config['PROFILE_PIC_SIZES'],
+                     config['PROFILE_PIC_QUALITY'])
+        return upload.digest
+
+    def discard(self, digest):
+        if digest and _DIGEST.match(digest):
+            self._submit(_remove_thumbnails, current_app.config['FILE_UPLOAD_PATH'], digest,
+                         current_app.config['PROFILE_PIC_SIZES'])
+
+    def url(self, user, size=64):
+        """URL of the user's picture at the smallest configured size that is at least ``size``."""
+        sizes = sorted(current_app.config['PROFILE_PIC_SIZES'])
+        size = next((s for s in sizes if s >= size), sizes[-1])
+        digest = user.profile_pic
+        if not digest:
+            filename = DEFAULT_AVATAR
+        elif _DIGEST.match(digest):
+            filename = thumbnail_name(digest, size)
+        else:
+            # uploaded before pictures were processed, served as is
+            filename = digest
+        return url_for('auth.profile_picture', filename=filename)
+
+
+profile_pictures = ProfilePictures()
@@ -0,0 +1,152 @@
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+from flask import g, request, current_app, has_app_context, has_request_context, jsonify, abort
+from flask_login import current_user
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+_APP_ROOT = os.path.dirname(os.path.abspath(__file__))
+_SKIPPED = (os.path.abspath(__file__), os.path.join(_APP_ROOT, 'engine.py'))
+# IN lists of different lengths are still the same query
+_PARAMETER_LIST = re.compile(r'\?(?:\s*,\s*\?)+')
+# totals of requests that matched no url rule
+UNMATCHED = '<unmatched>'
+
+
+def statement_shape(statement):
+    return _PARAMETER_LIST.sub('?, ...', statement)
+
+
+def _origin():
+    """Describe the innermost template or application frame that issued the running query."""
+    frame = sys._getframe(1)
+    while frame is not None:
+        template = frame.f_globals.get('__jinja_template__')
+        if template is not None:
+            return '%s:%d' % (template.name, template.get_corresponding_lineno(frame.f_lineno))
+        filename = frame.f_code.co_filename
+        if filename.startswith(_APP_ROOT) and filename not in _SKIPPED:
+            return '%s:%d in %s' % (os.path.relpath(filename, os.path.dirname(_APP_ROOT)),
+                                    frame.f_lineno, frame.f_code.co_name)
+        frame = frame.f_back
+    return None
+
+
+class RequestStats(object):
+    """Queries made while handling one request, grouped by statement shape."""
+
+    def __init__(self, repeat_threshold):
+        self.started = time.perf_counter()
+        self.repeat_threshold = repeat_threshold
+        self.count = 0
+        self.duration = 0.0
+        self.shapes = Counter()
+        self.origins = {}
+
+    def record(self, statement, duration):
+        self.count += 1
+        self.duration += duration
+        shape = statement_shape(statement)
+        self.shapes[shape] += 1
+        # walking the stack is slow, only do it for the query that makes a shape suspicious
+        if self.shapes[shape] == self.repeat_threshold:
+            self.origins[shape] = _origin()
+
+    def suspects(self):
+        """(count, statement, origin) of every shape repeated often enough to be an N+1."""
+        return [(count, shape, self.origins.get(shape)) for shape, count in self.shapes.most_common()
+                if count >= self.repeat_threshold]
+
+
+class Instrumentation(object):
+    """Counts and times the SQL run by each request.
+
+    The totals go out in a ``Server-Timing`` header and statements repeated
+    ``SQL_N_PLUS_ONE_THRESHOLD`` times in one request are logged as probable N+1
+    queries, along with the template line or function that issued them. Queries
+    slower than ``SQL_SLOW_QUERY_THRESHOLD`` seconds are logged wherever they run.
+    Set ``SQL_STATS_URL`` to serve per-endpoint totals to admins.
+    """
+
+    def __init__(self, app=None):
+        self._totals = {}
+        self._lock = threading.Lock()
+        self._listening = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('SQL_INSTRUMENTATION', True)
+        app.config.setdefault('SQL_SLOW_QUERY_THRESHOLD', 0.25)
+        app.config.setdefault('SQL_N_PLUS_ONE_THRESHOLD', 5)
+        app.config.setdefault('SQL_SERVER_TIMING', True)
+        app.config.setdefault('SQL_STATS_URL', None)
+        app.extensions['sql_instrumentation'] = self
+        if not app.config['SQL_INSTRUMENTATION']:
+            return
+        if not self._listening:
+            event.listen(Engine, 'before_cursor_execute', self._before_execute)
+            event.listen(Engine, 'after_cursor_execute', self._after_execute)
+            self._listening = True
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        if app.config['SQL_STATS_URL']:
+            app.add_url_rule(app.config['SQL_STATS_URL'], 'sql_stats', self._stats)
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        # statements on one connection never nest, and one that raises leaves nothing behind
+        conn.info['query_started'] = time.perf_counter()
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        duration = time.perf_counter() - conn.info['query_started']
+        stats = g.get('sql_stats') if has_request_context() else None
+        if stats is not None:
+            stats.record(statement, duration)
+        if has_app_context() and duration >= current_app.config['SQL_SLOW_QUERY_THRESHOLD']:
+            current_app.logger.warning('Slow query (%.1fms) from %s: %s %r',
+                                       duration * 1000, _origin(), statement, parameters)
+
+    def _start(self):
+        g.sql_stats = RequestStats(current_app.config['SQL_N_PLUS_ONE_THRESHOLD'])
+
+    def _finish(self, response):
+        stats = g.pop('sql_stats', None)
+        if stats is None:
+            return response
+        suspects = stats.suspects()
+        for count, shape, origin in suspects:
+            current_app.logger.warning('Probable N+1 in %s: %d queries from %s: %s',
+                                       request.endpoint, count, origin, shape)
+        if current_app.config['SQL_SERVER_TIMING']:
+            response.headers.add('Server-Timing', 'db;dur=%.2f;desc="%d queries"' % (
+                stats.duration * 1000, stats.count))
+            response.headers.add('Server-Timing', 'app;dur=%.2f' % ((time.perf_counter() - stats.started) * 1000))
+        with self._lock:
+            totals = self._totals.setdefault(request.endpoint or UNMATCHED, dict(
+                requests=0, queries=0, max_queries=0, db_ms=0.0, n_plus_one=0, suspects={}))
+            totals['requests'] += 1
+            totals['queries'] += stats.count
+            totals['max_queries'] = max(totals['max_queries'], stats.count)
+            totals['db_ms'] += stats.duration * 1000
+            totals['n_plus_one'] += bool(suspects)
+            for count, shape, origin in suspects:
+                totals['suspects'][shape] = dict(count=count, origin=origin)
+        return response
+
+    def _stats(self):
+        if not current_user.is_admin():
+            abort(403)
+        with self._lock:
+            endpoints = dict((endpoint, dict(totals, suspects=[dict(statement=shape, **suspect)
+                                                               for shape, suspect in totals['suspects'].items()]))
+                             for endpoint, totals in self._totals.items())
+        return jsonify(endpoints=endpoints)
+
+
+instrumentation = Instrumentation()
@@ -0,0 +1,180 @@
+import atexit
+import threading
+from collections import OrderedDict
+
+from flask import current_app
+
+from . import db
+from .cache import invalidate_on_commit
+from .models import Post, Comment, users_like_posts, users_like_comments
+from .trending import trending
+
+
+POST, COMMENT = 'post', 'comment'
+
+
+class _Target(object):
+
+    def __init__(self, table, column, counted):
+        self.table = table
+        self.column = column
+        self.counted = counted
+        # INSERT OR IGNORE ... SELECT only inserts when the liked row exists and skips duplicates
+        self.like = table.insert().prefix_with('OR IGNORE').from_select(
+            ['user_id', column.name],
+            db.select([db.bindparam('b_user'), counted.c.uid]).where(counted.c.uid == db.bindparam('b_entity')))
+        self.unlike = table.delete().where(db.and_(
+            table.c.user_id == db.bindparam('b_user'), column == db.bindparam('b_entity')))
+
+    def bump(self, entity_id, delta):
+        return self.counted.update().where(self.counted.c.uid == entity_id) \
+            .values(like_count=self.counted.c.like_count + delta)
+
+    def post_ids(self, entity_ids):
+        """Ids of the posts whose pages show the given entities."""
+        if 'post_id' not in self.counted.c:
+            return set(entity_ids)
+        return set(post_id for post_id, in db.session.execute(
+            db.select([self.counted.c.post_id]).where(self.counted.c.uid.in_(entity_ids))))
+
+    def like_counts(self, entity_ids):
+        return dict(db.session.execute(db.select([self.counted.c.uid, self.counted.c.like_count])
+                                       .where(self.counted.c.uid.in_(entity_ids))).fetchall())
+
+    def recount(self, entity_ids):
+        count = db.select([db.func.count()]).where(self.column == self.counted.c.uid).as_scalar()
+        return self.counted.update().where(self.counted.c.uid.in_(entity_ids)).values(like_count=count)
+
+
+_targets = {
+    POST: _Target(users_like_posts, users_like_posts.c.post_id, Post.__table__),
+    COMMENT: _Target(users_like_comments, users_like_comments.c.comment_id, Comment.__table__),
+}
+
+
+class _State(object):
+    """The likes an app has buffered and the thread writing them to its database."""
+
+    def __init__(self):
+        self.pending = OrderedDict()
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+
+
+class LikeService(object):
+    """Likes and unlikes posts and comments without loading any collection.
+
+    Each call is a single INSERT OR IGNORE or DELETE on the association table plus a
+    counter update. With ``LIKES_WRITE_BEHIND`` set, calls are buffered in process
+    instead and a background thread writes them in batched transactions every
+    ``LIKES_FLUSH_INTERVAL`` seconds or as soon as ``LIKES_BATCH_SIZE`` are pending.
+    Every app has its own buffer and thread, kept in ``app.extensions['likes']``.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('LIKES_WRITE_BEHIND', False)
+        app.config.setdefault('LIKES_FLUSH_INTERVAL', 1.0)
+        app.config.setdefault('LIKES_BATCH_SIZE', 500)
+        app.extensions['likes'] = _State()
+
+    def like(self, user_id, entity_id, kind=POST):
+        """Like an entity, return whether anything changed or None when the write is deferred."""
+        return self._write(kind, user_id, entity_id, True)
+
+    def unlike(self, user_id, entity_id, kind=POST):
+        return self._write(kind, user_id, entity_id, False)
+
+    def _write(self, kind, user_id, entity_id, liked):
+        if current_app.config['LIKES_WRITE_BEHIND']:
+            return self._buffer(kind, user_id, entity_id, liked)
+        target = _targets[kind]
+        params = dict(b_user=user_id, b_entity=entity_id)
+        changed = db.session.execute(target.like if liked else target.unlike, params).rowcount
+        if changed:
+            db.session.execute(target.bump(entity_id, 1 if liked else -1))
+            if kind == POST:
+                trending.record(entity_id, self._like_weight() * (1 if liked else -1))
+            invalidate_on_commit(*('post:%d' % post_id for post_id in target.post_ids([entity_id])))
+        db.session.commit()
+        return bool(changed)
+
+    def _like_weight(self):
+        return current_app.config['TRENDING_LIKE_WEIGHT']
+
+    def _buffer(self, kind, user_id, entity_id, liked):
+        app = current_app._get_current_object()
+        state = app.extensions['likes']
+        with state.lock:
+            # a later like or unlike by the same user supersedes the pending one
+            state.pending.pop((kind, user_id, entity_id), None)
+            state.pending[(kind, user_id, entity_id)] = liked
+            size = len(state.pending)
+            if state.thread is None:
+                state.thread = threading.Thread(target=self._run, args=(app,), name='likes-flusher')
+                state.thread.daemon = True
+                state.thread.start()
+                atexit.register(self._flush_at_exit, app)
+        if size >= app.config['LIKES_BATCH_SIZE']:
+            state.wakeup.set()
+        return None
+
+    def flush(self):
+        """Write every like and unlike the current app buffered in one transaction, return how
+        many were written."""
+        state = current_app.extensions['likes']
+        with state.lock:
+            pending, state.pending = state.pending, OrderedDict()
+        if not pending:
+            return 0
+        try:
+            for kind, target in _targets.items():
+                likes, unlikes, touched = [], [], set()
+                for (kind_, user_id, entity_id), liked in pending.items():
+                    if kind_ == kind:
+                        (likes if liked else unlikes).append(dict(b_user=user_id, b_entity=entity_id))
+                        touched.add(entity_id)
+                if likes:
+                    db.session.execute(target.like, likes)
+                if unlikes:
+                    db.session.execute(target.unlike, unlikes)
+                if touched:
+                    # trending only hears about the likes that changed a count
+                    before = target.like_counts(touched) if kind == POST else None
+                    db.session.execute(target.recount(touched))
+                    if before is not None:
+                        for post_id, count in target.like_counts(touched).items():
+                            trending.record(post_id, self._like_weight() * (count - before.get(post_id, 0)))
+                    invalidate_on_commit(*('post:%d' % post_id for post_id in target.post_ids(touched)))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            with state.lock:
+                for key, liked in pending.items():
+                    state.pending.setdefault(key, liked)
+            raise
+        return len(pending)
+
+    def _run(self, app):
+        state = app.extensions['likes']
+        with app.app_context():
+            while True:
+                state.wakeup.wait(app.config['LIKES_FLUSH_INTERVAL'])
+                state.wakeup.clear()
+                try:
+                    self.flush()
+                except Exception:
+                    app.logger.exception('Failed to flush buffered likes')
+                finally:
+                    db.session.remove()
+
+    def _flush_at_exit(self, app):
+        with app.app_context():
+            self.flush()
+
+
+likes = LikeService()
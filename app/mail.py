@@ -0,0 +1,183 @@
+import os
+import smtplib
+import socket
+import threading
+from datetime import datetime, timedelta
+
+from flask_mail import Message
+
+from . import db, mailer
+from .models import QueuedMail
+
+
+# errors after which the SMTP connection can no longer be trusted
+CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError)
+
+
+def is_outage(error):
+    """Whether ``error`` means the SMTP server could not be reached rather than that it refused.
+
+    Every SMTPException is an OSError as well, yet an answer such as a refused login or
+    recipient is not an outage and must count against the message's attempts.
+    """
+    return isinstance(error, CONNECTION_ERRORS) or \
+        (isinstance(error, OSError) and not isinstance(error, smtplib.SMTPException))
+
+
+class MailQueue(object):
+    """Outbound mail spooled to the database and sent by a fixed pool of worker threads.
+
+    Every worker keeps one app context for its whole life and one SMTP connection for
+    as long as there are due messages. Failed messages are retried with exponential
+    backoff until ``MAIL_QUEUE_MAX_ATTEMPTS`` is reached, then logged as abandoned.
+    Messages that could not be sent because the server was unreachable are retried
+    every ``MAIL_QUEUE_RETRY_DELAY`` seconds without using up an attempt.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._workers = []
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('MAIL_QUEUE_WORKERS', 2)
+        app.config.setdefault('MAIL_QUEUE_AUTOSTART', True)
+        app.config.setdefault('MAIL_QUEUE_BATCH_SIZE', 20)
+        app.config.setdefault('MAIL_QUEUE_POLL_INTERVAL', 5.0)
+        app.config.setdefault('MAIL_QUEUE_MAX_ATTEMPTS', 5)
+        app.config.setdefault('MAIL_QUEUE_RETRY_DELAY', 30)
+        app.config.setdefault('MAIL_QUEUE_CLAIM_TIMEOUT', 600)
+        app.extensions['mail_queue'] = self
+        self.app = app
+
+    def enqueue(self, recipient, subject, body=None, html=None):
+        db.session.add(QueuedMail(recipient=recipient, subject=subject, body=body, html=html))
+        db.session.commit()
+        if self.app.config['MAIL_QUEUE_AUTOSTART']:
+            self.start()
+        self._wakeup.set()
+
+    def start(self, workers=None):
+        """Start the worker pool unless it is already running."""
+        with self._lock:
+            if self._workers:
+                return
+            self._stopping.clear()
+            for n in range(workers or self.app.config['MAIL_QUEUE_WORKERS']):
+                worker = threading.Thread(target=self._run, name='mail-worker-%d' % n)
+                worker.daemon = True
+                worker.start()
+                self._workers.append(worker)
+
+    def stop(self):
+        with self._lock:
+            workers, self._workers = self._workers, []
+        self._stopping.set()
+        self._wakeup.set()
+        for worker in workers:
+            worker.join()
+
+    def drain(self):
+        """Send every message that is due from the calling thread, return how many were sent."""
+        sent = self._work(self._worker_id())
+        db.session.remove()
+        return sent
+
+    def _worker_id(self):
+        return '%s:%d:%s' % (socket.gethostname(), os.getpid(), threading.current_thread().name)
+
+    def _run(self):
+        worker_id = self._worker_id()
+        with self.app.app_context():
+            while not self._stopping.is_set():
+                try:
+                    sent = self._work(worker_id)
+                except Exception:
+                    sent = 0
+                    self.app.logger.exception('Mail worker %s failed', worker_id)
+                finally:
+                    db.session.remove()
+                if not sent:
+                    self._wakeup.wait(self.app.config['MAIL_QUEUE_POLL_INTERVAL'])
+                    self._wakeup.clear()
+
+    def _claim(self, worker_id):
+        now = datetime.now()
+        stale = now - timedelta(seconds=self.app.config['MAIL_QUEUE_CLAIM_TIMEOUT'])
+        queue = QueuedMail.__table__
+        due = db.select([queue.c.uid]).where(db.and_(
+            queue.c.sent_at.is_(None),
+            queue.c.next_attempt_at <= now,
+            queue.c.attempts < self.app.config['MAIL_QUEUE_MAX_ATTEMPTS'],
+            db.or_(queue.c.claimed_by.is_(None), queue.c.claimed_at < stale),
+        )).order_by(queue.c.next_attempt_at).limit(self.app.config['MAIL_QUEUE_BATCH_SIZE'])
+        claimed = db.session.execute(
+            queue.update().where(queue.c.uid.in_(due)).values(claimed_by=worker_id, claimed_at=now)).rowcount
+        db.session.commit()
+        if not claimed:
+            return []
+        return QueuedMail.query.filter_by(claimed_by=worker_id, claimed_at=now, sent_at=None).all()
+
+    def _work(self, worker_id):
+        batch = self._claim(worker_id)
+        if not batch:
+            return 0
+        sent = 0
+        try:
+            with mailer.connect() as connection:
+                while batch:
+                    sent += self._send(connection, batch)
+                    batch = self._claim(worker_id)
+        except OSError as e:
+            if is_outage(e):
+                self.app.logger.exception('SMTP connection failed, retrying %d messages later', len(batch))
+                for mail in batch:
+                    self._postpone(mail, e)
+            else:
+                # e.g. a refused login, it won't fix itself, so let it end in abandoned mail
+                self.app.logger.exception('SMTP server refused the session, %d messages failed', len(batch))
+                for mail in batch:
+                    self._retry(mail, e)
+            db.session.commit()
+        return sent
+
+    def _postpone(self, mail, error):
+        # the messages are not at fault, an outage of any length must not use up their attempts
+        mail.last_error = str(error)
+        mail.next_attempt_at = datetime.now() + timedelta(seconds=self.app.config['MAIL_QUEUE_RETRY_DELAY'])
+        mail.claimed_by = None
+
+    def _retry(self, mail, error):
+        mail.attempts += 1
+        mail.last_error = str(error)
+        mail.next_attempt_at = datetime.now() + timedelta(
+            seconds=self.app.config['MAIL_QUEUE_RETRY_DELAY'] * 2 ** (mail.attempts - 1))
+        mail.claimed_by = None
+        if mail.attempts >= self.app.config['MAIL_QUEUE_MAX_ATTEMPTS']:
+            self.app.logger.error('Giving up on mail %d to %s after %d attempts: %s',
+                                  mail.uid, mail.recipient, mail.attempts, error)
+
+    def _send(self, connection, batch):
+        sent = 0
+        for mail in list(batch):
+            try:
+                connection.send(Message(subject=mail.subject, recipients=[mail.recipient],
+                                        body=mail.body, html=mail.html))
+            except Exception as e:
+                if is_outage(e):
+                    db.session.commit()
+                    raise
+                self._retry(mail, e)
+            else:
+                mail.sent_at = datetime.now()
+                sent += 1
+            batch.remove(mail)
+        db.session.commit()
+        return sent
+
+
+mail_queue = MailQueue()
@@ -1,44 +1,70 @@
-from datetime import datetime
+from datetime import date, datetime
 
-from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import UserMixin, AnonymousUserMixin
 
 from . import db
+from .hashing import hasher
 
 
 class CCMixin(object):
 
     uid = db.Column(db.Integer, primary_key=True)
     created_at = db.Column(db.DateTime, default=datetime.now)
-    modified_at = db.Column(db.DateTime, default=datetime.now)
+    modified_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now, index=True)
 
 
 class Post(db.Model, CCMixin):
 
     __tablename__ = 'posts'
 
+    # the archive needs the month a post moves out of, load it before a change even when expired
+    created_at = db.column_property(db.Column(db.DateTime, default=datetime.now, index=True), active_history=True)
     title = db.Column(db.String(255), nullable=False, unique=True, index=True)
     body = db.Column(db.Text, nullable=False)
     author_id = db.Column(db.Integer, db.ForeignKey('users.uid'))
     author = db.relationship('User', back_populates='posts')
-    comments = db.relationship('Comment', cascade='all, delete-orphan')
+    comments = db.relationship('Comment', back_populates='post', cascade='all, delete-orphan')
     likes = db.relationship('User', back_populates='liked_posts', secondary='users_like_posts')
+    like_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    comment_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
 
     def __str__(self):
         return '<Post: %s>' % self.title
 
 
+class Archive(db.Model):
+
+    __tablename__ = 'archive'
+
+    year = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    month = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    post_count = db.Column(db.Integer, nullable=False, default=0)
+    # months emptied by deletes are kept at zero so this still records the change
+    modified_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now, index=True)
+
+    @property
+    def date(self):
+        return date(self.year, self.month, 1)
+
+    def __str__(self):
+        return '<Archive: %d-%02d>' % (self.year, self.month)
+
+
 class Comment(db.Model, CCMixin):
 
     __tablename__ = 'comments'
 
     body = db.Column(db.Text, nullable=False)
-    post_id = db.Column(db.Integer, db.ForeignKey('posts.uid'))
+    # replies keep the id of the post at the root of their thread too
+    post_id = db.Column(db.Integer, db.ForeignKey('posts.uid'), index=True)
+    post = db.relationship('Post', back_populates='comments')
     author_id = db.Column(db.Integer, db.ForeignKey('users.uid'), nullable=False)
     author = db.relationship('User', back_populates='comments')
-    parent_id = db.Column(db.Integer, db.ForeignKey('comments.uid'))
+    parent_id = db.Column(db.Integer, db.ForeignKey('comments.uid'), index=True)
     comments = db.relationship('Comment')
     likes = db.relationship('User', back_populates='liked_comments', secondary='users_like_comments')
+    like_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    reply_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
 
     def __str__(self):
         return '<Comment: <Post: %s>>' % self.post.title
@@ -71,7 +97,7 @@ class User(db.Model, UserMixin, CCMixin):
 
     @password.setter
     def password(self, value):
-        self.password_hash = generate_password_hash(value)
+        self.password_hash = hasher.hash(value)
 
     @property
     def is_active(self):
@@ -82,19 +108,26 @@ class User(db.Model, UserMixin, CCMixin):
 
     def verify_password(self, password):
         """ hek user password against the stored hash."""
-        return check_password_hash(self.password_hash, password)
+        return hasher.verify(self.password_hash, password)
 
     # Override
     def get_id(self):
         return str(self.uid)
 
     def can(self, permission):
-        return self.role is not None and (self.role.permissions & permission) == permission
+        # answered by the registry so checks never load the Role row
+        from .permissions import permission_registry
+        return permission_registry.can(self.role_id, permission)
 
     def is_admin(self):
         return self.can(Permission.ADMINISTRATE)
 
 
+# case-insensitive lookups done by the form validators
+db.Index('ix_users_username_lower', db.func.lower(User.username))
+db.Index('ix_users_email_lower', db.func.lower(User.email))
+
+
 class AnonymousUser(AnonymousUserMixin):
 
     def can(self, permission):
@@ -107,7 +140,7 @@ class AnonymousUser(AnonymousUserMixin):
 users_like_posts = db.Table(
     'users_like_posts', db.metadata,
     db.Column('user_id', db.ForeignKey('users.uid'), nullable=False),
-    db.Column('post_id', db.ForeignKey('posts.uid'), nullable=False),
+    db.Column('post_id', db.ForeignKey('posts.uid'), nullable=False, index=True),
     db.UniqueConstraint('user_id', 'post_id')
 )
 
@@ -115,11 +148,66 @@ users_like_posts = db.Table(
 users_like_comments = db.Table(
     'users_like_comments', db.metadata,
     db.Column('user_id', db.ForeignKey('users.uid'), nullable=False),
-    db.Column('comment_id', db.ForeignKey('comments.uid'), nullable=False),
+    db.Column('comment_id', db.ForeignKey('comments.uid'), nullable=False, index=True),
     db.UniqueConstraint('user_id', 'comment_id')
 )
 
 
+class TrendingScore(db.Model):
+
+    __tablename__ = 'trending'
+
+    # decayed to the time in TrendingEpoch, see app.trending
+    post_id = db.Column(db.Integer, db.ForeignKey('posts.uid'), primary_key=True, autoincrement=False)
+    score = db.Column(db.Float, nullable=False, default=0, index=True)
+
+
+class TrendingEpoch(db.Model):
+
+    __tablename__ = 'trending_epoch'
+
+    # a single row, the unix time every score is currently expressed at
+    uid = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    epoch = db.Column(db.Float, nullable=False)
+
+
+class QueuedMail(db.Model, CCMixin):
+
+    __tablename__ = 'mail_queue'
+    __table_args__ = (db.Index('ix_mail_queue_due', 'sent_at', 'next_attempt_at'),)
+
+    recipient = db.Column(db.String(255), nullable=False)
+    subject = db.Column(db.String(255), nullable=False)
+    body = db.Column(db.Text)
+    html = db.Column(db.Text)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    claimed_by = db.Column(db.String(120))
+    claimed_at = db.Column(db.DateTime)
+    sent_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+
+    def __str__(self):
+        return '<QueuedMail: %s>' % self.subject
+
+
+class ConsumedToken(db.Model):
+
+    __tablename__ = 'consumed_tokens'
+
+    digest = db.Column(db.LargeBinary(16), primary_key=True)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+
+class PermissionsVersion(db.Model):
+
+    __tablename__ = 'permissions_version'
+
+    # a single row, bumped whenever a role changes
+    uid = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+
 class Permission(object):
 
     LIKE = 0x01
@@ -146,7 +234,7 @@ class Role(db.Model):
         for name, permissions in dict(
                 user=user,
                 moderator=moderator,
-                admin=admin):
+                admin=admin).items():
             role = cls.query.filter_by(name=name).first()
             if role is None:
                 role = cls(name=name)
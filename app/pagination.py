@@ -0,0 +1,65 @@
+from datetime import datetime
+
+from . import db
+
+
+CURSOR_FORMAT = '%Y%m%d%H%M%S%f'
+
+
+def encode_cursor(created_at, uid):
+    return '%s.%d' % (created_at.strftime(CURSOR_FORMAT), uid)
+
+
+def decode_cursor(cursor):
+    """Return the (created_at, uid) pair a cursor points at or None if it is malformed."""
+    try:
+        stamp, uid = cursor.split('.', 1)
+        return datetime.strptime(stamp, CURSOR_FORMAT), int(uid)
+    except (AttributeError, ValueError):
+        return None
+
+
+class KeysetPage(object):
+
+    def __init__(self, items, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+
+def paginate(query, model, per_page, after=None, before=None):
+    """Fetch a page of ``query`` ordered newest first, keyed on (created_at, uid).
+
+    ``after`` pages towards older rows and ``before`` towards newer ones. Both are
+    opaque cursors as handed out on a previous page; a malformed cursor is ignored.
+    """
+    created_at, uid = model.created_at, model.uid
+    before = decode_cursor(before) if before else None
+    after = decode_cursor(after) if after else None
+    if before is not None:
+        stamp, key = before
+        rows = query.filter(db.or_(created_at > stamp, db.and_(created_at == stamp, uid > key))) \
+            .order_by(created_at.asc(), uid.asc()).limit(per_page + 1).all()
+        has_prev, has_next = len(rows) > per_page, True
+        rows = rows[:per_page][::-1]
+    else:
+        if after is not None:
+            stamp, key = after
+            query = query.filter(db.or_(created_at < stamp, db.and_(created_at == stamp, uid < key)))
+        rows = query.order_by(created_at.desc(), uid.desc()).limit(per_page + 1).all()
+        has_prev, has_next = after is not None, len(rows) > per_page
+        rows = rows[:per_page]
+    if not rows:
+        return KeysetPage(rows)
+    return KeysetPage(
+        rows,
+        next_cursor=encode_cursor(rows[-1].created_at, rows[-1].uid) if has_next else None,
+        prev_cursor=encode_cursor(rows[0].created_at, rows[0].uid) if has_prev else None)
@@ -0,0 +1,93 @@
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from . import db
+from .models import Role, PermissionsVersion
+
+
+_VERSION_ROW = 1
+
+
+class PermissionRegistry(object):
+    """The permission bitmask of every role, loaded once per worker.
+
+    Any change to a role bumps a version stamp in the database in the same
+    transaction. Workers compare it with the version they loaded at most every
+    ``PERMISSIONS_CHECK_INTERVAL`` seconds, so a permission check is a dict lookup
+    and a bitwise and. Roles changed with plain SQL should call :meth:`bump`.
+    """
+
+    def __init__(self, app=None):
+        self.check_interval = 5.0
+        self._permissions = {}
+        self._version = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('PERMISSIONS_CHECK_INTERVAL', 5.0)
+        app.extensions['permission_registry'] = self
+        self.check_interval = app.config['PERMISSIONS_CHECK_INTERVAL']
+
+    def _stored_version(self):
+        return db.session.query(PermissionsVersion.version).filter_by(uid=_VERSION_ROW).scalar() or 0
+
+    def _refresh(self):
+        now = time.monotonic()
+        if self._checked_at is not None and now - self._checked_at < self.check_interval:
+            return
+        with self._lock:
+            if self._checked_at is not None and now - self._checked_at < self.check_interval:
+                return
+            version = self._stored_version()
+            if version != self._version:
+                self._permissions = dict(db.session.query(Role.uid, Role.permissions))
+                self._version = version
+            self._checked_at = now
+
+    def permissions(self, role_id):
+        self._refresh()
+        return self._permissions.get(role_id, 0)
+
+    def can(self, role_id, permission):
+        return (self.permissions(role_id) & permission) == permission
+
+    def invalidate(self):
+        """Reload on the next check, in this worker only."""
+        self._checked_at = None
+
+    def bump(self, connection=None):
+        """Mark the roles changed for every worker, in the current transaction."""
+        table = PermissionsVersion.__table__
+        execute = (connection or db.session).execute
+        if not execute(table.update().where(table.c.uid == _VERSION_ROW)
+                       .values(version=table.c.version + 1)).rowcount:
+            execute(table.insert().values(uid=_VERSION_ROW, version=1))
+        db.session.info['roles_changed'] = True
+
+
+permission_registry = PermissionRegistry()
+
+
+@event.listens_for(Role, 'after_insert')
+@event.listens_for(Role, 'after_update')
+@event.listens_for(Role, 'after_delete')
+def _role_changed(mapper, connection, role):
+    permission_registry.bump(connection)
+
+
+@event.listens_for(Session, 'after_commit')
+def _reload_roles(session):
+    # other workers catch up within the check interval, this one right away
+    if session.info.pop('roles_changed', False):
+        permission_registry.invalidate()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_roles_changed(session):
+    session.info.pop('roles_changed', None)
@@ -0,0 +1,95 @@
+import re
+from collections import namedtuple
+
+from flask import Markup, escape
+from sqlalchemy import event, DDL
+
+from . import db
+from .models import Post
+from .pagination import KeysetPage
+
+
+# title matches weigh ten times as much as body matches when ranking
+TITLE_WEIGHT = 10.0
+BODY_WEIGHT = 1.0
+SNIPPET_TOKENS = 24
+# control characters never show up in user text, mark hits with them until escaped
+_HIT_START, _HIT_END = '\x02', '\x03'
+
+posts_fts = db.table('posts_fts', db.column('rowid'), db.column('title'), db.column('body'))
+
+CREATE_INDEX = "CREATE VIRTUAL TABLE IF NOT EXISTS posts_fts USING fts5(title, body, tokenize='porter unicode61')"
+
+event.listen(db.metadata, 'after_create', DDL(CREATE_INDEX).execute_if(dialect='sqlite'))
+event.listen(db.metadata, 'before_drop', DDL('DROP TABLE IF EXISTS posts_fts').execute_if(dialect='sqlite'))
+
+
+SearchHit = namedtuple('SearchHit', ['post', 'snippet', 'score'])
+
+
+@event.listens_for(Post, 'after_insert')
+def _index_post(mapper, connection, post):
+    connection.execute(posts_fts.insert().values(rowid=post.uid, title=post.title, body=post.body))
+
+
+@event.listens_for(Post, 'after_update')
+def _reindex_post(mapper, connection, post):
+    state = db.inspect(post)
+    # the body is deferred on listing queries; only touch the columns that changed
+    values = dict((name, getattr(post, name)) for name in ('title', 'body')
+                  if state.attrs[name].history.has_changes())
+    if values:
+        connection.execute(posts_fts.update().where(posts_fts.c.rowid == post.uid).values(**values))
+
+
+@event.listens_for(Post, 'after_delete')
+def _unindex_post(mapper, connection, post):
+    connection.execute(posts_fts.delete().where(posts_fts.c.rowid == post.uid))
+
+
+def match_expression(text):
+    """Turn free text into an FTS5 query that prefix matches every word."""
+    return ' '.join('"%s"*' % word for word in re.findall(r'\w+', text, re.UNICODE))
+
+
+def highlight(snippet):
+    return Markup(escape(snippet).replace(_HIT_START, Markup('<mark>')).replace(_HIT_END, Markup('</mark>')))
+
+
+def search_posts(text, per_page, start=0, filters=()):
+    """Rank posts matching ``text`` with bm25 and return a page of :class:`SearchHit`.
+
+    Cursors on the returned page are result offsets.
+    """
+    match = match_expression(text)
+    if not match:
+        return KeysetPage([])
+    fts = db.literal_column('posts_fts')
+    score = db.func.bm25(fts, TITLE_WEIGHT, BODY_WEIGHT).label('score')
+    snippet = db.func.snippet(fts, -1, _HIT_START, _HIT_END, '…', SNIPPET_TOKENS).label('snippet')
+    stmt = db.select([posts_fts.c.rowid, score, snippet]) \
+        .select_from(posts_fts.join(Post.__table__, Post.uid == posts_fts.c.rowid)) \
+        .where(db.text('posts_fts MATCH :match').bindparams(match=match)) \
+        .order_by(score, posts_fts.c.rowid).limit(per_page + 1).offset(start)
+    for filter_ in filters:
+        stmt = stmt.where(filter_)
+    rows = db.session.execute(stmt).fetchall()
+    has_next, rows = len(rows) > per_page, rows[:per_page]
+    posts = {}
+    if rows:
+        posts = dict((post.uid, post) for post in Post.query.options(
+            db.defer(Post.body), db.joinedload(Post.author)).filter(Post.uid.in_([row.rowid for row in rows])))
+    hits = [SearchHit(posts[row.rowid], highlight(row.snippet), row.score) for row in rows if row.rowid in posts]
+    return KeysetPage(
+        hits,
+        next_cursor=str(start + per_page) if has_next else None,
+        prev_cursor=str(max(start - per_page, 0)) if start > 0 else None)
+
+
+def rebuild_index():
+    """Repopulate the full-text index from the posts table in a single pass."""
+    db.session.execute(CREATE_INDEX)
+    db.session.execute('DELETE FROM posts_fts')
+    db.session.execute('INSERT INTO posts_fts (rowid, title, body) SELECT uid, title, body FROM posts')
+    db.session.execute("INSERT INTO posts_fts (posts_fts) VALUES ('optimize')")
+    db.session.commit()
@@ -0,0 +1,71 @@
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+from collections import Counter
+
+
+_PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# the clock starts before the app package is imported
+_CHILD = ('import sys, time; started = time.perf_counter(); '
+          'from app import startup; startup._measure(started, sys.argv[1], sys.argv[2:])')
+_IMPORT_TIME = re.compile(r'^import time:\s+(\d+) \|\s+\d+ \|\s+(\S+)$')
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 2)
+
+
+def _measure(started, env, urls):
+    """Runs in the fresh interpreter, prints the timings as JSON."""
+    from app import create_app
+    imported = time.perf_counter()
+    app = create_app(env)
+    created = time.perf_counter()
+    # report failing pages as 500s instead of stopping, as the testing config would
+    app.config['PROPAGATE_EXCEPTIONS'] = False
+    client = app.test_client()
+    requests = []
+    for url in urls:
+        timings = []
+        for _ in range(2):
+            before = time.perf_counter()
+            status = client.get(url).status_code
+            timings.append(time.perf_counter() - before)
+        requests.append(dict(url=url, status=status, first_ms=_ms(timings[0]), second_ms=_ms(timings[1])))
+    sys.stdout.write(json.dumps(dict(
+        import_ms=_ms(imported - started), create_app_ms=_ms(created - imported), requests=requests)))
+
+
+def _packages(lines):
+    """Import time in ms per top level package, from ``-X importtime`` output."""
+    totals = Counter()
+    for line in lines:
+        match = _IMPORT_TIME.match(line)
+        if match:
+            totals[match.group(2).split('.')[0]] += int(match.group(1)) / 1000.0
+    return totals
+
+
+def profile(env='default', urls=('/', '/auth/login'), top=10):
+    """Start the app in a new interpreter and time the imports, ``create_app`` and
+    the first and second request to each of ``urls``.
+
+    The first request pays for compiling its templates, unless they come from the
+    bytecode cache, and for any other first use costs. ``packages`` lists the
+    ``top`` packages that took longest to import.
+    """
+    environ = dict(os.environ, PYTHONPATH=os.pathsep.join(
+        [_PROJECT_ROOT] + [p for p in [os.environ.get('PYTHONPATH')] if p]))
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', _CHILD, env] + list(urls),
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=environ,
+                             universal_newlines=True)
+    if process.returncode:
+        raise RuntimeError('Start up failed:\n%s' % '\n'.join(
+            line for line in process.stderr.splitlines() if not line.startswith('import time:')))
+    result = json.loads(process.stdout.strip().splitlines()[-1])
+    result['packages'] = [(name, round(ms, 2)) for name, ms in
+                          _packages(process.stderr.splitlines()).most_common(top)]
+    return result
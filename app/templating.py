@@ -0,0 +1,53 @@
+import os
+import tempfile
+
+from jinja2 import FileSystemBytecodeCache
+
+
+class _BytecodeCache(FileSystemBytecodeCache):
+    """Writes each entry under a temporary name first, workers booting together
+    never read one that is half written."""
+
+    def dump_bytecode(self, bucket):
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                bucket.write_bytecode(f)
+            os.replace(tmp, self._get_cache_filename(bucket))
+        except Exception:
+            os.remove(tmp)
+            raise
+
+
+class TemplateCache(object):
+    """Keeps compiled templates on disk in ``TEMPLATE_CACHE_DIR``.
+
+    New workers load the bytecode instead of parsing and compiling every template,
+    Flask-Bootstrap's included, on their first requests. Entries are keyed by the
+    template source so edited templates are compiled again. Must be set up before
+    anything touches ``app.jinja_env``.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('TEMPLATE_CACHE_DIR', None)
+        app.extensions['template_cache'] = self
+        directory = app.config['TEMPLATE_CACHE_DIR']
+        if not directory:
+            return
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        app.jinja_options = dict(app.jinja_options, bytecode_cache=_BytecodeCache(directory))
+
+    def compile(self, app):
+        """Compile every template of the app and its blueprints into the cache, return their names."""
+        names = app.jinja_env.list_templates(extensions=('html', 'txt', 'xml'))
+        for name in names:
+            app.jinja_env.get_template(name)
+        return names
+
+
+template_cache = TemplateCache()
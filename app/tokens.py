@@ -0,0 +1,117 @@
+import hashlib
+import threading
+from datetime import datetime
+
+from flask import current_app
+from itsdangerous import TimedJSONWebSignatureSerializer, Signer, BadSignature, SignatureExpired
+
+from . import db
+from .models import ConsumedToken
+
+
+class _Signer(Signer):
+    """Derives its key on first use instead of on every signature."""
+
+    def derive_key(self):
+        key = self.__dict__.get('_derived_key')
+        if key is None:
+            key = self.__dict__['_derived_key'] = super(_Signer, self).derive_key()
+        return key
+
+
+class _Serializer(TimedJSONWebSignatureSerializer):
+
+    # the constructor sets self.signer from this, a signer attribute would be overwritten
+    default_signer = _Signer
+
+    def __init__(self, *args, **kwargs):
+        super(_Serializer, self).__init__(*args, **kwargs)
+        self._signers = {}
+
+    def make_signer(self, salt=None, algorithm=None):
+        signer = self._signers.get((salt, algorithm))
+        if signer is None:
+            signer = self._signers[(salt, algorithm)] = super(_Serializer, self).make_signer(salt, algorithm)
+        return signer
+
+
+def _digest(token):
+    # a truncated hash keeps the consumed token table and its index small
+    return hashlib.sha256(token.encode() if isinstance(token, str) else token).digest()[:16]
+
+
+class TokenService(object):
+    """Signs and verifies the timed tokens sent out in links.
+
+    Serializers, and the keys derived for them, are built once per key, salt and
+    lifetime. Tokens are signed with ``SECRET_KEY`` and also accepted when signed
+    with any of ``OLD_SECRET_KEYS``, so the key can be rotated without breaking
+    links already sent. :meth:`consume` makes a token single use.
+    """
+
+    def __init__(self, app=None):
+        self._serializers = {}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('OLD_SECRET_KEYS', ())
+        app.config.setdefault('TOKEN_EXPIRATION', 3600)
+        app.extensions['tokens'] = self
+
+    def _serializer(self, key, salt, expiration):
+        serializer = self._serializers.get((key, salt, expiration))
+        if serializer is None:
+            with self._lock:
+                serializer = self._serializers.get((key, salt, expiration))
+                if serializer is None:
+                    serializer = _Serializer(key, expires_in=expiration, salt=salt)
+                    self._serializers[(key, salt, expiration)] = serializer
+        return serializer
+
+    def generate(self, data, role=None, expiration=None):
+        config = current_app.config
+        expiration = expiration or config['TOKEN_EXPIRATION']
+        return self._serializer(config['SECRET_KEY'], role, expiration).dumps(data)
+
+    def _load(self, token, role):
+        config = current_app.config
+        for key in [config['SECRET_KEY']] + list(config['OLD_SECRET_KEYS']):
+            try:
+                return self._serializer(key, role, None).loads(token, return_header=True)
+            except SignatureExpired:
+                return None
+            except BadSignature:
+                continue
+        return None
+
+    def verify(self, token, role=None):
+        loaded = self._load(token, role)
+        return loaded[0] if loaded is not None else None
+
+    def consume(self, token, role=None):
+        """Verify a token and mark it used in the current transaction.
+
+        Returns None if the token is invalid, expired or was consumed before. The
+        mark is only kept if the caller commits.
+        """
+        loaded = self._load(token, role)
+        if loaded is None:
+            return None
+        data, header = loaded
+        stmt = ConsumedToken.__table__.insert().prefix_with('OR IGNORE').values(
+            digest=_digest(token), expires_at=datetime.fromtimestamp(header['exp']))
+        if not db.session.execute(stmt).rowcount:
+            return None
+        return data
+
+    def purge(self):
+        """Forget consumed tokens that have expired anyway, return how many were removed."""
+        count = db.session.execute(
+            ConsumedToken.__table__.delete().where(ConsumedToken.expires_at < datetime.now())).rowcount
+        db.session.commit()
+        return count
+
+
+tokens = TokenService()
@@ -0,0 +1,272 @@
+import csv
+import json
+import os
+from datetime import datetime
+
+from . import db, search, archive, counters
+from .feeds import feeds
+from .trending import trending
+from .cache import invalidate_on_commit
+from .models import Role, User, Post, Comment
+
+
+BATCH_SIZE = 5000
+FORMATS = ('jsonl', 'csv')
+KINDS = ('users', 'posts', 'comments')
+MAX_PARAMETERS = 900
+
+# references are to the ids in the same export, they are remapped on import
+FIELDS = dict(
+    users=('id', 'username', 'email', 'password_hash', 'bio', 'activated', 'role', 'created_at'),
+    posts=('id', 'title', 'body', 'author', 'created_at'),
+    comments=('id', 'post', 'parent', 'author', 'body', 'created_at'))
+_INTEGERS = ('id', 'post', 'parent', 'author')
+
+_users, _posts, _comments = User.__table__, Post.__table__, Comment.__table__
+
+
+def _selects():
+    return dict(
+        users=db.select([_users.c.uid, _users.c.username, _users.c.email, _users.c.password_hash, _users.c.bio,
+                         _users.c.activated, Role.__table__.c.name, _users.c.created_at])
+        .select_from(_users.outerjoin(Role.__table__)).order_by(_users.c.uid),
+        posts=db.select([_posts.c.uid, _posts.c.title, _posts.c.body, _posts.c.author_id, _posts.c.created_at])
+        .order_by(_posts.c.uid),
+        comments=db.select([_comments.c.uid, _comments.c.post_id, _comments.c.parent_id, _comments.c.author_id,
+                            _comments.c.body, _comments.c.created_at]).order_by(_comments.c.uid))
+
+
+def path_for(directory, kind, fmt):
+    return os.path.join(directory, '%s.%s' % (kind, fmt))
+
+
+def _batches(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _lookup(columns, column, values):
+    """Rows whose ``column`` is in ``values``, asked in chunks SQLite's bound parameter limit allows."""
+    values = list(values)
+    for start in range(0, len(values), MAX_PARAMETERS):
+        for row in db.session.execute(db.select(columns).where(column.in_(values[start:start + MAX_PARAMETERS]))):
+            yield row
+
+
+def _datetime(value):
+    if not value or isinstance(value, datetime):
+        return value or None
+    return datetime.strptime(value, '%Y-%m-%dT%H:%M:%S.%f' if '.' in value else '%Y-%m-%dT%H:%M:%S')
+
+
+def _write_jsonl(f, kind, rows):
+    fields = FIELDS[kind]
+    for row in rows:
+        record = dict(zip(fields, row))
+        if record['created_at'] is not None:
+            record['created_at'] = record['created_at'].isoformat()
+        f.write(json.dumps(record, sort_keys=True))
+        f.write('\n')
+
+
+def _write_csv(f, kind, rows):
+    writer = csv.writer(f)
+    for row in rows:
+        writer.writerow(['' if value is None else value.isoformat() if isinstance(value, datetime) else value
+                         for value in row])
+
+
+def _read_jsonl(f):
+    for line in f:
+        if line.strip():
+            yield json.loads(line)
+
+
+def _read_csv(f):
+    # csv has no nulls or types, empty cells are None and the rest is parsed back
+    for record in csv.DictReader(f):
+        for name, value in record.items():
+            if value == '':
+                record[name] = None
+            elif name in _INTEGERS:
+                record[name] = int(value)
+            elif name == 'activated':
+                record[name] = value in ('True', 'true', '1')
+        yield record
+
+
+def export(directory, fmt='jsonl', kinds=KINDS, batch_size=BATCH_SIZE):
+    """Write every user, post and comment to ``<directory>/<kind>.<fmt>``, return the row counts.
+
+    Rows are fetched ``batch_size`` at a time so memory stays flat however big the
+    tables are. Comments come out in id order, which puts parents before replies.
+    """
+    write = dict(jsonl=_write_jsonl, csv=_write_csv)[fmt]
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    selects, counts = _selects(), {}
+    for kind in kinds:
+        result = db.session.execute(selects[kind])
+        counts[kind] = 0
+        with open(path_for(directory, kind, fmt), 'w', newline='') as f:
+            if fmt == 'csv':
+                csv.writer(f).writerow(FIELDS[kind])
+            while True:
+                rows = result.fetchmany(batch_size)
+                if not rows:
+                    break
+                write(f, kind, rows)
+                counts[kind] += len(rows)
+    return counts
+
+
+class _Importer(object):
+    """Inserts one batch of records at a time and remembers the id each record was given.
+
+    Ids are handed out here rather than by the database so a whole batch goes in
+    with one ``executemany``. Users and posts that already exist, by username,
+    email or title, are not inserted again but references to them still resolve.
+    """
+
+    def __init__(self, batch_size):
+        self.batch_size = batch_size
+        self.ids = dict((kind, {}) for kind in KINDS)
+        self.orphans = []
+        # pages of posts that were already here and may get new comments
+        self.stale = set()
+
+    def _next_uid(self, table):
+        return (db.session.execute(db.select([db.func.max(table.c.uid)])).scalar() or 0) + 1
+
+    def _run(self, records, table, insert_batch):
+        uid, stats = self._next_uid(table), dict(created=0, existing=0, skipped=0)
+        for batch in _batches(records, self.batch_size):
+            rows = insert_batch(batch, uid, stats)
+            if rows:
+                db.session.execute(table.insert(), rows)
+                uid += len(rows)
+                stats['created'] += len(rows)
+            db.session.commit()
+        return stats
+
+    def users(self, records):
+        roles = dict(db.session.execute(db.select([Role.__table__.c.name, Role.__table__.c.uid])).fetchall())
+        default_role = roles.get('user')
+        ids = self.ids['users']
+
+        def insert_batch(batch, uid, stats):
+            columns, existing = [_users.c.uid, _users.c.username, _users.c.email], {}
+            for user_id, username, email in list(_lookup(columns, _users.c.username,
+                                                         [record['username'] for record in batch])) + \
+                    list(_lookup(columns, _users.c.email, [record['email'] for record in batch if record.get('email')])):
+                existing[username] = user_id
+                if email:
+                    existing[email] = user_id
+            rows, now = [], datetime.now()
+            for record in batch:
+                known = existing.get(record['username']) or existing.get(record.get('email') or None)
+                role_id = roles.get(record.get('role'), default_role)
+                if known is not None:
+                    ids[record['id']] = known
+                    stats['existing'] += 1
+                elif role_id is None or not record.get('password_hash'):
+                    stats['skipped'] += 1
+                else:
+                    ids[record['id']] = existing[record['username']] = uid + len(rows)
+                    if record.get('email'):
+                        existing[record['email']] = ids[record['id']]
+                    rows.append(dict(uid=ids[record['id']], username=record['username'], email=record.get('email'),
+                                     password_hash=record['password_hash'], bio=record.get('bio'),
+                                     activated=bool(record.get('activated')), role_id=role_id,
+                                     created_at=_datetime(record.get('created_at')) or now, modified_at=now))
+            return rows
+
+        return self._run(records, _users, insert_batch)
+
+    def posts(self, records):
+        ids, authors = self.ids['posts'], self.ids['users']
+
+        def insert_batch(batch, uid, stats):
+            existing = dict(_lookup([_posts.c.title, _posts.c.uid], _posts.c.title,
+                                    [record['title'] for record in batch]))
+            rows, now = [], datetime.now()
+            for record in batch:
+                known = existing.get(record['title'])
+                if known is not None:
+                    ids[record['id']] = known
+                    self.stale.add('post:%d' % known)
+                    stats['existing'] += 1
+                    continue
+                ids[record['id']] = existing[record['title']] = uid + len(rows)
+                created_at = _datetime(record.get('created_at')) or now
+                rows.append(dict(uid=ids[record['id']], title=record['title'], body=record['body'],
+                                 author_id=authors.get(record.get('author')),
+                                 created_at=created_at, modified_at=created_at))
+            return rows
+
+        return self._run(records, _posts, insert_batch)
+
+    def comments(self, records):
+        ids, posts, authors = self.ids['comments'], self.ids['posts'], self.ids['users']
+
+        def insert_batch(batch, uid, stats):
+            rows, now = [], datetime.now()
+            for record in batch:
+                post_id, author_id = posts.get(record.get('post')), authors.get(record.get('author'))
+                if post_id is None or author_id is None:
+                    stats['skipped'] += 1
+                    continue
+                ids[record['id']] = uid + len(rows)
+                parent = record.get('parent')
+                parent_id = ids.get(parent) if parent is not None else None
+                if parent is not None and parent_id is None:
+                    # the parent may still be further down the file
+                    self.orphans.append((ids[record['id']], parent))
+                rows.append(dict(uid=ids[record['id']], body=record['body'], post_id=post_id, author_id=author_id,
+                                 parent_id=parent_id, created_at=_datetime(record.get('created_at')) or now,
+                                 modified_at=now))
+            return rows
+
+        stats = self._run(records, _comments, insert_batch)
+        adopted = [dict(_uid=uid, _parent_id=ids[parent]) for uid, parent in self.orphans if parent in ids]
+        for batch in _batches(adopted, self.batch_size):
+            db.session.execute(_comments.update().where(_comments.c.uid == db.bindparam('_uid'))
+                               .values(parent_id=db.bindparam('_parent_id')), batch)
+        db.session.commit()
+        del stats['existing']
+        stats['orphaned'] = len(self.orphans) - len(adopted)
+        return stats
+
+
+def import_(directory, fmt='jsonl', kinds=KINDS, batch_size=BATCH_SIZE):
+    """Load the files written by :func:`export` into the database, return per kind counts.
+
+    Records are read and inserted ``batch_size`` at a time. Authors, posts and
+    parent comments are looked up by their exported id in an in-memory map of the
+    ids they were given here, so kinds have to be imported together. Missing files
+    are skipped. Comments have no natural key, importing them twice duplicates them.
+    """
+    read = dict(jsonl=_read_jsonl, csv=_read_csv)[fmt]
+    importer, results = _Importer(batch_size), {}
+    for kind in kinds:
+        path = path_for(directory, kind, fmt)
+        if not os.path.exists(path):
+            continue
+        with open(path, newline='') as f:
+            results[kind] = getattr(importer, kind)(read(f))
+
+    # the bulk inserts bypassed the mapper events that maintain these
+    search.rebuild_index()
+    archive.rebuild()
+    counters.recount()
+    feeds.rebuild()
+    trending.rebuild()
+    invalidate_on_commit('posts', *importer.stale)
+    db.session.commit()
+    return results
@@ -0,0 +1,204 @@
+import threading
+import time
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import event
+
+from . import db
+from .cache import invalidate_on_commit
+from .models import Post, Comment, TrendingScore, TrendingEpoch, users_like_posts
+
+
+scores, epochs = TrendingScore.__table__, TrendingEpoch.__table__
+posts, comments = Post.__table__, Comment.__table__
+
+_EPOCH_ROW = 1
+# contributions older than this many half lives are too small to matter when rebuilding
+_HORIZON = 12
+# scores are rebased once new events weigh this many times two more than at the epoch,
+# long before 2 ** x overflows at 1024 half lives
+_REBASE_AFTER = 64
+
+
+def _timestamp(value):
+    return time.mktime(value.timetuple()) + value.microsecond / 1e6 if value is not None else time.time()
+
+
+class _State(object):
+    """The decay thread of an app, started by its first record."""
+
+    def __init__(self):
+        self.thread = None
+
+
+class Trending(object):
+    """Posts ranked by likes and comments that lose half their weight every ``TRENDING_HALF_LIFE`` seconds.
+
+    Rather than decaying every score as time passes, an event at time ``t`` adds
+    ``weight * 2 ** ((t - epoch) / half_life)`` to its post's score. Every score
+    decays by the same factor, so the stored values keep their order and the top
+    posts are one read of the score index. :meth:`decay` rebases the scores on the
+    current time to keep them small and drops the ones that faded away. Run it with
+    ``manage.py decay_trending`` or set ``TRENDING_DECAY_INTERVAL`` to have a
+    background thread do it. Without either, :meth:`record` rebases on its own once
+    the epoch is ``_REBASE_AFTER`` half lives old. Cached pages showing the ranking
+    carry the ``trending`` tag, dropped whenever it changes.
+    """
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('TRENDING_HALF_LIFE', 12 * 3600)
+        app.config.setdefault('TRENDING_LIKE_WEIGHT', 1.0)
+        app.config.setdefault('TRENDING_COMMENT_WEIGHT', 2.0)
+        app.config.setdefault('TRENDING_MIN_SCORE', 0.05)
+        app.config.setdefault('TRENDING_SIZE', 5)
+        app.config.setdefault('TRENDING_PAGE_SIZE', 20)
+        app.config.setdefault('TRENDING_DECAY_INTERVAL', 0)
+        app.extensions['trending'] = _State()
+
+    def _epoch(self, execute):
+        epoch = execute(db.select([epochs.c.epoch]).where(epochs.c.uid == _EPOCH_ROW)).scalar()
+        if epoch is None:
+            epoch = time.time()
+            execute(epochs.insert().values(uid=_EPOCH_ROW, epoch=epoch))
+        return epoch
+
+    def _rebase(self, execute, epoch, now):
+        """Express every score at ``now`` instead of ``epoch`` and drop those below
+        ``TRENDING_MIN_SCORE``, return how many were dropped."""
+        config = current_app.config
+        factor = 2 ** ((epoch - now) / config['TRENDING_HALF_LIFE'])
+        execute(scores.update().values(score=scores.c.score * factor))
+        dropped = execute(scores.delete().where(scores.c.score < config['TRENDING_MIN_SCORE'])).rowcount
+        execute(epochs.update().where(epochs.c.uid == _EPOCH_ROW).values(epoch=now))
+        return dropped
+
+    def record(self, post_id, weight, at=None, connection=None):
+        """Add an event of ``weight``, negative to take one back, that happened ``at``, default now.
+
+        Callers have written in the same transaction already, so the epoch read here
+        can't be moved by a concurrent rebase.
+        """
+        if post_id is None or not weight:
+            return
+        execute = (connection or db.session).execute
+        half_life = current_app.config['TRENDING_HALF_LIFE']
+        epoch, now = self._epoch(execute), time.time()
+        if now - epoch > _REBASE_AFTER * half_life:
+            self._rebase(execute, epoch, now)
+            epoch = now
+        delta = weight * 2 ** ((_timestamp(at) - epoch) / half_life)
+        if not execute(scores.update().where(scores.c.post_id == post_id)
+                       .values(score=scores.c.score + delta)).rowcount and delta > 0:
+            execute(scores.insert().values(post_id=post_id, score=delta))
+        if delta < 0:
+            # an unlike takes back a like at today's weight, more than the like added if it is
+            # older, never leave the post ranked below posts with no activity at all
+            execute(scores.delete().where(db.and_(scores.c.post_id == post_id, scores.c.score <= 0)))
+        invalidate_on_commit('trending')
+        self._start()
+
+    def top(self, limit=None):
+        """The trending posts, best first, with their score decayed to now."""
+        config = current_app.config
+        epoch = db.session.query(TrendingEpoch.epoch).filter_by(uid=_EPOCH_ROW).scalar() or time.time()
+        factor = 2 ** ((epoch - time.time()) / config['TRENDING_HALF_LIFE'])
+        rows = db.session.query(Post.uid, Post.title, TrendingScore.score) \
+            .join(TrendingScore, TrendingScore.post_id == Post.uid) \
+            .order_by(TrendingScore.score.desc()).limit(limit or config['TRENDING_SIZE']).all()
+        return [(uid, title, score * factor) for uid, title, score in rows]
+
+    def decay(self):
+        """Rebase every score on the current time and drop those below ``TRENDING_MIN_SCORE``,
+        return how many were dropped."""
+        # take the write lock before reading the epoch, every worker runs its own decay thread
+        # and two of them rebasing from the same epoch would apply the factor twice
+        db.session.execute(epochs.update().where(epochs.c.uid == _EPOCH_ROW).values(epoch=epochs.c.epoch))
+        dropped = self._rebase(db.session.execute, self._epoch(db.session.execute), time.time())
+        if dropped:
+            invalidate_on_commit('trending')
+        db.session.commit()
+        return dropped
+
+    def rebuild(self):
+        """Recompute every score from the comments and likes, return how many posts are trending.
+
+        Likes carry no time of their own and count as if made when their post was
+        published.
+        """
+        config = current_app.config
+        now, half_life = time.time(), config['TRENDING_HALF_LIFE']
+        since = datetime.fromtimestamp(now - _HORIZON * half_life)
+        totals = {}
+
+        def add(rows, weight):
+            for post_id, at, count in rows:
+                totals[post_id] = totals.get(post_id, 0) + count * weight * 2 ** ((_timestamp(at) - now) / half_life)
+
+        add(db.session.execute(db.select([comments.c.post_id, comments.c.created_at, db.literal(1)])
+                               .where(db.and_(comments.c.post_id.isnot(None), comments.c.created_at >= since))),
+            config['TRENDING_COMMENT_WEIGHT'])
+        add(db.session.execute(db.select([posts.c.uid, posts.c.created_at, db.func.count()])
+                               .select_from(posts.join(users_like_posts, users_like_posts.c.post_id == posts.c.uid))
+                               .where(posts.c.created_at >= since).group_by(posts.c.uid)),
+            config['TRENDING_LIKE_WEIGHT'])
+        rows = [dict(post_id=post_id, score=score) for post_id, score in totals.items()
+                if score >= config['TRENDING_MIN_SCORE']]
+        db.session.execute(scores.delete())
+        if rows:
+            db.session.execute(scores.insert(), rows)
+        if not db.session.execute(epochs.update().where(epochs.c.uid == _EPOCH_ROW).values(epoch=now)).rowcount:
+            db.session.execute(epochs.insert().values(uid=_EPOCH_ROW, epoch=now))
+        invalidate_on_commit('trending')
+        db.session.commit()
+        return len(rows)
+
+    def _start(self):
+        state = current_app.extensions['trending']
+        if not current_app.config['TRENDING_DECAY_INTERVAL'] or state.thread is not None:
+            return
+        with self._lock:
+            if state.thread is None:
+                state.thread = threading.Thread(target=self._run, args=(current_app._get_current_object(),),
+                                                name='trending-decay')
+                state.thread.daemon = True
+                state.thread.start()
+
+    def _run(self, app):
+        with app.app_context():
+            while True:
+                time.sleep(app.config['TRENDING_DECAY_INTERVAL'])
+                try:
+                    self.decay()
+                except Exception:
+                    db.session.rollback()
+                    app.logger.exception('Failed to decay trending scores')
+                finally:
+                    db.session.remove()
+
+
+trending = Trending()
+
+
+def _comment_weight():
+    return current_app.config['TRENDING_COMMENT_WEIGHT']
+
+
+@event.listens_for(Comment, 'after_insert')
+def _comment_added(mapper, connection, comment):
+    trending.record(comment.post_id, _comment_weight(), comment.created_at, connection)
+
+
+@event.listens_for(Comment, 'before_delete')
+def _comment_removed(mapper, connection, comment):
+    trending.record(comment.post_id, -_comment_weight(), comment.created_at, connection)
+
+
+@event.listens_for(Post, 'before_delete')
+def _post_removed(mapper, connection, post):
+    connection.execute(scores.delete().where(scores.c.post_id == post.uid))
@@ -0,0 +1,63 @@
+import hashlib
+import os
+import tempfile
+from collections import namedtuple
+
+from werkzeug.exceptions import RequestEntityTooLarge
+
+
+CHUNK_SIZE = 64 * 1024
+
+# leading bytes of every accepted file type and the extension it is stored under
+SIGNATURES = (
+    (b'\xff\xd8\xff', 'jpg'),
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+)
+
+Upload = namedtuple('Upload', ['path', 'digest', 'size', 'kind'])
+
+
+def sniff(head):
+    """Return the extension matching the magic bytes at the start of a file or None."""
+    for signature, kind in SIGNATURES:
+        if head.startswith(signature):
+            return kind
+    return None
+
+
+def receive(stream, directory, max_size, salt=b'', chunk_size=CHUNK_SIZE):
+    """Copy an upload stream into ``directory`` one chunk at a time and return an :class:`Upload`.
+
+    The type is sniffed from the first chunk and the content hashed as it is copied,
+    so memory use does not depend on the file size. The file only gets its final
+    ``.<kind>`` extension once complete, under a name of its own, so identical
+    uploads never share a file that one of them may remove. Raises ValueError for
+    unrecognised content and RequestEntityTooLarge past ``max_size`` bytes.
+    """
+    digest = hashlib.sha1(salt)
+    kind, size = None, 0
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            while True:
+                chunk = stream.read(chunk_size)
+                if not chunk:
+                    break
+                if kind is None:
+                    kind = sniff(chunk)
+                    if kind is None:
+                        raise ValueError('File must be a JPEG or PNG image.')
+                size += len(chunk)
+                if size > max_size:
+                    raise RequestEntityTooLarge()
+                digest.update(chunk)
+                out.write(chunk)
+        if kind is None:
+            raise ValueError('The file is empty.')
+        fd, path = tempfile.mkstemp(dir=directory, suffix='.' + kind)
+        os.close(fd)
+        os.replace(tmp, path)
+    except Exception:
+        os.remove(tmp)
+        raise
+    return Upload(path, digest.hexdigest(), size, kind)
@@ -1,14 +1,13 @@
-import os
-
+import hashlib
+import time
+from datetime import datetime
 from functools import wraps
-from threading import Thread
 
-from flask import abort, render_template, current_app
+from flask import abort, render_template, current_app, request, session, make_response
 from flask_login import current_user
-from flask_mail import Message
-from itsdangerous import TimedJSONWebSignatureSerializer, BadSignature
 
-from . import create_app, mailer
+from .mail import mail_queue
+from .tokens import tokens
 from .models import Permission
 
 
@@ -27,29 +26,72 @@ def admin_required(f):
     return permission_required(Permission.ADMINISTRATE)(f)
 
 
-def send_mail(to, subject, template, **kwargs):
-    msg = Message(subject=current_app.config['MAIL_SUBJECT_PREFIX'] + subject,
-                  body=render_template(template + '.txt', **kwargs),
-                  html=render_template(template + '.html', **kwargs),
-                  recipients=[to])
-    thread = Thread(target=send_mail_async, args=[msg])
-    thread.start()
+def _utc(local):
+    return datetime.utcfromtimestamp(time.mktime(local.timetuple())) if local is not None else None
 
 
-def send_mail_async(msg):
-    app = create_app(os.environ.get('SKY_ENV') or 'default')
-    with app.app_context():
-        mailer.send(msg)
+def not_modified(etag, last_modified):
+    """Whether the client's conditional headers show its copy has this ``etag`` or is newer
+    than ``last_modified``, in UTC."""
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    return (request.if_modified_since is not None and last_modified is not None and
+            last_modified.replace(microsecond=0) <= request.if_modified_since)
+
+
+def conditional(validators):
+    """Answer GET requests with 304 Not Modified when the client's copy is still current.
+
+    ``validators`` is called with the view arguments and returns a tuple of values that
+    change whenever the page does, the first being its last modification time, or None
+    to skip the check. Pages are per user and embed CSRF tokens, so the ETag also covers
+    the user and the CSRF token lifetime. Put it under :meth:`PageCache.page`, which keeps
+    the ETag with the cached page and answers anonymous visitors without the validators.
+    """
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            if request.method != 'GET' or '_flashes' in session:
+                return f(*args, **kwargs)
+            values = validators(**kwargs)
+            if values is None:
+                return f(*args, **kwargs)
+            last_modified = _utc(values[0])
+            state = ['anonymous']
+            if current_user.is_authenticated:
+                lifetime = current_app.config.get('WTF_CSRF_TIME_LIMIT') or 3600
+                state = [current_user.get_id(), int(time.time() // (lifetime / 2))]
+            etag = hashlib.sha1('|'.join(str(value) for value in list(values) + state).encode()).hexdigest()
+            if not_modified(etag, last_modified):
+                rv = current_app.response_class(status=304)
+            else:
+                rv = make_response(f(*args, **kwargs))
+            if rv.status_code in (200, 304):
+                rv.set_etag(etag)
+                rv.last_modified = last_modified
+                rv.cache_control.no_cache = True
+                if current_user.is_authenticated:
+                    rv.cache_control.private = True
+                rv.vary.add('Cookie')
+            return rv
+        return wrapper
+    return decorator
+
+
+def send_mail(to, subject, template, **kwargs):
+    mail_queue.enqueue(to, current_app.config.get('MAIL_SUBJECT_PREFIX', '') + subject,
+                       body=render_template(template + '.txt', **kwargs),
+                       html=render_template(template + '.html', **kwargs))
 
 
 def generate_token(data, role=None, expiration=3600):
-    s = TimedJSONWebSignatureSerializer(current_app.config['SECRET_KEY'], expires_in=expiration)
-    return s.dumps(data, salt=role)
+    return tokens.generate(data, role, expiration)
 
 
 def verify_token(token, role=None):
-    s = TimedJSONWebSignatureSerializer(current_app.config['SECRET_KEY'])
-    try:
-        return s.loads(token, salt=role)
-    except BadSignature:
-        return None
+    return tokens.verify(token, role)
+
+
+def consume_token(token, role=None):
+    """Like verify_token but a token is only accepted once, provided the caller commits."""
+    return tokens.consume(token, role)
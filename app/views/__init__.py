@@ -1,22 +1,27 @@
 from flask import Blueprint, request, redirect, url_for
-from flask_login import current_user
+
+from ..identity import is_public, is_activated
 
 main_blueprint = Blueprint('main', __name__)
 auth_blueprint = Blueprint('auth', __name__, url_prefix='/auth')
 posts_blueprint = Blueprint('posts', __name__, url_prefix='/posts')
+api_blueprint = Blueprint('api', __name__, url_prefix='/api/v1')
 
 from . import auth
 from . import posts
 from . import helpers
+from . import api
+from . import feeds
 
 
 @main_blueprint.before_app_request
 def before_request():
-    if (current_user.is_authenticated and
-            not current_user.is_active and
-            request.endpoint[:5] != 'auth.' and
-            request.endpoint != 'bootstrap.static'):  # allow serving static files
+    # unknown urls and public endpoints, static files included, never load the user
+    endpoint = request.endpoint
+    if endpoint is None or is_public(endpoint):
+        return None
+    if is_activated() is False and not endpoint.startswith('auth.'):
         return redirect(url_for('auth.inactive'))
 
 
-blueprints = [main_blueprint, auth_blueprint, posts_blueprint]
+blueprints = [main_blueprint, auth_blueprint, posts_blueprint, api_blueprint]
@@ -0,0 +1,136 @@
+from datetime import datetime
+
+from flask import jsonify, request, abort, current_app
+
+from . import api_blueprint
+from ..models import db, User, Post, Comment
+from ..pagination import paginate
+from ..engine import read_only
+from ..identity import public
+from ..images import profile_pictures
+
+
+MAX_PAGE_SIZE = 100
+
+# field name -> columns it is read from, joined authors come back as author_id/author_username
+_author = [User.uid.label('author_id'), User.username.label('author_username')]
+POST_FIELDS = dict(
+    id=[], created_at=[], title=[Post.title], body=[Post.body], modified_at=[Post.modified_at],
+    like_count=[Post.like_count], comment_count=[Post.comment_count], author=_author)
+COMMENT_FIELDS = dict(
+    id=[], created_at=[], body=[Comment.body], parent_id=[], like_count=[Comment.like_count],
+    reply_count=[Comment.reply_count], author=_author)
+AUTHOR_FIELDS = dict(
+    id=[], username=[], created_at=[User.created_at], bio=[User.bio], avatar=[User.profile_pic],
+    post_count=[db.select([db.func.count(Post.uid)]).where(Post.author_id == User.uid)
+                .as_scalar().label('post_count')])
+
+DEFAULT_POST_FIELDS = ('id', 'title', 'created_at', 'author', 'like_count', 'comment_count')
+
+
+def _fields(available, default):
+    """Parse the ``fields`` argument into the requested field names, 400 on unknown ones."""
+    names = request.args.get('fields')
+    if not names:
+        return list(default)
+    names = [name.strip() for name in names.split(',') if name.strip()]
+    unknown = [name for name in names if name not in available]
+    if unknown:
+        abort(400, 'Unknown fields: %s' % ', '.join(unknown))
+    return names
+
+
+def _columns(available, fields):
+    return [column for name in fields for column in available[name]]
+
+
+def _serialize(row, fields, key='uid'):
+    rv = {}
+    for name in fields:
+        if name == 'id':
+            rv['id'] = getattr(row, key)
+        elif name == 'author':
+            rv['author'] = dict(id=row.author_id, username=row.author_username)
+        elif name == 'avatar':
+            rv['avatar'] = request.url_root.rstrip('/') + profile_pictures.url(row, 256)
+        else:
+            value = getattr(row, name)
+            rv[name] = value.isoformat() if isinstance(value, datetime) else value
+    return rv
+
+
+def _with_author(query, fields, author_id):
+    if 'author' in fields:
+        query = query.outerjoin(User, User.uid == author_id)
+    return query
+
+
+@api_blueprint.errorhandler(400)
+@api_blueprint.errorhandler(404)
+def error(error):
+    return jsonify(error=error.description), error.code
+
+
+@api_blueprint.route('/posts')
+@public
+@read_only
+def posts():
+    fields = _fields(POST_FIELDS, DEFAULT_POST_FIELDS)
+    limit = min(request.args.get('limit', current_app.config['POSTS_PER_PAGE'], type=int), MAX_PAGE_SIZE)
+    if limit < 1:
+        abort(400, 'limit must be positive')
+    query = _with_author(db.session.query(Post.uid, Post.created_at, *_columns(POST_FIELDS, fields)),
+                         fields, Post.author_id)
+    author = request.args.get('author')
+    if author is not None:
+        query = query.filter(Post.author_id == db.select([User.uid]).where(User.username == author).as_scalar())
+    page = paginate(query, Post, limit, after=request.args.get('after'), before=request.args.get('before'))
+    return jsonify(
+        posts=[_serialize(row, fields) for row in page.items],
+        next_cursor=page.next_cursor,
+        prev_cursor=page.prev_cursor)
+
+
+@api_blueprint.route('/posts/<int:post_id>')
+@public
+@read_only
+def post(post_id):
+    fields = _fields(POST_FIELDS, list(DEFAULT_POST_FIELDS) + ['body', 'modified_at'])
+    query = _with_author(db.session.query(Post.uid, Post.created_at, *_columns(POST_FIELDS, fields)),
+                         fields, Post.author_id)
+    row = query.filter(Post.uid == post_id).first()
+    if row is None:
+        abort(404, 'No such post')
+    return jsonify(post=_serialize(row, fields))
+
+
+@api_blueprint.route('/posts/<int:post_id>/comments')
+@public
+@read_only
+def comments(post_id):
+    """The whole comment thread of a post, replies nested under their parents."""
+    fields = _fields(COMMENT_FIELDS, COMMENT_FIELDS)
+    if not db.session.query(db.exists().where(Post.uid == post_id)).scalar():
+        abort(404, 'No such post')
+    query = _with_author(
+        db.session.query(Comment.uid, Comment.created_at, Comment.parent_id, *_columns(COMMENT_FIELDS, fields)),
+        fields, Comment.author_id)
+    rows = query.filter(Comment.post_id == post_id).order_by(Comment.created_at, Comment.uid).all()
+    nodes = dict((row.uid, dict(_serialize(row, fields), replies=[])) for row in rows)
+    thread = []
+    for row in rows:
+        parent = nodes.get(row.parent_id)
+        (parent['replies'] if parent is not None else thread).append(nodes[row.uid])
+    return jsonify(comments=thread)
+
+
+@api_blueprint.route('/authors/<username>')
+@public
+@read_only
+def author(username):
+    fields = _fields(AUTHOR_FIELDS, AUTHOR_FIELDS)
+    row = db.session.query(User.uid, User.username, *_columns(AUTHOR_FIELDS, fields)) \
+        .filter(User.username == username).first()
+    if row is None:
+        abort(404, 'No such author')
+    return jsonify(author=_serialize(row, fields))
@@ -2,7 +2,7 @@ import os
 
 from flask import (
     request, render_template, redirect, url_for, flash, current_app,
-    send_from_directory)
+    send_from_directory, make_response, jsonify, abort)
 from flask_login import login_required, login_user, logout_user, current_user
 
 from . import auth_blueprint
@@ -10,17 +10,27 @@ from ..models import db, User
 from ..forms import (
     LoginForm, RegistrationForm, ChangeUsernameForm, ChangeEmailForm,
     ChangePasswordForm, AccountRecoveryForm, PasswordResetForm, UpdateBioForm,
-    ProfilePicForm)
-from ..utils import send_mail, generate_token, verify_token
+    ProfilePicForm, is_available, equals_ignoring_case, email_exists)
+from ..utils import send_mail, generate_token, verify_token, consume_token
+from ..hashing import hasher
+from ..engine import read_only
+from ..identity import public, set_activated
+from ..images import profile_pictures, is_thumbnail, DEFAULT_AVATAR
 
 
 @auth_blueprint.route('/login', methods=['get', 'post'])
 def login():
     lf = LoginForm()
     if lf.validate_on_submit():
-        user = User.query.filter((User.username == lf.username.data) |
-                                 (User.email == lf.username.data)).first()
+        name = lf.username.data
+        # names are unique ignoring case, an exact match wins over older accounts differing in case only
+        user = User.query.filter(equals_ignoring_case(User.username, name) |
+                                 equals_ignoring_case(User.email, name)) \
+            .order_by(db.case([((User.username == name) | (User.email == name), 0)], else_=1)).first()
         if user is not None and user.verify_password(lf.password.data):
+            if hasher.needs_rehash(user.password_hash):
+                user.password = lf.password.data
+                db.session.commit()
             if login_user(user, lf.remember_me.data):
                 flash('Login successful.', 'success')
             elif not user.is_active:
@@ -56,14 +66,26 @@ def register():
     return render_template('register.html', form=rf)
 
 
+@auth_blueprint.route('/available')
+@public
+@read_only
+def available():
+    for field in ('username', 'email'):
+        value = request.args.get(field, '').strip()
+        if value:
+            return jsonify(field=field, value=value, available=is_available(field, value))
+    abort(400)
+
+
 @auth_blueprint.route('/account/activate/<token>')
 @login_required
 def activate(token):
     if not current_user.is_active:
-        uid = verify_token(token, 'account-activation')
+        uid = consume_token(token, 'account-activation')
         if uid == current_user.uid:
             current_user.activated = True
             db.session.commit()
+            set_activated(True)
             flash('You have activated your account. Thank you!', 'success')
         else:
             flash('This activation link is invalid or has expired.', 'danger')
@@ -75,6 +97,8 @@ def activate(token):
 @login_required
 def inactive():
     if current_user.is_anonymous or current_user.is_active:
+        # the session flag was stale, e.g. dropped by session protection
+        set_activated(None if current_user.is_anonymous else True)
         return redirect(url_for('main.index'))
     return render_template('activate_account.html')
 
@@ -94,7 +118,7 @@ def resend_activation_link():
 def recover_account():
     arf = AccountRecoveryForm()
     if arf.validate_on_submit():
-        user = User.query.filter_by(email=arf.email.data).first()
+        user = email_exists.first(arf.email.data)
         token = generate_token(user.uid, 'account-recovery')
         url = url_for('auth.reset_password', token=token, _external=True)
         send_mail(user.email, 'Account Recovery', 'mail/recover_account', user=user, url=url)
@@ -111,6 +135,9 @@ def reset_password(token):
         return redirect(url_for('auth.login'))
     prf = PasswordResetForm()
     if prf.validate_on_submit():
+        if consume_token(token, 'account-recovery') != uid:
+            flash('This password reset link has already been used.', 'danger')
+            return redirect(url_for('auth.login'))
         user = User.query.get(uid)
         user.password = prf.password.data
         db.session.commit()
@@ -157,11 +184,15 @@ def profile():
             return redirect(url_for('auth.profile'))
     elif 'submit_pic' in request.form:
         if ppf.validate_on_submit():
-            file = request.files['profile_pic']
-            path = os.path.join(current_app.config['FILE_UPLOAD_PATH'], file.filename)
-            file.save(path)
-            current_user.profile_pic = file.filename
+            try:
+                digest = profile_pictures.save(current_user.uid, request.files['profile_pic'].stream)
+            except ValueError as e:
+                flash(str(e), 'danger')
+                return redirect(url_for('auth.profile'))
+            previous, current_user.profile_pic = current_user.profile_pic, digest
             db.session.commit()
+            if previous != digest:
+                profile_pictures.discard(previous)
             return redirect(url_for('auth.profile'))
     return render_template(
         'profile.html', name_form=cuf, email_form=cef, pswd_form=cpf,
@@ -169,16 +200,34 @@ def profile():
 
 
 @auth_blueprint.route('/account/profile/<filename>')
+@public
 def profile_picture(filename):
-    return send_from_directory(current_app.config['FILE_UPLOAD_PATH'], filename)
+    config = current_app.config
+    if not is_thumbnail(filename):
+        return send_from_directory(config['FILE_UPLOAD_PATH'], filename)
+    if not os.path.exists(os.path.join(config['FILE_UPLOAD_PATH'], filename)):
+        # still being processed, show the default until the thumbnail is written
+        response = send_from_directory(config['FILE_UPLOAD_PATH'], DEFAULT_AVATAR, cache_timeout=0)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    if config['PROFILE_PIC_ACCEL_PREFIX']:
+        response = make_response('')
+        response.headers['X-Accel-Redirect'] = config['PROFILE_PIC_ACCEL_PREFIX'] + filename
+        response.headers['Content-Type'] = 'image/jpeg'
+    else:
+        # honours USE_X_SENDFILE
+        response = send_from_directory(config['FILE_UPLOAD_PATH'], filename)
+    # thumbnail names change with their content
+    response.headers['Cache-Control'] = 'public, max-age=%d, immutable' % config['PROFILE_PIC_MAX_AGE']
+    return response
 
 
 @auth_blueprint.route('/account/confirm-new-email/<token>')
 @login_required
 def confirm_new_email(token):
-    uid, new_email = verify_token(token, 'change-email')
-    if uid == current_user.uid:
-        current_user.email = new_email
+    data = consume_token(token, 'change-email')
+    if data is not None and data[0] == current_user.uid:
+        current_user.email = data[1]
         db.session.commit()
         flash('Email changed.', 'success')
     else:
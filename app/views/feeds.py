@@ -0,0 +1,43 @@
+import os
+
+from flask import current_app, send_from_directory, abort
+
+from . import main_blueprint
+from ..feeds import feeds, ATOM, RSS, SITEMAP_INDEX, sitemap_name
+from ..identity import public
+
+
+MIMETYPES = {ATOM: 'application/atom+xml', RSS: 'application/rss+xml'}
+# seconds clients are asked to wait for files that were not written yet
+RETRY_AFTER = 300
+
+
+def _send(name):
+    if not os.path.exists(feeds.path(name)):
+        if name not in (ATOM, RSS, SITEMAP_INDEX):
+            abort(404)
+        # nothing written yet on a fresh deploy, rebuilding reads every post so it is
+        # left to `manage.py build_feeds` or the next commit touching posts
+        current_app.logger.warning('%s is missing, run manage.py build_feeds', name)
+        response = current_app.response_class('Not generated yet, try again later.', 503, mimetype='text/plain')
+        response.headers['Retry-After'] = str(RETRY_AFTER)
+        return response
+    # the ETag comes from the file's mtime and size, so unchanged files get a 304
+    response = send_from_directory(current_app.config['FEEDS_DIR'], name, conditional=True,
+                                   mimetype=MIMETYPES.get(name, 'application/xml'),
+                                   cache_timeout=current_app.config['FEEDS_MAX_AGE'])
+    response.cache_control.public = True
+    return response
+
+
+@main_blueprint.route('/feeds/<any(%r, %r):name>' % (ATOM, RSS))
+@public
+def feed(name):
+    return _send(name)
+
+
+@main_blueprint.route('/sitemap.xml')
+@main_blueprint.route('/sitemap-<int:chunk>.xml')
+@public
+def sitemap(chunk=None):
+    return _send(SITEMAP_INDEX if chunk is None else sitemap_name(chunk))
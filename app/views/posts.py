@@ -1,49 +1,106 @@
 import datetime as dt
 
-from flask import request, render_template, redirect, url_for
+from flask import request, render_template, redirect, url_for, current_app, abort
 from flask_login import login_required, current_user
 
 from . import main_blueprint, posts_blueprint
-from ..models import db, User, Post, Comment, Permission
+from ..models import db, User, Post, Comment, Archive, Permission, TrendingEpoch
 from ..forms import PostForm, CommentForm
-from ..utils import permission_required
+from ..utils import permission_required, conditional
+from ..pagination import paginate
+from ..search import search_posts, match_expression
+from .. import archive
+from ..trending import trending
+from ..comments import CommentThread
+from ..likes import likes, POST, COMMENT
+from ..cache import page_cache
+from ..engine import read_only
+
+
+def _latest(column):
+    return db.select([db.func.max(column)]).as_scalar()
+
+
+def _validators(row):
+    stamps = [value for value in row if value is not None]
+    return (max(stamps) if stamps else None,) + tuple(row)
+
+
+def index_validators():
+    # the archive changes on every post insert or delete, users on every author rename,
+    # likes and comments move the trending sidebar along with their post's modified_at
+    # and a decay that drops posts from it moves the epoch
+    row = db.session.query(_latest(Post.modified_at), _latest(Archive.modified_at), _latest(User.modified_at),
+                           _latest(TrendingEpoch.epoch)).one()
+    # the epoch is a unix time, only the ETag covers it
+    return _validators(row[:-1]) + row[-1:]
+
+
+def post_validators(post_id):
+    # comment inserts and deletes and post likes bump the post's counters and so its modified_at,
+    # comment likes only touch the comment
+    latest_comment = db.select([db.func.max(Comment.modified_at)]).where(Comment.post_id == post_id).as_scalar()
+    row = db.session.query(Post.modified_at, _latest(User.modified_at), latest_comment) \
+        .filter(Post.uid == post_id).first()
+    return _validators(row) if row is not None else None
 
 
 @main_blueprint.route('/')
+@read_only
+@page_cache.page('posts', 'users', 'trending')
+@conditional(index_validators)
 def index():
     query = request.args.get('q')
-    filter_ = None
+    if query is not None and not match_expression(query):
+        # a search box left blank, or holding no words, lists every post like no search at all
+        query = None
+    filters = []
+    year = request.args.get('year', type=int)
+    month = request.args.get('month', type=int)
+    if year is not None or month is not None:
+        try:
+            frm, to = archive.month_range(year or dt.date.today().year, month)
+        except ValueError:
+            abort(404)
+        filters.append(db.and_(Post.created_at >= frm, Post.created_at < to))
+    per_page = current_app.config['POSTS_PER_PAGE']
     if query is not None:
-        filter_ = Post.title.ilike('%' + query + '%')
-    month = request.args.get('month')
-    if month is not None:
-        month = int(month)
-        frm = dt.date.today().replace(month=month, day=1)
-        to = dt.date.today().replace(month=month, day=28)
-        max_day = 31
-        while max_day > 28:
-            try:
-                to = to.replace(day=max_day)
-                break
-            except ValueError:
-                max_day -= 1
-        filter_ = db.and_(Post.created_at >= dt.datetime.combine(frm, dt.time.min),
-                          Post.created_at <= dt.datetime.combine(to, dt.time.max))
-    qry = Post.query.order_by(db.desc(Post.created_at))
-    if filter_ is not None:
-        qry = qry.filter(filter_)
-    posts = qry.all()
-    archive = None
-    if posts:
-        latest, earliest = Post.query.with_entities(db.func.max(Post.created_at),
-                                                    db.func.min(Post.created_at)).one()
-        archive = [dt.date(dt.MINYEAR, mon, 1) for mon in range(latest.month, earliest.month - 1, -1)]
-    return render_template('index.html', posts=posts, q=query, archive=archive)
+        cursor = request.args.get('after') or request.args.get('before')
+        start = int(cursor) if cursor and cursor.isdigit() else 0
+        page = search_posts(query, per_page, start, filters)
+    else:
+        # only the lead post shows its body, so leave it out of the page query
+        qry = Post.query.options(db.defer(Post.body), db.joinedload(Post.author))
+        if filters:
+            qry = qry.filter(*filters)
+        page = paginate(qry, Post, per_page,
+                        after=request.args.get('after'), before=request.args.get('before'))
+    lead = None
+    if query is None and page.items and not page.has_prev:
+        lead = page.items[0]
+    args = dict((k, v) for k, v in dict(q=query, year=year, month=month).items() if v is not None)
+    return render_template('index.html', page=page, lead=lead, q=query, args=args,
+                           archive=archive.entries, trending=trending.top)
+
+
+@main_blueprint.route('/trending')
+@read_only
+@page_cache.page('posts', 'trending', timeout=60)
+def trending_posts():
+    return render_template('trending.html', posts=trending.top(current_app.config['TRENDING_PAGE_SIZE']))
+
+
+def render_post(post_id, form):
+    post = Post.query.options(db.joinedload(Post.author)).filter_by(uid=post_id).first_or_404()
+    return render_template('show.html', post=post, thread=CommentThread(post.uid), form=form)
 
 
 @posts_blueprint.route('/<int:post_id>')
+@read_only
+@page_cache.page('post:{post_id}', 'users')
+@conditional(post_validators)
 def show(post_id):
-    return render_template('show.html', post=Post.query.get_or_404(post_id), form=CommentForm())
+    return render_post(post_id, CommentForm())
 
 
 @posts_blueprint.route('/create', methods=['get', 'post'])
@@ -63,13 +120,21 @@ def create():
 @posts_blueprint.route('/<int:post_id>/like')
 @login_required
 def like(post_id, comment_id=None):
-    user = User.query.get(current_user.uid)
     if comment_id is not None:
-        entity = Comment.query.get(comment_id)
+        likes.like(current_user.uid, comment_id, COMMENT)
     else:
-        entity = Post.query.get(post_id)
-    entity.likes.append(user)
-    db.session.commit()
+        likes.like(current_user.uid, post_id, POST)
+    return redirect(url_for('posts.show', post_id=post_id))
+
+
+@posts_blueprint.route('/<int:post_id>/comments/<int:comment_id>/unlike')
+@posts_blueprint.route('/<int:post_id>/unlike')
+@login_required
+def unlike(post_id, comment_id=None):
+    if comment_id is not None:
+        likes.unlike(current_user.uid, comment_id, COMMENT)
+    else:
+        likes.unlike(current_user.uid, post_id, POST)
     return redirect(url_for('posts.show', post_id=post_id))
 
 
@@ -77,14 +142,16 @@ def like(post_id, comment_id=None):
 @posts_blueprint.route('/<int:post_id>/comments/<int:comment_id>/reply', methods=['post'])
 @login_required
 def post_comment(post_id, comment_id=None):
+    # replies inherit the post id, so the parent has to be on this post
+    if comment_id is not None and \
+            db.session.query(Comment.post_id).filter_by(uid=comment_id).scalar() != post_id:
+        abort(404)
     cf = CommentForm()
     if not cf.validate_on_submit():
-        return render_template('show.html', post=Post.query.get_or_404(post_id), form=cf)
-    comment = Comment(body=cf.body.data, author_id=current_user.uid)
+        return render_post(post_id, cf)
+    comment = Comment(body=cf.body.data, author_id=current_user.uid, post_id=post_id)
     if comment_id is not None:
         comment.parent_id = comment_id
-    else:
-        comment.post_id = post_id
     db.session.add(comment)
     db.session.commit()
     return redirect(url_for('posts.show', post_id=post_id))
@@ -1,16 +1,25 @@
 #!/usr/bin/env python
 
 import os
+import time
 
 from flask import current_app
 from flask_script import Manager, Shell, prompt_bool
 
-from app import create_app, db, models, forms
+from app import create_app, db, models, forms, search, archive, comments, counters, transfer, startup
+from app.mail import mail_queue
+from app.tokens import tokens
+from app.templating import template_cache
+from app.feeds import feeds
+from app.trending import trending
+from app.bench import hashing as bench_hashing, sqlite as bench_sqlite, data as bench_data, \
+    endpoints as bench_endpoints
 
 
 manager = Manager(create_app)
 manager.add_option('-c', '--config', dest='env', default='default', required=False,
                    help="The environment configuration to use: [development | testing | production]")
+bench = Manager(usage='Run performance benchmarks')
 
 
 @manager.command
@@ -47,11 +56,205 @@ def create_admin():
     return None
 
 
+@manager.command
+def rebuild_search_index():
+    """Rebuild the full-text search index of posts."""
+    search.rebuild_index()
+
+
+@manager.command
+def rebuild_archive():
+    """Recount the posts listed in the monthly archive."""
+    archive.rebuild()
+
+
+@manager.command
+def backfill_comment_posts():
+    """Store the root post id on replies created before replies kept it."""
+    comments.backfill_post_ids()
+
+
+@manager.command
+def build_feeds():
+    """Rewrite the Atom and RSS feeds and every sitemap file."""
+    feeds.rebuild()
+
+
+@manager.command
+def decay_trending():
+    """Rebase the trending scores on the current time and drop faded ones, run it every few hours."""
+    print('Dropped %d posts from trending.' % trending.decay())
+
+
+@manager.command
+def rebuild_trending():
+    """Recompute the trending scores from comments and likes."""
+    print('%d posts are trending.' % trending.rebuild())
+
+
+@manager.command
+def recount():
+    """Recompute like, comment and reply counters and repair any drift."""
+    print('Repaired %d rows.' % counters.recount())
+
+
+@manager.option('-w', '--workers', dest='workers', type=int, default=None,
+                help="Number of worker threads, defaults to MAIL_QUEUE_WORKERS")
+def mail_worker(workers=None):
+    """Run the outbound mail workers until interrupted."""
+    mail_queue.start(workers)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        mail_queue.stop()
+
+
+@manager.command
+def drain_mail():
+    """Send every queued message that is due and exit."""
+    print('Sent %d messages.' % mail_queue.drain())
+
+
+@manager.command
+def purge_tokens():
+    """Forget consumed one-time tokens that have expired."""
+    print('Purged %d tokens.' % tokens.purge())
+
+
+@manager.command
+def compile_templates():
+    """Compile every template into TEMPLATE_CACHE_DIR ahead of the first requests."""
+    if not current_app.config['TEMPLATE_CACHE_DIR']:
+        print('TEMPLATE_CACHE_DIR is not set.')
+        return 1
+    started = time.time()
+    names = template_cache.compile(current_app)
+    print('Compiled %d templates into %s in %.1fs.' % (
+        len(names), current_app.config['TEMPLATE_CACHE_DIR'], time.time() - started))
+
+
+# not dest='env', that is the manager's own -c option and would take its value
+@manager.option('-e', '--env', dest='target_env', default='default', help="Configuration to start the app with")
+@manager.option('-u', '--url', dest='urls', action='append',
+                help="Page to request after starting, may be repeated, defaults to / and /auth/login")
+@manager.option('-t', '--top', dest='top', type=int, default=10, help="Number of slowest packages to list")
+def profile_startup(target_env='default', urls=None, top=10):
+    """Time imports, app creation and first requests of a cold start."""
+    result = startup.profile(target_env, urls or ('/', '/auth/login'), top)
+    print('import %(import_ms).1fms, create_app %(create_app_ms).1fms' % result)
+    for request in result['requests']:
+        print('GET %(url)s: %(status)d, first %(first_ms).1fms, then %(second_ms).1fms' % request)
+    print('Slowest imports:')
+    for name, ms in result['packages']:
+        print('  %-20s %7.1fms' % (name, ms))
+
+
+@manager.option('directory', help="Directory to write users, posts and comments files into")
+@manager.option('-f', '--format', dest='fmt', choices=transfer.FORMATS, default='jsonl')
+@manager.option('-k', '--kind', dest='kinds', action='append', choices=transfer.KINDS,
+                help="Kind of record to export, may be repeated, defaults to all")
+@manager.option('-b', '--batch-size', dest='batch_size', type=int, default=transfer.BATCH_SIZE)
+def export_data(directory, fmt='jsonl', kinds=None, batch_size=transfer.BATCH_SIZE):
+    """Export users, posts and comments as JSON lines or CSV."""
+    started = time.time()
+    counts = transfer.export(directory, fmt, kinds or transfer.KINDS, batch_size)
+    for kind in transfer.KINDS:
+        if kind in counts:
+            print('Exported %d %s.' % (counts[kind], kind))
+    print('Done in %.1fs.' % (time.time() - started))
+
+
+@manager.option('directory', help="Directory holding files written by export_data")
+@manager.option('-f', '--format', dest='fmt', choices=transfer.FORMATS, default='jsonl')
+@manager.option('-k', '--kind', dest='kinds', action='append', choices=transfer.KINDS,
+                help="Kind of record to import, may be repeated, defaults to all")
+@manager.option('-b', '--batch-size', dest='batch_size', type=int, default=transfer.BATCH_SIZE)
+def import_data(directory, fmt='jsonl', kinds=None, batch_size=transfer.BATCH_SIZE):
+    """Import users, posts and comments exported by export_data."""
+    started = time.time()
+    results = transfer.import_(directory, fmt, kinds or transfer.KINDS, batch_size)
+    for kind in transfer.KINDS:
+        if kind in results:
+            print('%s: %s' % (kind.capitalize(), ', '.join('%d %s' % (count, name)
+                                                          for name, count in sorted(results[kind].items()))))
+    print('Done in %.1fs.' % (time.time() - started))
+
+
+@bench.option('-m', '--method', dest='method', default=None,
+              help="Hash method to measure, defaults to PASSWORD_HASH_METHOD")
+@bench.option('-s', '--seconds', dest='seconds', type=float, default=2.0)
+@bench.option('-p', '--processes', dest='processes', type=int, default=None)
+def hashing(method=None, seconds=2.0, processes=None):
+    """Measure password hashes per second per core."""
+    result = bench_hashing.run(method or current_app.config['PASSWORD_HASH_METHOD'], seconds, processes)
+    print('%(method)s: %(single_core_per_second).1f/s on one core, '
+          '%(per_second).1f/s on %(processes)d processes (%(per_second_per_core).1f/s per core)' % result)
+
+
+@bench.option('-t', '--threads', dest='threads', type=int, default=8)
+@bench.option('-s', '--seconds', dest='seconds', type=float, default=5.0)
+@bench.option('-w', '--write-ratio', dest='write_ratio', type=float, default=0.2,
+              help="Share of requests that like or unlike a post")
+def sqlite(threads=8, seconds=5.0, write_ratio=0.2):
+    """Compare request throughput on a scratch database with default and production SQLite settings."""
+    for name, result in sorted(bench_sqlite.run(threads, seconds, write_ratio).items()):
+        print('%s: %.1f requests/s, %d reads, %d writes, %d database errors'
+              % (name, result['per_second'], result['reads'], result['writes'], result['errors']))
+
+
+@bench.option('-u', '--users', dest='users', type=int, default=100)
+@bench.option('-p', '--posts', dest='posts', type=int, default=1000)
+@bench.option('-c', '--comments', dest='comments', type=int, default=5000)
+@bench.option('-l', '--likes', dest='likes', type=int, default=20000)
+@bench.option('-k', '--skew', dest='skew', type=float, default=3.0,
+              help="How strongly comments and likes favour the newest posts")
+@bench.option('--seed', dest='seed', type=int, default=0)
+def generate(users=100, posts=1000, comments=5000, likes=20000, skew=3.0, seed=0):
+    """Fill the database with a synthetic dataset for benchmarks."""
+    print('Created %(users)d users, %(posts)d posts, %(comments)d comments (%(largest_thread)d in the largest '
+          'thread), %(post_likes)d post likes and %(comment_likes)d comment likes.'
+          % bench_data.generate(users, posts, comments, likes, skew=skew, seed=seed))
+
+
+@bench.option('-n', '--requests', dest='requests', type=int, default=200)
+@bench.option('-e', '--endpoint', dest='endpoints', action='append',
+              help="Scenario to run, may be repeated: %s" % ', '.join(sorted(bench_endpoints.SCENARIOS)))
+@bench.option('-o', '--output', dest='output', default=None, help="Save the results as JSON")
+@bench.option('-b', '--baseline', dest='baseline', default=None, help="JSON results to compare against")
+@bench.option('-t', '--threshold', dest='threshold', type=float, default=0.1)
+def endpoints(requests=200, endpoints=None, output=None, baseline=None, threshold=0.1):
+    """Measure latency, queries and memory per endpoint on the current database."""
+    result = bench_endpoints.run(requests, endpoints)
+    for name, stats in sorted(result['endpoints'].items()):
+        print('%-12s p50 %7.2fms  p95 %7.2fms  p99 %7.2fms  %5.1f queries  %8.1f KiB peak' % (
+            name, stats['p50_ms'], stats['p95_ms'], stats['p99_ms'], stats['queries'], stats['peak_kib']))
+    if output:
+        bench_endpoints.save(result, output)
+    if baseline:
+        return _compare(bench_endpoints.load(baseline), result, threshold)
+
+
+@bench.option('baseline')
+@bench.option('current')
+@bench.option('-t', '--threshold', dest='threshold', type=float, default=0.1)
+def compare(baseline, current, threshold=0.1):
+    """Compare two saved endpoint benchmark runs, exit with 1 on regressions."""
+    return _compare(bench_endpoints.load(baseline), bench_endpoints.load(current), threshold)
+
+
+def _compare(baseline, current, threshold):
+    lines, regressed = bench_endpoints.compare(baseline, current, threshold)
+    print('\n'.join(lines))
+    return 1 if regressed else None
+
+
 def shell_context():
     return dict(app=current_app, db=db, models=models, forms=forms)
 
 
 manager.add_command('shell', Shell(make_context=shell_context))
+manager.add_command('bench', bench)
 
 if __name__ == '__main__':
     manager.run()
@@ -0,0 +1,66 @@
+import re
+
+import pytest
+
+from app import create_app, db
+from app.identity import user_cache
+from app.models import Role, User, Post
+from app.permissions import permission_registry
+
+
+@pytest.fixture
+def app(tmpdir):
+    app = create_app('testing')
+    app.config.update(
+        SQLALCHEMY_DATABASE_URI='sqlite://',
+        MAIL_QUEUE_AUTOSTART=False,
+        FEEDS_DIR=str(tmpdir.join('feeds')),
+        FILE_UPLOAD_PATH=str(tmpdir.join('profile_pictures')),
+    )
+    with app.app_context():
+        db.create_all()
+        Role.populate()
+        yield app
+        db.session.remove()
+        db.drop_all()
+    # module level state outlives the app
+    user_cache.clear()
+    permission_registry.invalidate()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def make_user(app):
+    def make_user(username='alice', password='password123', activated=True, role='user'):
+        user = User(username=username, email='%s@example.com' % username, password=password,
+                    activated=activated)
+        user.role = Role.query.filter_by(name=role).first()
+        db.session.add(user)
+        db.session.commit()
+        return user
+    return make_user
+
+
+@pytest.fixture
+def make_post(app):
+    def make_post(author, title, body='body', **fields):
+        post = Post(title=title, body=body, author_id=author.uid, **fields)
+        db.session.add(post)
+        db.session.commit()
+        return post
+    return make_post
+
+
+def csrf_token(client, url):
+    """The CSRF token of the first form on the page at ``url``."""
+    html = client.get(url).get_data(as_text=True)
+    return re.search(r'name="csrf_token" type="hidden" value="([^"]+)"', html).group(1)
+
+
+def login(client, username='alice', password='password123'):
+    return client.post('/auth/login', data=dict(username=username, password=password,
+                                                csrf_token=csrf_token(client, '/auth/login')))
@@ -0,0 +1,56 @@
+import os
+
+from app import db
+from app.identity import ACTIVATED_KEY, is_public
+from app.images import DEFAULT_AVATAR
+from app.models import User
+
+from .conftest import login
+
+
+def test_inactive_users_are_sent_to_activate(client, make_user):
+    make_user(activated=False)
+    login(client)
+    rv = client.get('/')
+    assert rv.status_code == 302 and rv.headers['Location'].endswith('/auth/account/inactive')
+    assert client.get('/auth/account/inactive').status_code == 200
+
+
+def test_active_users_are_not(client, make_user):
+    make_user()
+    login(client)
+    assert client.get('/').status_code == 200
+    with client.session_transaction() as session:
+        assert session[ACTIVATED_KEY] is True
+
+
+def test_flag_left_without_a_login_is_dropped(client):
+    with client.session_transaction() as session:
+        session[ACTIVATED_KEY] = False
+    assert client.get('/').status_code == 200
+    with client.session_transaction() as session:
+        assert ACTIVATED_KEY not in session
+
+
+def test_flag_of_a_deleted_user_is_dropped(client, make_user):
+    make_user(activated=False)
+    login(client)
+    db.session.delete(User.query.filter_by(username='alice').one())
+    db.session.commit()
+    assert client.get('/').status_code == 200
+
+
+def test_public_endpoints_never_load_the_user(app, client, make_user, monkeypatch):
+    make_user()
+    login(client)
+    os.makedirs(app.config['FILE_UPLOAD_PATH'])
+    open(os.path.join(app.config['FILE_UPLOAD_PATH'], DEFAULT_AVATAR), 'wb').close()
+    loaded = []
+    loader = app.login_manager.user_callback
+    monkeypatch.setattr(app.login_manager, 'user_callback', lambda uid: loaded.append(uid) or loader(uid))
+    assert is_public('auth.profile_picture') and is_public('static')
+    assert client.get('/auth/account/profile/%s' % DEFAULT_AVATAR).status_code == 200
+    assert client.get('/api/v1/posts').status_code == 200
+    assert loaded == []
+    client.get('/')
+    assert loaded
@@ -0,0 +1,68 @@
+from datetime import datetime
+
+from app import db
+from app.models import Comment
+
+
+def _get(client, url):
+    rv = client.get(url)
+    return rv.status_code, rv.get_json()
+
+
+def test_posts_are_paged_with_default_fields(client, make_user, make_post):
+    author = make_user()
+    for n in range(3):
+        make_post(author, 'Post %d' % n, created_at=datetime(2018, 1, 1 + n))
+    status, data = _get(client, '/api/v1/posts?limit=2')
+    assert status == 200
+    assert [post['title'] for post in data['posts']] == ['Post 2', 'Post 1']
+    assert set(data['posts'][0]) == {'id', 'title', 'created_at', 'author', 'like_count', 'comment_count'}
+    assert data['posts'][0]['author'] == dict(id=author.uid, username='alice')
+    _, data = _get(client, '/api/v1/posts?limit=2&after=%s' % data['next_cursor'])
+    assert [post['title'] for post in data['posts']] == ['Post 0'] and data['next_cursor'] is None
+
+
+def test_only_requested_fields_are_read(client, make_user, make_post):
+    post_id = make_post(make_user(), 'Post', 'secret body').uid
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+    db.event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        status, data = _get(client, '/api/v1/posts/%d?fields=title' % post_id)
+    finally:
+        db.event.remove(db.engine, 'before_cursor_execute', record)
+    assert status == 200 and data == dict(post=dict(title='Post'))
+    assert not any('posts.body' in statement or 'JOIN users' in statement for statement in statements)
+
+
+def test_unknown_fields_and_bad_limits_are_400(client, make_user, make_post):
+    make_post(make_user(), 'Post')
+    status, data = _get(client, '/api/v1/posts?fields=title,password_hash')
+    assert status == 400 and 'password_hash' in data['error']
+    assert _get(client, '/api/v1/posts?limit=0')[0] == 400
+
+
+def test_missing_rows_are_404(client):
+    assert _get(client, '/api/v1/posts/404')[0] == 404
+    assert _get(client, '/api/v1/posts/404/comments')[0] == 404
+    assert _get(client, '/api/v1/authors/nobody')[0] == 404
+
+
+def test_comments_are_nested(client, make_user, make_post):
+    author = make_user()
+    post = make_post(author, 'Post')
+    top = Comment(body='top', author_id=author.uid, post_id=post.uid)
+    db.session.add(top)
+    db.session.commit()
+    db.session.add(Comment(body='reply', author_id=author.uid, post_id=post.uid, parent_id=top.uid))
+    db.session.commit()
+    _, data = _get(client, '/api/v1/posts/%d/comments?fields=body' % post.uid)
+    assert data == dict(comments=[dict(body='top', replies=[dict(body='reply', replies=[])])])
+
+
+def test_author(client, make_user, make_post):
+    make_post(make_user(), 'Post')
+    _, data = _get(client, '/api/v1/authors/alice?fields=username,post_count')
+    assert data == dict(author=dict(username='alice', post_count=1))
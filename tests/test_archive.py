@@ -0,0 +1,51 @@
+from datetime import datetime
+
+from app import db, archive
+from app.models import Archive, Post
+
+
+def _counts():
+    return sorted((entry.year, entry.month, entry.post_count) for entry in Archive.query)
+
+
+def test_counts_follow_inserts_moves_and_deletes(make_user, make_post):
+    author = make_user()
+    first = make_post(author, 'First', created_at=datetime(2018, 3, 1))
+    make_post(author, 'Second', created_at=datetime(2018, 3, 31, 23, 59))
+    assert _counts() == [(2018, 3, 2)]
+
+    first.created_at = datetime(2018, 4, 1)
+    db.session.commit()
+    assert _counts() == [(2018, 3, 1), (2018, 4, 1)]
+
+    db.session.delete(Post.query.filter_by(title='Second').one())
+    db.session.commit()
+    assert _counts() == [(2018, 3, 0), (2018, 4, 1)]
+    assert [(entry.year, entry.month) for entry in archive.entries()] == [(2018, 4)]
+
+
+def test_rebuild_matches_the_incremental_counts(make_user, make_post):
+    author = make_user()
+    for n, created_at in enumerate([datetime(2017, 12, 31), datetime(2018, 1, 1), datetime(2018, 1, 15)]):
+        make_post(author, 'Post %d' % n, created_at=created_at)
+    db.session.delete(Post.query.filter_by(title='Post 0').one())
+    db.session.commit()
+    incremental = [count for count in _counts() if count[2]]
+    archive.rebuild()
+    assert _counts() == incremental == [(2018, 1, 2)]
+
+
+def test_month_range():
+    assert archive.month_range(2018, 12) == (datetime(2018, 12, 1), datetime(2019, 1, 1))
+    assert archive.month_range(2018) == (datetime(2018, 1, 1), datetime(2019, 1, 1))
+
+
+def test_index_filters_by_month(client, make_user, make_post):
+    author = make_user()
+    make_post(author, 'In March', created_at=datetime(2018, 3, 10))
+    make_post(author, 'In April', created_at=datetime(2018, 4, 10))
+    html = client.get('/?year=2018&month=3').get_data(as_text=True)
+    assert 'In March' in html and 'In April</a>' not in html.split('<h3>Archive</h3>')[0]
+    html = client.get('/?year=2018').get_data(as_text=True)
+    assert 'In March' in html and 'In April' in html
+    assert client.get('/?year=2018&month=13').status_code == 404
@@ -0,0 +1,46 @@
+from flask_login import current_user
+
+from app.forms import is_available
+from app.models import QueuedMail
+
+from .conftest import login, csrf_token
+
+
+def test_login_ignores_case(client, make_user):
+    make_user('Alice')
+    with client:
+        assert login(client, 'alice').status_code == 302
+        assert current_user.username == 'Alice'
+    client.get('/auth/logout')
+    with client:
+        login(client, 'ALICE@example.com')
+        assert current_user.is_authenticated
+
+
+def test_wrong_password_is_refused(client, make_user):
+    make_user()
+    with client:
+        assert login(client, 'alice', 'wrong').status_code == 200
+        assert not current_user.is_authenticated
+
+
+def test_recovery_finds_the_email_ignoring_case(client, make_user):
+    make_user()
+    rv = client.post('/auth/account/recovery', data=dict(
+        email='Alice@Example.com', csrf_token=csrf_token(client, '/auth/account/recovery')))
+    assert rv.status_code == 200
+    assert QueuedMail.query.one().recipient == 'alice@example.com'
+
+
+def test_availability_ignores_case(make_user):
+    make_user()
+    assert not is_available('username', 'ALICE')
+    assert not is_available('email', 'alice@EXAMPLE.com')
+    assert is_available('username', 'bob')
+
+
+def test_availability_endpoint(client, make_user):
+    make_user()
+    assert client.get('/auth/available?username=Alice').get_json() == dict(
+        field='username', value='Alice', available=False)
+    assert client.get('/auth/available').status_code == 400
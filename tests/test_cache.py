@@ -0,0 +1,82 @@
+import time
+
+import pytest
+
+from app import db
+from app.cache import MemoryBackend, SQLiteBackend, page_cache, invalidate_on_commit
+from app.models import Post, Comment
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def backend(request, tmpdir):
+    if request.param == 'memory':
+        return MemoryBackend(maxsize=2)
+    return SQLiteBackend(str(tmpdir.join('cache.sqlite3')))
+
+
+def test_entries_are_dropped_by_tag(backend):
+    backend.set('a', 1, 60, ['posts', 'post:1'])
+    backend.set('b', 2, 60, ['post:2'])
+    backend.invalidate(['post:1'])
+    assert backend.get('a') is None and backend.get('b') == 2
+    backend.clear()
+    assert backend.get('b') is None
+
+
+def test_entries_expire(backend, monkeypatch):
+    backend.set('a', 1, 60)
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now + 61)
+    assert backend.get('a') is None
+
+
+def test_memory_backend_evicts_least_recently_used():
+    backend = MemoryBackend(maxsize=2)
+    backend.set('a', 1, 60)
+    backend.set('b', 2, 60)
+    backend.get('a')
+    backend.set('c', 3, 60)
+    assert (backend.get('a'), backend.get('b'), backend.get('c')) == (1, None, 3)
+
+
+@pytest.fixture
+def memory_cache(app, monkeypatch):
+    monkeypatch.setattr(page_cache, 'backend', MemoryBackend())
+    return page_cache.backend
+
+
+def _title_shown(client, post_id, title):
+    return title in client.get('/posts/%d' % post_id).get_data(as_text=True)
+
+
+def test_commits_invalidate_cached_pages(client, memory_cache, make_user, make_post):
+    author = make_user()
+    post = make_post(author, 'First title')
+    assert _title_shown(client, post.uid, 'First title')
+
+    # plain SQL bypasses invalidation, the cached page is still served
+    db.session.execute(Post.__table__.update().where(Post.uid == post.uid).values(title='Second title'))
+    db.session.commit()
+    assert _title_shown(client, post.uid, 'First title')
+
+    post = Post.query.get(post.uid)
+    post.title = 'Third title'
+    db.session.commit()
+    assert _title_shown(client, post.uid, 'Third title')
+
+
+def test_comments_invalidate_their_post(client, memory_cache, make_user, make_post):
+    author = make_user()
+    post = make_post(author, 'Post')
+    client.get('/posts/%d' % post.uid)
+    db.session.add(Comment(body='first comment', author_id=author.uid, post_id=post.uid))
+    db.session.commit()
+    assert _title_shown(client, post.uid, 'first comment')
+
+
+def test_rollback_discards_pending_tags(app, memory_cache):
+    memory_cache.set('page', 'html', 60, ['post:1'])
+    invalidate_on_commit('post:1')
+    db.session.rollback()
+    db.session.commit()
+    assert memory_cache.get('page') == 'html'
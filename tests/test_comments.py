@@ -0,0 +1,64 @@
+from app import db
+from app.comments import CommentThread, backfill_post_ids
+from app.models import Comment
+
+from .conftest import login, csrf_token
+
+
+def _comment(author, body, post=None, parent=None):
+    comment = Comment(body=body, author_id=author.uid, post_id=post.uid if post else None,
+                      parent_id=parent.uid if parent else None)
+    db.session.add(comment)
+    db.session.commit()
+    return comment
+
+
+def test_thread_is_linked_in_memory(app, make_user, make_post):
+    author = make_user()
+    post = make_post(author, 'Post')
+    top = _comment(author, 'top', post)
+    reply = _comment(author, 'reply', post, top)
+    _comment(author, 'nested', post, reply)
+    post_id = post.uid
+    db.session.expunge_all()
+
+    thread = CommentThread(post_id)
+    queries = []
+
+    def count(*args):
+        queries.append(args)
+    db.event.listen(db.engine, 'before_cursor_execute', count)
+    try:
+        bodies = [(c.body, [(r.body, [n.body for n in r.comments]) for r in c.comments])
+                  for c in thread.comments]
+    finally:
+        db.event.remove(db.engine, 'before_cursor_execute', count)
+    assert bodies == [('top', [('reply', ['nested'])])]
+    assert queries == []
+
+
+def test_backfill_copies_root_post_ids(make_user, make_post):
+    author = make_user()
+    post = make_post(author, 'Post')
+    top = _comment(author, 'top', post)
+    reply = _comment(author, 'reply', parent=top)
+    nested = _comment(author, 'nested', parent=reply)
+    backfill_post_ids()
+    assert [db.session.query(Comment.post_id).filter_by(uid=c.uid).scalar() for c in (reply, nested)] == \
+        [post.uid, post.uid]
+
+
+def test_reply_to_a_comment_on_another_post_is_refused(client, make_user, make_post):
+    author = make_user()
+    post, other = make_post(author, 'Post'), make_post(author, 'Other')
+    top = _comment(author, 'top', other)
+    login(client)
+    token = csrf_token(client, '/posts/%d' % other.uid)
+    rv = client.post('/posts/%d/comments/%d/reply' % (post.uid, top.uid),
+                     data=dict(body='hijack', csrf_token=token))
+    assert rv.status_code == 404
+    rv = client.post('/posts/%d/comments/%d/reply' % (other.uid, top.uid),
+                     data=dict(body='fine', csrf_token=token))
+    assert rv.status_code == 302
+    assert Comment.query.filter_by(body='fine').one().post_id == other.uid
+    assert Comment.query.filter_by(body='hijack').first() is None
@@ -0,0 +1,76 @@
+from app import db
+from app.cache import MemoryBackend, page_cache
+from app.likes import likes, COMMENT
+from app.models import Comment
+
+from .conftest import login
+
+
+def _revalidate(client, url, rv):
+    return client.get(url, headers={'If-None-Match': rv.headers['ETag']}).status_code
+
+
+def test_unchanged_post_is_not_modified(client, make_user, make_post):
+    post = make_post(make_user(), 'Post')
+    url = '/posts/%d' % post.uid
+    rv = client.get(url)
+    assert rv.status_code == 200 and rv.headers['ETag'] and rv.headers['Last-Modified']
+    assert _revalidate(client, url, rv) == 304
+    assert client.get(url, headers={'If-Modified-Since': rv.headers['Last-Modified']}).status_code == 304
+
+
+def test_post_changes_invalidate_the_etag(client, make_user, make_post):
+    author = make_user()
+    post = make_post(author, 'Post')
+    url = '/posts/%d' % post.uid
+    rv = client.get(url)
+    post.title = 'Edited'
+    db.session.commit()
+    assert _revalidate(client, url, rv) == 200
+
+
+def test_comment_activity_invalidates_the_post(client, make_user, make_post):
+    author = make_user()
+    post = make_post(author, 'Post')
+    url = '/posts/%d' % post.uid
+    comment = Comment(body='top', author_id=author.uid, post_id=post.uid)
+    db.session.add(comment)
+    db.session.commit()
+    comment_id = comment.uid
+    rv = client.get(url)
+    likes.like(author.uid, comment_id, COMMENT)
+    rv2 = client.get(url, headers={'If-None-Match': rv.headers['ETag']})
+    assert rv2.status_code == 200 and rv2.headers['ETag'] != rv.headers['ETag']
+    likes.unlike(author.uid, comment_id, COMMENT)
+    assert _revalidate(client, url, rv2) == 200
+
+
+def test_etag_depends_on_the_user(client, make_user, make_post):
+    post = make_post(make_user(), 'Post')
+    url = '/posts/%d' % post.uid
+    rv = client.get(url)
+    login(client)
+    assert _revalidate(client, url, rv) == 200
+
+
+def test_missing_post_is_404(client):
+    assert client.get('/posts/404', headers={'If-None-Match': '"x"'}).status_code == 404
+
+
+def test_cached_pages_are_revalidated_without_queries(client, make_user, make_post, monkeypatch):
+    monkeypatch.setattr(page_cache, 'backend', MemoryBackend())
+    url = '/posts/%d' % make_post(make_user(), 'Post').uid
+    rv, index = client.get(url), client.get('/')
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+    db.event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        cached = client.get(url)
+        assert _revalidate(client, url, rv) == 304
+        assert _revalidate(client, '/', index) == 304
+    finally:
+        db.event.remove(db.engine, 'before_cursor_execute', record)
+    assert statements == []
+    assert cached.get_data() == rv.get_data() and cached.headers['ETag'] == rv.headers['ETag']
@@ -0,0 +1,48 @@
+from app import db
+from app.counters import recount
+from app.models import Post, Comment, users_like_posts
+
+
+def _counts(model, uid, *names):
+    return db.session.query(*[getattr(model, name) for name in names]).filter(model.uid == uid).one()
+
+
+def test_comments_and_replies_are_counted(make_user, make_post):
+    author = make_user()
+    post = make_post(author, 'Post')
+    top = Comment(body='top', author_id=author.uid, post_id=post.uid)
+    db.session.add(top)
+    db.session.commit()
+    reply = Comment(body='reply', author_id=author.uid, post_id=post.uid, parent_id=top.uid)
+    db.session.add(reply)
+    db.session.commit()
+    assert _counts(Post, post.uid, 'comment_count') == (2,)
+    assert _counts(Comment, top.uid, 'reply_count') == (1,)
+
+    db.session.delete(reply)
+    db.session.commit()
+    assert _counts(Post, post.uid, 'comment_count') == (1,)
+    assert _counts(Comment, top.uid, 'reply_count') == (0,)
+
+
+def test_likes_collection_is_counted(make_user, make_post):
+    author, fan = make_user(), make_user('bob')
+    post = make_post(author, 'Post')
+    post.likes.append(fan)
+    db.session.commit()
+    assert _counts(Post, post.uid, 'like_count') == (1,)
+    post.likes.remove(fan)
+    db.session.commit()
+    assert _counts(Post, post.uid, 'like_count') == (0,)
+
+
+def test_recount_repairs_drift(make_user, make_post):
+    author, fan = make_user(), make_user('bob')
+    post, fine = make_post(author, 'Post'), make_post(author, 'Fine')
+    db.session.execute(users_like_posts.insert().values(user_id=fan.uid, post_id=post.uid))
+    db.session.execute(Post.__table__.update().where(Post.uid == post.uid).values(comment_count=7))
+    db.session.commit()
+    assert recount() == 1
+    assert _counts(Post, post.uid, 'like_count', 'comment_count') == (1, 0)
+    assert _counts(Post, fine.uid, 'like_count', 'comment_count') == (0, 0)
+    assert recount() == 0
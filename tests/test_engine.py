@@ -0,0 +1,64 @@
+import sqlite3
+
+import pytest
+from flask import g
+
+from app import create_app, db
+from app.models import Role
+
+
+@pytest.fixture
+def tuned_app(tmpdir):
+    app = create_app('testing')
+    app.config.update(
+        SQLALCHEMY_DATABASE_URI='sqlite:///%s' % tmpdir.join('tuned.sqlite3'),
+        SQLALCHEMY_POOL_SIZE=2,
+        SQLITE_PRAGMAS=(('journal_mode', 'wal'), ('busy_timeout', 100)),
+        SQLITE_IMMEDIATE_WRITES=True,
+        SQLITE_READ_POOL_SIZE=2,
+        FEEDS_DIR=str(tmpdir.join('feeds')),
+    )
+    with app.app_context():
+        db.create_all()
+        Role.populate()
+        yield app
+        db.session.remove()
+
+
+def _write_lock_taken(app):
+    conn = sqlite3.connect(app.config['SQLALCHEMY_DATABASE_URI'][len('sqlite:///'):], timeout=0,
+                           isolation_level=None)
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+    except sqlite3.OperationalError:
+        return True
+    finally:
+        conn.close()
+    return False
+
+
+def test_write_lock_is_taken_at_the_first_write(tuned_app):
+    assert Role.query.count() == 3
+    assert not _write_lock_taken(tuned_app)
+    role = Role.query.first()
+    role.permissions = 0
+    db.session.flush()
+    assert _write_lock_taken(tuned_app)
+    db.session.commit()
+    assert not _write_lock_taken(tuned_app)
+
+
+def test_read_pool_refuses_writes(tuned_app):
+    reader = db.get_read_engine()
+    assert reader.execute('SELECT count(*) FROM roles').scalar() == 3
+    with pytest.raises(Exception):
+        reader.execute("UPDATE roles SET permissions = 0")
+
+
+def test_read_only_flag_is_reset_per_request(tuned_app):
+    client = tuned_app.test_client()
+    # the test client shares the app context, and g, with this test
+    client.get('/')
+    assert g.db_read_only is True
+    client.get('/auth/login')
+    assert g.db_read_only is False
@@ -0,0 +1,39 @@
+import os
+
+from app import db
+from app.feeds import feeds, ATOM, SITEMAP_INDEX, sitemap_name
+
+
+def test_missing_files_are_not_built_in_the_request(app, client):
+    rv = client.get('/feeds/atom.xml')
+    assert rv.status_code == 503 and rv.headers['Retry-After']
+    assert client.get('/sitemap-3.xml').status_code == 404
+    assert not os.path.exists(feeds.path(ATOM))
+
+
+def test_commits_write_the_feeds(app, client, make_user, make_post):
+    post = make_post(make_user(), 'Feed me', 'a <b>body</b>')
+    rv = client.get('/feeds/atom.xml')
+    assert rv.status_code == 200 and rv.mimetype == 'application/atom+xml'
+    assert 'Feed me' in rv.get_data(as_text=True) and '&lt;b&gt;' in rv.get_data(as_text=True)
+    assert client.get('/feeds/atom.xml', headers={'If-None-Match': rv.headers['ETag']}).status_code == 304
+    assert '/posts/%d' % post.uid in client.get('/sitemap-0.xml').get_data(as_text=True)
+    assert '/sitemap-0.xml' in client.get('/sitemap.xml').get_data(as_text=True)
+
+    post.title = 'Renamed'
+    db.session.commit()
+    assert 'Renamed' in client.get('/feeds/rss.xml').get_data(as_text=True)
+
+
+def test_only_changed_sitemap_chunks_are_rewritten(app, make_user, make_post):
+    app.config['SITEMAP_CHUNK_SIZE'] = 2
+    author = make_user()
+    for n in range(4):
+        make_post(author, 'Post %d' % n)
+    os.remove(feeds.path(sitemap_name(0)))
+    make_post(author, 'Post 4')
+    assert not os.path.exists(feeds.path(sitemap_name(0)))
+    assert os.path.exists(feeds.path(sitemap_name(2)))
+    feeds.rebuild()
+    assert os.path.exists(feeds.path(sitemap_name(0)))
+    assert os.path.exists(feeds.path(SITEMAP_INDEX))
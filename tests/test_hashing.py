@@ -0,0 +1,40 @@
+import pytest
+
+from app.hashing import PasswordHasher
+from app.models import User
+
+from .conftest import login
+
+
+@pytest.mark.parametrize('workers', [0, 1])
+def test_hash_and_verify_round_trip(app, workers):
+    app.config['PASSWORD_HASH_WORKERS'] = workers
+    hasher = PasswordHasher()
+    try:
+        pwhash = hasher.hash('secret')
+        assert pwhash.startswith(app.config['PASSWORD_HASH_METHOD'] + '$')
+        assert hasher.verify(pwhash, 'secret') and not hasher.verify(pwhash, 'wrong')
+        assert (hasher._pool is None) == (workers == 0)
+    finally:
+        if hasher._pool is not None:
+            hasher._pool.shutdown()
+
+
+def test_login_upgrades_old_hashes(app, client, make_user):
+    method = app.config['PASSWORD_HASH_METHOD']
+    app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:500'
+    make_user()
+    app.config['PASSWORD_HASH_METHOD'] = method
+    old = User.query.filter_by(username='alice').one().password_hash
+    assert old.startswith('pbkdf2:sha256:500$')
+    login(client)
+    user = User.query.filter_by(username='alice').one()
+    assert user.password_hash != old and user.password_hash.startswith(method + '$')
+    assert user.verify_password('password123')
+
+
+def test_current_hashes_are_kept(app, client, make_user):
+    make_user()
+    current = User.query.filter_by(username='alice').one().password_hash
+    login(client)
+    assert User.query.filter_by(username='alice').one().password_hash == current
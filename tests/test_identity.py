@@ -0,0 +1,33 @@
+from app import db
+from app.identity import load_user, user_cache
+
+
+def test_snapshot_is_cached(make_user):
+    user = make_user()
+    assert load_user(user.uid).username == 'alice'
+    assert user_cache.get(user.uid)['username'] == 'alice'
+    assert load_user(404) is None
+
+
+def test_updates_and_deletes_drop_the_snapshot(make_user):
+    user = make_user()
+    load_user(user.uid)
+    user.username = 'alicia'
+    db.session.commit()
+    assert user_cache.get(user.uid) is None
+    assert load_user(user.uid).username == 'alicia'
+
+    db.session.delete(user)
+    db.session.commit()
+    assert user_cache.get(user.uid) is None
+    assert load_user(user.uid) is None
+
+
+def test_other_fields_come_from_the_row(make_user):
+    user = make_user()
+    cached = load_user(user.uid)
+    assert cached.email == 'alice@example.com'
+    assert cached.is_active and cached.get_id() == str(user.uid)
+    cached.bio = 'hello'
+    db.session.commit()
+    assert user.bio == 'hello'
@@ -0,0 +1,56 @@
+import pytest
+
+from app import db
+from app.instrumentation import instrumentation, RequestStats, statement_shape, UNMATCHED
+
+from .conftest import login
+
+
+def test_in_lists_share_a_shape():
+    assert statement_shape('SELECT 1 WHERE uid IN (?, ?, ?)') == statement_shape('SELECT 1 WHERE uid IN (?,?)')
+
+
+def test_repeated_statements_are_suspects():
+    stats = RequestStats(repeat_threshold=3)
+    for _ in range(3):
+        stats.record('SELECT * FROM users WHERE uid = ?', 0.001)
+    stats.record('SELECT * FROM posts', 0.001)
+    assert stats.count == 4
+    assert [(count, shape) for count, shape, origin in stats.suspects()] == [
+        (3, 'SELECT * FROM users WHERE uid = ?')]
+
+
+def test_server_timing_header(client):
+    assert 'db;dur=' in client.get('/').headers['Server-Timing']
+
+
+@pytest.fixture
+def stats_url(app, monkeypatch):
+    monkeypatch.setattr(instrumentation, '_totals', {})
+    app.add_url_rule('/_stats/sql', 'sql_stats', instrumentation._stats)
+    return '/_stats/sql'
+
+
+def test_stats_survive_unmatched_urls(client, stats_url, make_user):
+    make_user(role='admin')
+    login(client)
+    assert client.get('/no/such/page').status_code == 404
+    client.get('/')
+    rv = client.get(stats_url)
+    assert rv.status_code == 200
+    endpoints = rv.get_json()['endpoints']
+    assert endpoints[UNMATCHED]['requests'] == 1 and endpoints['main.index']['requests'] == 1
+
+
+def test_stats_are_for_admins(client, stats_url, make_user):
+    make_user()
+    login(client)
+    assert client.get(stats_url).status_code == 403
+
+
+def test_failed_statements_leave_nothing_on_the_connection(app):
+    with db.engine.connect() as conn:
+        with pytest.raises(Exception):
+            conn.execute('SELECT * FROM no_such_table')
+        conn.execute('SELECT 1')
+        assert isinstance(conn.connection.info['query_started'], float)
@@ -0,0 +1,80 @@
+import pytest
+
+from app import create_app, db
+from app.likes import likes, POST, COMMENT
+from app.models import Post, Comment
+
+
+def _like_count(model, uid):
+    return db.session.query(model.like_count).filter(model.uid == uid).scalar()
+
+
+def test_like_and_unlike_are_idempotent(make_user, make_post):
+    author, fan = make_user(), make_user('bob')
+    post = make_post(author, 'Post')
+    assert likes.like(fan.uid, post.uid) is True
+    assert likes.like(fan.uid, post.uid) is False
+    assert _like_count(Post, post.uid) == 1
+    assert likes.unlike(fan.uid, post.uid) is True
+    assert likes.unlike(fan.uid, post.uid) is False
+    assert _like_count(Post, post.uid) == 0
+
+
+def test_liking_a_missing_entity_changes_nothing(make_user):
+    fan = make_user()
+    assert likes.like(fan.uid, 404) is False
+    assert likes.like(fan.uid, 404, COMMENT) is False
+
+
+def test_comment_likes(make_user, make_post):
+    author = make_user()
+    comment = Comment(body='top', author_id=author.uid, post_id=make_post(author, 'Post').uid)
+    db.session.add(comment)
+    db.session.commit()
+    assert likes.like(author.uid, comment.uid, COMMENT) is True
+    assert _like_count(Comment, comment.uid) == 1
+
+
+@pytest.fixture
+def write_behind(app, monkeypatch):
+    # buffer in the test's thread and flush by hand instead of from the background thread
+    app.config['LIKES_WRITE_BEHIND'] = True
+    app.extensions['likes'].thread = object()
+    return likes
+
+
+def test_write_behind_buffers_until_flushed(write_behind, make_user, make_post):
+    author, fan = make_user(), make_user('bob')
+    post = make_post(author, 'Post')
+    assert write_behind.like(fan.uid, post.uid) is None
+    assert write_behind.like(author.uid, post.uid) is None
+    assert _like_count(Post, post.uid) == 0
+    assert write_behind.flush() == 2
+    assert _like_count(Post, post.uid) == 2
+    assert write_behind.flush() == 0
+
+
+def test_write_behind_keeps_the_last_call_per_user(write_behind, make_user, make_post):
+    author, fan = make_user(), make_user('bob')
+    post = make_post(author, 'Post')
+    write_behind.like(fan.uid, post.uid)
+    write_behind.unlike(fan.uid, post.uid)
+    write_behind.like(fan.uid, post.uid, POST)
+    assert write_behind.flush() == 1
+    assert _like_count(Post, post.uid) == 1
+    write_behind.like(fan.uid, post.uid)
+    write_behind.flush()
+    assert _like_count(Post, post.uid) == 1
+
+
+def test_write_behind_is_per_app(app, make_user, make_post):
+    other = create_app('testing')
+    other.config['LIKES_WRITE_BEHIND'] = True
+    other.extensions['likes'].thread = object()
+    with other.app_context():
+        assert likes.like(1, 1) is None
+    author = make_user()
+    post = make_post(author, 'Post')
+    assert likes.like(author.uid, post.uid) is True
+    assert list(other.extensions['likes'].pending) == [(POST, 1, 1)]
+    assert not app.extensions['likes'].pending
@@ -0,0 +1,96 @@
+import smtplib
+import socket
+from datetime import datetime
+
+import pytest
+
+from app import mail as mail_module
+from app.mail import mail_queue
+from app.models import QueuedMail
+
+
+class _Connection(object):
+
+    def __init__(self, error=None):
+        self.error = error
+        self.sent = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def send(self, message):
+        if self.error is not None:
+            raise self.error
+        self.sent.append(message)
+
+
+@pytest.fixture
+def smtp(monkeypatch):
+    connection = _Connection()
+    monkeypatch.setattr(mail_module.mailer, 'connect', lambda: connection)
+    return connection
+
+
+def _queued():
+    return QueuedMail.query.one()
+
+
+def test_queued_mail_is_sent_once(app, smtp):
+    mail_queue.enqueue('bob@example.com', 'Hello', body='hi')
+    assert mail_queue.drain() == 1
+    assert [message.recipients for message in smtp.sent] == [['bob@example.com']]
+    assert _queued().sent_at is not None
+    assert mail_queue.drain() == 0
+
+
+def test_rejected_mail_uses_up_attempts(app, smtp):
+    smtp.error = smtplib.SMTPRecipientsRefused({'bob@example.com': (550, b'no such user')})
+    mail_queue.enqueue('bob@example.com', 'Hello', body='hi')
+    assert mail_queue.drain() == 0
+    mail = _queued()
+    assert mail.attempts == 1 and mail.sent_at is None and mail.next_attempt_at > datetime.now()
+
+
+def test_abandoned_mail_is_logged(app, smtp, caplog):
+    app.config['MAIL_QUEUE_MAX_ATTEMPTS'] = 1
+    smtp.error = smtplib.SMTPDataError(554, b'rejected')
+    mail_queue.enqueue('bob@example.com', 'Hello', body='hi')
+    mail_queue.drain()
+    assert 'Giving up on mail' in caplog.text
+
+
+@pytest.mark.parametrize('error', [socket.error('connection refused'), smtplib.SMTPServerDisconnected()])
+def test_outages_do_not_use_up_attempts(app, monkeypatch, error):
+    def connect():
+        raise error
+    monkeypatch.setattr(mail_module.mailer, 'connect', connect)
+    mail_queue.enqueue('bob@example.com', 'Hello', body='hi')
+    for _ in range(app.config['MAIL_QUEUE_MAX_ATTEMPTS'] + 1):
+        QueuedMail.query.update(dict(next_attempt_at=datetime(2000, 1, 1)))
+        mail_module.db.session.commit()
+        assert mail_queue.drain() == 0
+    mail = _queued()
+    assert mail.attempts == 0 and mail.claimed_by is None and mail.next_attempt_at > datetime.now()
+
+
+def test_refused_login_uses_up_attempts(app, monkeypatch, caplog):
+    def connect():
+        raise smtplib.SMTPAuthenticationError(535, b'bad credentials')
+    monkeypatch.setattr(mail_module.mailer, 'connect', connect)
+    mail_queue.enqueue('bob@example.com', 'Hello', body='hi')
+    for _ in range(app.config['MAIL_QUEUE_MAX_ATTEMPTS']):
+        QueuedMail.query.update(dict(next_attempt_at=datetime(2000, 1, 1)))
+        mail_module.db.session.commit()
+        assert mail_queue.drain() == 0
+    assert _queued().attempts == app.config['MAIL_QUEUE_MAX_ATTEMPTS']
+    assert 'Giving up on mail' in caplog.text
+
+
+def test_other_smtp_answers_are_not_outages(app, smtp):
+    smtp.error = smtplib.SMTPHeloError(501, b'bad helo')
+    mail_queue.enqueue('bob@example.com', 'Hello', body='hi')
+    mail_queue.drain()
+    assert _queued().attempts == 1
@@ -0,0 +1,64 @@
+from datetime import datetime
+
+from app.models import Post
+from app.pagination import encode_cursor, decode_cursor, paginate
+
+
+def test_cursor_round_trip():
+    stamp = datetime(2018, 7, 4, 13, 5, 9, 123456)
+    assert decode_cursor(encode_cursor(stamp, 42)) == (stamp, 42)
+
+
+def test_malformed_cursor_is_ignored():
+    for cursor in ('', 'garbage', '20180704.x', '2018.1', None):
+        assert decode_cursor(cursor) is None
+
+
+def _titles(page):
+    return [post.title for post in page.items]
+
+
+def test_pages_walk_every_post_once(make_user, make_post):
+    author = make_user()
+    # ties on created_at are broken by uid
+    stamp = datetime(2018, 1, 1)
+    for n in range(7):
+        make_post(author, 'Post %d' % n, created_at=stamp if n in (2, 3, 4) else datetime(2018, 1, 1 + n))
+    pages = [paginate(Post.query, Post, 3)]
+    while pages[-1].has_next:
+        pages.append(paginate(Post.query, Post, 3, after=pages[-1].next_cursor))
+    assert [_titles(page) for page in pages] == [
+        ['Post 6', 'Post 5', 'Post 1'], ['Post 4', 'Post 3', 'Post 2'], ['Post 0']]
+    assert not pages[0].has_prev and pages[1].has_prev and pages[2].has_prev
+
+
+def test_paging_back_returns_the_same_page(make_user, make_post):
+    author = make_user()
+    for n in range(5):
+        make_post(author, 'Post %d' % n, created_at=datetime(2018, 1, 1 + n))
+    first = paginate(Post.query, Post, 2)
+    second = paginate(Post.query, Post, 2, after=first.next_cursor)
+    back = paginate(Post.query, Post, 2, before=second.prev_cursor)
+    assert _titles(back) == _titles(first) == ['Post 4', 'Post 3']
+    assert back.has_next and not back.has_prev
+
+
+def test_last_page_boundary(make_user, make_post):
+    author = make_user()
+    for n in range(4):
+        make_post(author, 'Post %d' % n, created_at=datetime(2018, 1, 1 + n))
+    first = paginate(Post.query, Post, 2)
+    last = paginate(Post.query, Post, 2, after=first.next_cursor)
+    assert _titles(last) == ['Post 1', 'Post 0']
+    assert not last.has_next
+    empty = paginate(Post.query, Post, 2, after=encode_cursor(datetime(2018, 1, 1), 1))
+    assert empty.items == [] and not empty.has_next and not empty.has_prev
+
+
+def test_index_pages(client, make_user, make_post):
+    author = make_user()
+    for n in range(7):
+        make_post(author, 'Post %d' % n, created_at=datetime(2018, 1, 1 + n))
+    html = client.get('/').get_data(as_text=True)
+    assert 'Post 6' in html and 'Post 1' not in html
+    assert 'Older &rarr;' in html and '&larr; Newer' not in html
@@ -0,0 +1,66 @@
+import time
+
+import pytest
+
+from app import db
+from app.models import Permission, PermissionsVersion, Role
+from app.permissions import permission_registry
+
+from .conftest import login
+
+
+def _version():
+    return db.session.query(PermissionsVersion.version).scalar()
+
+
+def _role_id(name):
+    return db.session.query(Role.uid).filter_by(name=name).scalar()
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [time.monotonic()]
+    monkeypatch.setattr(time, 'monotonic', lambda: now[0])
+    return now
+
+
+def test_warm_registry_makes_no_queries(client, make_user):
+    make_user(role='moderator')
+    login(client)
+    assert client.get('/posts/create').status_code == 200
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+    db.event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        assert client.get('/posts/create').status_code == 200
+    finally:
+        db.event.remove(db.engine, 'before_cursor_execute', record)
+    assert not [statement for statement in statements if 'roles' in statement or 'permissions_version' in statement]
+
+
+def test_other_workers_changes_are_picked_up_after_the_interval(app, clock):
+    moderator = _role_id('moderator')
+    assert permission_registry.can(moderator, Permission.PUBLISH)
+    # what another worker's commit looks like from here, no local invalidation
+    db.session.execute(Role.__table__.update().where(Role.uid == moderator).values(permissions=Permission.LIKE))
+    db.session.execute(PermissionsVersion.__table__.update().values(version=PermissionsVersion.version + 1))
+    db.session.commit()
+    assert permission_registry.can(moderator, Permission.PUBLISH)
+    clock[0] += app.config['PERMISSIONS_CHECK_INTERVAL']
+    assert not permission_registry.can(moderator, Permission.PUBLISH)
+
+
+def test_role_changes_bump_the_version(app):
+    before = _version()
+    db.session.execute(Role.__table__.update().values(permissions=0))
+    db.session.commit()
+    Role.populate()
+    assert _version() > before
+    assert permission_registry.can(_role_id('user'), Permission.COMMENT)
+
+
+def test_users_are_checked_through_the_registry(make_user):
+    user = make_user()
+    assert user.can(Permission.COMMENT) and not user.can(Permission.PUBLISH)
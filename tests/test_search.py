@@ -0,0 +1,61 @@
+from app import db
+from app.models import Post
+from app.search import search_posts, match_expression, rebuild_index
+
+
+def _found(text):
+    return [hit.post.title for hit in search_posts(text, 10).items]
+
+
+def test_match_expression_prefix_matches_every_word():
+    assert match_expression('Flask, sqlite!') == '"Flask"* "sqlite"*'
+    assert match_expression('  ...  ') == ''
+
+
+def test_index_follows_inserts_updates_and_deletes(make_user, make_post):
+    author = make_user()
+    post = make_post(author, 'Keyset paging', 'cursors instead of offsets')
+    make_post(author, 'Unrelated', 'nothing to see')
+    assert _found('cursor') == ['Keyset paging']
+
+    post.body = 'bm25 ranking'
+    db.session.commit()
+    assert _found('cursor') == []
+    assert _found('ranking') == ['Keyset paging']
+
+    db.session.delete(post)
+    db.session.commit()
+    assert _found('ranking') == []
+
+
+def test_title_matches_rank_first(make_user, make_post):
+    author = make_user()
+    make_post(author, 'About gardens', 'python python python')
+    make_post(author, 'Python tips', 'short')
+    assert _found('python') == ['Python tips', 'About gardens']
+
+
+def test_snippet_marks_hits_and_escapes_the_rest(make_user, make_post):
+    author = make_user()
+    make_post(author, 'Markup', '<b>sqlite</b> text')
+    snippet = str(search_posts('sqlite', 10).items[0].snippet)
+    assert '<mark>sqlite</mark>' in snippet and '&lt;b&gt;' in snippet
+
+
+def test_rebuild_index_catches_up_with_plain_sql(make_user, make_post):
+    author = make_user()
+    post = make_post(author, 'Old title')
+    db.session.execute(Post.__table__.update().where(Post.uid == post.uid).values(title='New title'))
+    db.session.commit()
+    assert _found('new') == []
+    rebuild_index()
+    assert _found('new') == ['New title']
+
+
+def test_blank_searches_list_every_post(client, make_user, make_post):
+    author = make_user()
+    make_post(author, 'First')
+    make_post(author, 'Second')
+    for q in ('', '  ', '?!'):
+        html = client.get('/?q=' + q).get_data(as_text=True)
+        assert 'No posts found' not in html and 'First' in html and 'Second' in html
@@ -0,0 +1,49 @@
+from itsdangerous import Signer
+
+from app import db
+from app.tokens import tokens, _Signer
+
+
+def test_signers_are_cached_and_derive_their_key_once(app, monkeypatch):
+    token = tokens.generate(1, 'role')
+    serializer = tokens._serializer(app.config['SECRET_KEY'], 'role', app.config['TOKEN_EXPIRATION'])
+    signer = serializer.make_signer('role', serializer.algorithm)
+    assert isinstance(signer, _Signer)
+    assert serializer.make_signer('role', serializer.algorithm) is signer
+
+    derived = []
+    original = Signer.derive_key
+    monkeypatch.setattr(Signer, 'derive_key', lambda self: derived.append(1) or original(self))
+    fresh = serializer.make_signer('other', serializer.algorithm)
+    for _ in range(3):
+        fresh.sign(b'payload')
+    assert len(derived) == 1
+    assert tokens.verify(token, 'role') == 1
+
+
+def test_roles_do_not_mix(app):
+    token = tokens.generate(1, 'account-activation')
+    assert tokens.verify(token, 'account-recovery') is None
+    assert tokens.verify(token + b'x', 'account-activation') is None
+
+
+def test_old_keys_are_accepted_after_rotation(app):
+    token = tokens.generate(1, 'role')
+    app.config.update(SECRET_KEY='rotated', OLD_SECRET_KEYS=(app.config['SECRET_KEY'],))
+    assert tokens.verify(token, 'role') == 1
+    app.config['OLD_SECRET_KEYS'] = ()
+    assert tokens.verify(token, 'role') is None
+
+
+def test_expired_tokens_are_refused(app):
+    assert tokens.verify(tokens.generate(1, 'role', expiration=-1), 'role') is None
+
+
+def test_tokens_are_single_use_once_committed(app):
+    token = tokens.generate(1, 'role')
+    assert tokens.consume(token, 'role') == 1
+    db.session.rollback()
+    assert tokens.consume(token, 'role') == 1
+    db.session.commit()
+    assert tokens.consume(token, 'role') is None
+    assert tokens.verify(token, 'role') == 1
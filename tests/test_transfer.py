@@ -0,0 +1,72 @@
+from datetime import datetime
+
+import pytest
+
+from app import db, transfer
+from app.models import Role, User, Post, Comment
+from app.search import search_posts
+
+
+def _snapshot():
+    users = dict((user.uid, user.username) for user in User.query)
+    posts = dict((post.uid, post.title) for post in Post.query)
+    comments = dict((comment.uid, comment.body) for comment in Comment.query)
+    return dict(
+        users=sorted((user.username, user.email, user.password_hash, user.activated, user.role.name,
+                      user.created_at) for user in User.query),
+        posts=sorted((post.title, post.body, users[post.author_id], post.created_at, post.comment_count)
+                     for post in Post.query),
+        comments=sorted((comment.body, posts[comment.post_id], users[comment.author_id],
+                         comments.get(comment.parent_id), comment.reply_count) for comment in Comment.query))
+
+
+@pytest.fixture
+def blog(make_user, make_post):
+    alice, bob = make_user(), make_user('bob', activated=False, role='moderator')
+    first = make_post(alice, 'First post', 'about sqlite', created_at=datetime(2018, 3, 1, 12, 30, 15, 250))
+    make_post(bob, 'Second post', 'line one\nline two, "quoted"', created_at=datetime(2018, 4, 2))
+    top = Comment(body='top', author_id=bob.uid, post_id=first.uid)
+    db.session.add(top)
+    db.session.commit()
+    db.session.add(Comment(body='reply', author_id=alice.uid, post_id=first.uid, parent_id=top.uid))
+    db.session.commit()
+
+
+@pytest.mark.parametrize('fmt', transfer.FORMATS)
+def test_round_trip(blog, tmpdir, fmt):
+    before = _snapshot()
+    counts = transfer.export(str(tmpdir), fmt, batch_size=1)
+    assert counts == dict(users=2, posts=2, comments=2)
+
+    db.session.remove()
+    db.drop_all()
+    db.create_all()
+    Role.populate()
+    results = transfer.import_(str(tmpdir), fmt, batch_size=1)
+    assert results['users']['created'] == 2 and results['posts']['created'] == 2
+    assert results['comments'] == dict(created=2, skipped=0, orphaned=0)
+    assert _snapshot() == before
+    assert [hit.post.title for hit in search_posts('sqlite', 10).items] == ['First post']
+
+
+def test_existing_users_and_posts_are_not_duplicated(blog, tmpdir):
+    transfer.export(str(tmpdir))
+    results = transfer.import_(str(tmpdir), kinds=('users', 'posts'))
+    assert results['users'] == dict(created=0, existing=2, skipped=0)
+    assert results['posts'] == dict(created=0, existing=2, skipped=0)
+    assert User.query.count() == 2 and Post.query.count() == 2
+
+
+def test_replies_before_their_parent_are_adopted(app, tmpdir, make_user, make_post):
+    make_post(make_user(), 'Post')
+    with open(transfer.path_for(str(tmpdir), 'comments', 'jsonl'), 'w') as f:
+        f.write('{"id": 2, "post": 1, "parent": 1, "author": 1, "body": "reply", "created_at": null}\n'
+                '{"id": 1, "post": 1, "parent": null, "author": 1, "body": "top", "created_at": null}\n'
+                '{"id": 3, "post": 1, "parent": 99, "author": 1, "body": "lost", "created_at": null}\n')
+    importer = transfer._Importer(10)
+    importer.ids['users'][1], importer.ids['posts'][1] = 1, 1
+    with open(transfer.path_for(str(tmpdir), 'comments', 'jsonl')) as f:
+        stats = importer.comments(transfer._read_jsonl(f))
+    assert stats == dict(created=3, skipped=0, orphaned=1)
+    reply = Comment.query.filter_by(body='reply').one()
+    assert reply.parent_id == Comment.query.filter_by(body='top').one().uid
@@ -0,0 +1,87 @@
+import time
+from datetime import datetime
+
+import pytest
+
+from app import db
+from app.cache import MemoryBackend, page_cache
+from app.likes import likes
+from app.models import Comment, TrendingScore, TrendingEpoch
+from app.trending import trending, _EPOCH_ROW, _REBASE_AFTER
+
+
+@pytest.fixture
+def half_life(app):
+    return app.config['TRENDING_HALF_LIFE']
+
+
+def _scores():
+    return dict(db.session.query(TrendingScore.post_id, TrendingScore.score))
+
+
+def test_top_is_ordered_by_decayed_score(make_user, make_post, half_life):
+    author = make_user()
+    old, new = make_post(author, 'Old'), make_post(author, 'New')
+    trending.record(old.uid, 3, datetime.fromtimestamp(time.time() - 2 * half_life))
+    trending.record(new.uid, 1)
+    db.session.commit()
+    assert [title for _, title, _ in trending.top()] == ['New', 'Old']
+    assert [round(score, 3) for _, _, score in trending.top()] == [1, 0.75]
+
+
+def test_decay_rebases_once(make_user, make_post, half_life):
+    post_id = make_post(make_user(), 'Post').uid
+    trending.record(post_id, 1)
+    db.session.query(TrendingEpoch).filter_by(uid=_EPOCH_ROW).update(dict(epoch=TrendingEpoch.epoch - half_life))
+    db.session.commit()
+    assert trending.decay() == 0
+    assert round(_scores()[post_id], 3) == 0.5
+    trending.decay()
+    assert round(_scores()[post_id], 3) == 0.5
+
+
+def test_unlike_of_an_old_like_drops_the_score(make_user, make_post, half_life):
+    post_id = make_post(make_user(), 'Post').uid
+    trending.record(post_id, 1, datetime.fromtimestamp(time.time() - 3 * half_life))
+    trending.record(post_id, -1)
+    db.session.commit()
+    assert _scores() == {}
+    assert trending.top() == []
+
+
+def test_records_rebase_a_stale_epoch(make_user, make_post, half_life):
+    author = make_user()
+    faded, kept = make_post(author, 'Faded').uid, make_post(author, 'Kept').uid
+    trending.record(faded, 1)
+    db.session.query(TrendingEpoch).filter_by(uid=_EPOCH_ROW).update(dict(epoch=time.time() - 2000 * half_life))
+    db.session.commit()
+    trending.record(kept, 1)
+    db.session.commit()
+    assert db.session.query(TrendingEpoch.epoch).scalar() > time.time() - _REBASE_AFTER * half_life
+    assert list(_scores()) == [kept]
+
+
+def test_rebuild_counts_comments_and_likes(make_user, make_post):
+    author = make_user()
+    quiet, busy = make_post(author, 'Quiet'), make_post(author, 'Busy')
+    db.session.add(Comment(body='hi', author_id=author.uid, post_id=busy.uid))
+    quiet.likes.append(author)
+    db.session.commit()
+    db.session.query(TrendingScore).delete()
+    db.session.commit()
+    assert trending.rebuild() == 2
+    assert [title for _, title, _ in trending.top()] == ['Busy', 'Quiet']
+
+
+def test_cached_index_shows_new_likes(client, make_user, make_post, monkeypatch):
+    monkeypatch.setattr(page_cache, 'backend', MemoryBackend())
+    post_id = make_post(make_user(), 'Liked post').uid
+    reader_id = make_user('bob').uid
+    rv = client.get('/')
+    assert 'Liked post</a></li>' not in rv.get_data(as_text=True)
+    assert 'Liked post' not in client.get('/trending').get_data(as_text=True)
+    likes.like(reader_id, post_id)
+    rv2 = client.get('/', headers={'If-None-Match': rv.headers['ETag']})
+    assert rv2.status_code == 200 and rv2.headers['ETag'] != rv.headers['ETag']
+    assert 'Liked post</a></li>' in rv2.get_data(as_text=True)
+    assert 'Liked post' in client.get('/trending').get_data(as_text=True)
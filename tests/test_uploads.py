@@ -0,0 +1,54 @@
+import io
+import os
+
+import pytest
+from PIL import Image
+from werkzeug.exceptions import RequestEntityTooLarge
+
+from app.images import profile_pictures, thumbnail_name
+from app.uploads import receive, sniff
+
+
+def _png(size=(300, 200)):
+    out = io.BytesIO()
+    Image.new('RGB', size, 'red').save(out, 'PNG')
+    return out.getvalue()
+
+
+def test_sniff():
+    assert sniff(b'\xff\xd8\xff\xe0') == 'jpg'
+    assert sniff(_png()) == 'png'
+    assert sniff(b'GIF89a') is None
+
+
+def test_identical_uploads_get_their_own_source(tmpdir):
+    data = _png()
+    first = receive(io.BytesIO(data), str(tmpdir), len(data), chunk_size=100)
+    second = receive(io.BytesIO(data), str(tmpdir), len(data))
+    assert first.digest == second.digest and first.size == len(data) and first.kind == 'png'
+    assert first.path != second.path
+    os.remove(first.path)
+    with open(second.path, 'rb') as f:
+        assert f.read() == data
+
+
+@pytest.mark.parametrize('data, error', [
+    (b'GIF89a' + b'\0' * 10, ValueError),
+    (b'', ValueError),
+    (b'\xff\xd8\xff' + b'\0' * 100, RequestEntityTooLarge),
+])
+def test_refused_uploads_leave_nothing_behind(tmpdir, data, error):
+    with pytest.raises(error):
+        receive(io.BytesIO(data), str(tmpdir), 50, chunk_size=10)
+    assert tmpdir.listdir() == []
+
+
+def test_thumbnails_replace_the_source(app):
+    digest = profile_pictures.save(1, io.BytesIO(_png()))
+    directory = app.config['FILE_UPLOAD_PATH']
+    assert sorted(os.listdir(directory)) == sorted(thumbnail_name(digest, size)
+                                                   for size in app.config['PROFILE_PIC_SIZES'])
+    with Image.open(os.path.join(directory, thumbnail_name(digest, 64))) as thumbnail:
+        assert thumbnail.size == (64, 64) and thumbnail.format == 'JPEG'
+    # the owner is part of the digest
+    assert profile_pictures.save(2, io.BytesIO(_png())) != digest